@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import os
+import requests
+import uuid
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# Get the backend URL from the frontend .env file
+BACKEND_URL = None
+try:
+    with open('/app/frontend/.env', 'r') as f:
+        for line in f:
+            if line.startswith('REACT_APP_BACKEND_URL='):
+                BACKEND_URL = line.strip().split('=')[1].strip('"\'')
+                break
+except Exception as e:
+    print(f"Error reading .env file: {e}")
+    sys.exit(1)
+
+if not BACKEND_URL:
+    print("Could not find REACT_APP_BACKEND_URL in .env file")
+    sys.exit(1)
+
+API_URL = f"{BACKEND_URL}/api"
+print(f"Using API URL: {API_URL}")
+
+# Unique user so the test never touches real data
+TEST_USER_ID = f"test_user_cache_{uuid.uuid4()}"
+
+headers = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {TEST_USER_ID}"
+}
+
+# Cache stats are admin-only: the server must list this uid in ADMIN_USERS
+ADMIN_USER_ID = os.environ.get("ADMIN_USER_ID")
+if not ADMIN_USER_ID:
+    print("Set ADMIN_USER_ID to a uid listed in the server's ADMIN_USERS")
+    sys.exit(1)
+
+PARALLEL_REQUESTS = 20
+
+def print_separator(title):
+    """Print a separator with a title for better readability"""
+    print("\n" + "="*80)
+    print(f" {title} ".center(80, "="))
+    print("="*80 + "\n")
+
+def cache_stats():
+    response = requests.get(f"{API_URL}/admin/cache-stats", headers={"Authorization": f"Bearer {ADMIN_USER_ID}"})
+    response.raise_for_status()
+    return response.json()["analytics"]
+
+def get_analytics(capital_id):
+    return requests.get(f"{API_URL}/analytics/{capital_id}", headers=headers)
+
+def test_coalescing(capital_id):
+    """Identical concurrent analytics requests must trigger at most one computation"""
+    print_separator("TESTING CONCURRENT ANALYTICS REQUESTS")
+
+    before = cache_stats()
+    with ThreadPoolExecutor(max_workers=PARALLEL_REQUESTS) as pool:
+        responses = list(pool.map(lambda _: get_analytics(capital_id), range(PARALLEL_REQUESTS)))
+    after = cache_stats()
+
+    if any(r.status_code != 200 for r in responses):
+        print("❌ Some analytics requests failed")
+        return False
+    if len({r.text for r in responses}) != 1:
+        print("❌ Concurrent requests returned different analytics")
+        return False
+
+    misses = after["misses"] - before["misses"]
+    served = (after["hits"] - before["hits"]) + (after["coalesced"] - before["coalesced"])
+    print(f"misses: {misses}, hits + coalesced: {served}")
+    # Several workers each keep their own cache, so allow one miss per worker
+    if misses + served != PARALLEL_REQUESTS or served == 0:
+        print("❌ Requests were not served from the cache")
+        return False
+    print("✅ Concurrent requests shared the computation")
+    return True
+
+def test_invalidation(capital_id):
+    """A write must make the next analytics read reflect it"""
+    print_separator("TESTING INVALIDATION ON WRITE")
+
+    before = get_analytics(capital_id).json()
+    response = requests.post(f"{API_URL}/expenses", headers=headers, json={
+        "capital_id": capital_id,
+        "amount": 250.0,
+        "description": "Cache invalidation test"
+    })
+    if response.status_code != 200:
+        print(f"❌ Error creating expense: {response.status_code} - {response.text}")
+        return False
+
+    after = get_analytics(capital_id).json()
+    if abs(after["total_expenses"] - before["total_expenses"] - 250.0) > 0.001:
+        print(f"❌ Stale analytics: total_expenses {before['total_expenses']} -> {after['total_expenses']}")
+        return False
+    print(f"✅ total_expenses updated {before['total_expenses']} -> {after['total_expenses']}")
+    return True
+
+if __name__ == "__main__":
+    response = requests.post(f"{API_URL}/capitals", headers=headers, json={
+        "name": "Cache test capital",
+        "balance": 10000.0
+    })
+    if response.status_code != 200:
+        print(f"❌ Error creating capital: {response.status_code} - {response.text}")
+        sys.exit(1)
+    capital_id = response.json()["id"]
+
+    try:
+        success = test_coalescing(capital_id) and test_invalidation(capital_id)
+    finally:
+        requests.delete(f"{API_URL}/capitals/{capital_id}", headers=headers)
+    sys.exit(0 if success else 1)
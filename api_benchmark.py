@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""API benchmark suite: runs backend.server:app in-process against a local mongod.
+
+Seeds a portfolio of the requested size through the API, then measures each
+scenario with an ASGI client (no network, no uvicorn) and prints p50/p95/p99
+latency and throughput as JSON, so runs can be compared across commits:
+
+    MONGO_URL=mongodb://localhost:27017 DB_NAME=crm_bench MONGO_TLS=false \\
+        python api_benchmark.py --clients 5000 --output before.json
+    ... python api_benchmark.py --clients 5000 --compare before.json
+
+Use a replica set (mongod --replSet rs0) to include transactions in the numbers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+# Фоновые задачи не должны искажать замеры
+os.environ.setdefault("NIGHTLY_JOBS", "false")
+
+import httpx
+
+from backend import server
+
+SCENARIOS = ["clients", "clients_summary", "dashboard", "analytics", "payment_status", "bulk_clients"]
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def to_ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+def summarize(latencies, elapsed, errors):
+    # Без замеров (нулевое число запросов) процентили остаются null
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": to_ms(percentile(latencies, 0.50)),
+        "p95_ms": to_ms(percentile(latencies, 0.95)),
+        "p99_ms": to_ms(percentile(latencies, 0.99)),
+        "max_ms": to_ms(latencies[-1] if latencies else None),
+    }
+
+def client_rows(count, months):
+    """Import rows whose schedules hit overdue, today and tomorrow buckets"""
+    today = date.today()
+    rows = []
+    for i in range(count):
+        start = today - timedelta(days=random.randrange(0, max(1, 30 * months)))
+        monthly = float(random.choice([1000, 2500, 5000]))
+        rows.append({
+            "name": f"Бенчмарк клиент {i}",
+            "product": random.choice(["Телефон", "Ноутбук", "Телевизор"]),
+            "purchase_amount": monthly * months * 0.8,
+            "debt_amount": monthly * months,
+            "monthly_payment": monthly,
+            "start_date": start.strftime("%Y-%m-%d"),
+            "months": months,
+        })
+    return rows
+
+async def seed(http, capital_id, clients, months):
+    chunk = min(server.MAX_BULK_CLIENTS, 500)
+    for offset in range(0, clients, chunk):
+        rows = client_rows(min(chunk, clients - offset), months)
+        response = await http.post("/api/clients/bulk", json={
+            "capital_id": capital_id, "clients": rows, "offset": offset
+        })
+        response.raise_for_status()
+
+async def run_scenario(make_request, requests_count, concurrency):
+    latencies = []
+    errors = 0
+    counter = iter(range(requests_count))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            response = await make_request(i)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def main(args):
+    random.seed(args.seed)
+    await server.ensure_indexes()
+    headers = {"Authorization": f"Bearer bench_user_{uuid.uuid4()}"}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers, timeout=None) as http:
+        response = await http.post("/api/capitals", json={"name": "Benchmark capital", "balance": 10.0 ** 12})
+        response.raise_for_status()
+        capital_id = response.json()["id"]
+        try:
+            seeded = time.perf_counter()
+            await seed(http, capital_id, args.clients, args.months)
+            seed_seconds = time.perf_counter() - seeded
+
+            page = await http.get("/api/clients", params={"capital_id": capital_id, "limit": 200})
+            targets = [(c["client_id"], c["schedule"][0]["payment_date"]) for c in page.json() if c["schedule"]]
+
+            scenarios = {
+                "clients": lambda i: http.get("/api/clients", params={"capital_id": capital_id, "limit": args.page_size}),
+                "clients_summary": lambda i: http.get(
+                    "/api/clients", params={"capital_id": capital_id, "limit": args.page_size, "view": "summary"}
+                ),
+                "dashboard": lambda i: http.get("/api/dashboard", params={"capital_id": capital_id}),
+                "analytics": lambda i: http.get(f"/api/analytics/{capital_id}"),
+                "payment_status": lambda i: http.put(
+                    f"/api/clients/{targets[i % len(targets)][0]}/payments/{targets[i % len(targets)][1]}",
+                    json={"status": "paid" if (i // len(targets)) % 2 == 0 else "pending"}
+                ),
+                "bulk_clients": lambda i: http.post("/api/clients/bulk", json={
+                    "capital_id": capital_id, "clients": client_rows(args.bulk_size, args.months)
+                }),
+            }
+            results = {}
+            for name in args.scenario or SCENARIOS:
+                if name == "payment_status" and not targets:
+                    # При --months 0 у клиентов нет платежей, менять статус нечему
+                    print(f"{name}: skipped, no scheduled payments", file=sys.stderr)
+                    results[name] = None
+                    continue
+                count = args.requests if name != "bulk_clients" else max(1, args.requests // 10)
+                results[name] = await run_scenario(scenarios[name], count, args.concurrency)
+                print(f"{name}: {results[name]}", file=sys.stderr)
+        finally:
+            await http.delete(f"/api/capitals/{capital_id}")
+    server.client.close()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "clients": args.clients,
+            "months": args.months,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "page_size": args.page_size,
+            "seed_seconds": round(seed_seconds, 2),
+            "transactions": server._transactions_supported,
+        },
+        "results": results,
+    }
+    return report
+
+def compare(report, baseline):
+    print("\nscenario            p50 ms (base)     p95 ms (base)     rps (base)", file=sys.stderr)
+    for name, result in report["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not result:
+            continue
+        # str(): у сценария без замеров значения null
+        print(
+            f"{name:<18} {str(result['p50_ms']):>7} ({str(base['p50_ms']):>7}) "
+            f"{str(result['p95_ms']):>7} ({str(base['p95_ms']):>7}) "
+            f"{str(result['throughput_rps']):>7} ({str(base['throughput_rps']):>7})",
+            file=sys.stderr
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=2000, help="portfolio size to seed")
+    parser.add_argument("--months", type=int, default=12, help="installments per client")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--page-size", type=int, default=1000, help="limit for /api/clients")
+    parser.add_argument("--bulk-size", type=int, default=100, help="clients per bulk request")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="run only these scenarios")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
@@ -1,34 +1,451 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Header
+from fastapi import (
+    FastAPI, APIRouter, Depends, HTTPException, status, Header, Query, Request, Response, UploadFile, File, Form
+)
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import re
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Any, Dict
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Any, AsyncIterator, Dict, Iterable, Iterator, Sequence, Set, Tuple, Union
 import uuid
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, timedelta, timezone
 from enum import Enum
 import json
+import csv
+from decimal import Decimal, ROUND_HALF_UP
+import io
+import tempfile
+import base64
+import hashlib
+from email.utils import format_datetime
 from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from pymongo import monitoring
+import asyncio
+import bisect
+import contextvars
+import random
+import sys
+import threading
+import time
+from collections import deque
 import certifi
+import numpy as np
+import orjson
+import openpyxl
+from openpyxl.utils.datetime import from_excel
+from cachetools import LRUCache, TTLCache
 
 # Загружаем .env сразу!
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics
+# Метрики в текстовом формате Prometheus на /metrics. Реестр свой, без
+# prometheus_client: нужны только счётчики, gauge и гистограммы. Команды
+# MongoDB pymongo выполняет в потоках motor, поэтому метрики защищены локом.
+METRICS_ENABLED = os.environ.get('METRICS', 'true').lower() != 'false'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+    def set(self, labels: Tuple[str, ...], value: float) -> None:
+        with self.lock:
+            self.values[labels] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.series: Dict[Tuple[str, ...], List[float]] = {}  # counts per bucket + [+Inf, sum]
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            snapshot = sorted((labels, list(series)) for labels, series in self.series.items())
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors = []  # Функции, обновляющие gauge перед выдачей
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            collect()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+http_requests_total = metrics.register(Counter(
+    "http_requests_total", "HTTP requests by route, method and status", ("method", "route", "status")
+))
+http_request_duration = metrics.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route")
+))
+http_response_size = metrics.register(Histogram(
+    "http_response_size_bytes", "HTTP response body size", ("method", "route"), buckets=SIZE_BUCKETS
+))
+http_requests_in_flight = metrics.register(Gauge(
+    "http_requests_in_flight", "HTTP requests being processed", ("method",)
+))
+mongo_commands_total = metrics.register(Counter(
+    "mongo_commands_total", "MongoDB commands by collection, command and outcome", ("collection", "command", "outcome")
+))
+mongo_command_duration = metrics.register(Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("collection", "command")
+))
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Count and time every MongoDB command by collection and operation"""
+
+    def __init__(self):
+        self.pending: Dict[Tuple[Any, int], Tuple[str, str]] = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        collection = target if isinstance(target, str) else "-"
+        self.pending[(event.connection_id, event.request_id)] = (collection, event.command_name)
+
+    def _finished(self, event, outcome: str):
+        labels = self.pending.pop((event.connection_id, event.request_id), ("-", event.command_name))
+        mongo_commands_total.inc(labels + (outcome,))
+        mongo_command_duration.observe(labels, event.duration_micros / 1_000_000)
+
+    def succeeded(self, event):
+        self._finished(event, "success")
+
+    def failed(self, event):
+        self._finished(event, "failure")
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route counts, latency, sizes and in-flight requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method = scope["method"]
+        status_code = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        http_requests_in_flight.inc((method,))
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight.dec((method,))
+            # Шаблон пути, а не сам путь: иначе id клиентов раздуют число серий
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            http_requests_total.inc((method, route_path, str(status_code)))
+            http_request_duration.observe((method, route_path), elapsed)
+            http_response_size.observe((method, route_path), size)
+
+# Slow requests
+# Запросы дольше SLOW_REQUEST_MS попадают в кольцевой буфер (/api/admin/slow-requests)
+# и в лог вместе с командами MongoDB, которые они выполнили. Доля запросов
+# SLOW_REQUEST_PROFILE_RATE дополнительно профилируется семплированием стека.
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '1000'))
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '500'))
+SLOW_REQUEST_BUFFER = int(os.environ.get('SLOW_REQUEST_BUFFER', '200'))
+SLOW_REQUEST_PROFILE_RATE = float(os.environ.get('SLOW_REQUEST_PROFILE_RATE', '0'))
+SLOW_REQUEST_PROFILE_INTERVAL = float(os.environ.get('SLOW_REQUEST_PROFILE_INTERVAL', '0.005'))
+MAX_TRACED_COMMANDS = 500
+PROFILE_STACK_DEPTH = 40
+
+slow_logger = logging.getLogger(__name__ + ".slow")
+slow_requests: deque = deque(maxlen=SLOW_REQUEST_BUFFER)
+
+class RequestTrace:
+    """What one request did: user, MongoDB commands and an optional stack profile"""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.user: Optional[str] = None
+        self.commands: List[Dict[str, Any]] = []
+        self.dropped_commands = 0
+        self.profile: Optional[Dict[str, int]] = None
+
+    def add_command(self, command: Dict[str, Any]) -> None:
+        if len(self.commands) < MAX_TRACED_COMMANDS:
+            self.commands.append(command)
+        else:
+            self.dropped_commands += 1
+
+current_trace: contextvars.ContextVar = contextvars.ContextVar("current_trace", default=None)
+
+def reply_document_count(command_name: str, reply) -> Optional[int]:
+    cursor = reply.get("cursor") if isinstance(reply, dict) else None
+    if cursor:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+    if isinstance(reply, dict) and "n" in reply:
+        return reply["n"]
+    if command_name == "findAndModify" and isinstance(reply, dict):
+        return 1 if reply.get("value") is not None else 0
+    return None
+
+class MongoCommandTracer(monitoring.CommandListener):
+    """Attach MongoDB commands to the request that issued them and log slow ones.
+
+    motor runs pymongo in executor threads with a copy of the caller's context,
+    so current_trace is visible in started(); the trace is kept until the
+    matching succeeded/failed event.
+    """
+
+    def __init__(self):
+        self.pending: Dict[Tuple[Any, int], Tuple[Optional[RequestTrace], str]] = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        collection = target if isinstance(target, str) else "-"
+        self.pending[(event.connection_id, event.request_id)] = (current_trace.get(), collection)
+
+    def _finished(self, event, reply, error=None):
+        trace, collection = self.pending.pop((event.connection_id, event.request_id), (None, "-"))
+        duration_ms = event.duration_micros / 1000
+        command = {
+            "collection": collection,
+            "command": event.command_name,
+            "duration_ms": round(duration_ms, 2),
+            "docs": reply_document_count(event.command_name, reply),
+        }
+        if error is not None:
+            command["error"] = error
+        if trace is not None:
+            trace.add_command(command)
+        if duration_ms >= SLOW_QUERY_MS:
+            slow_logger.warning(json.dumps({"event": "slow_query", **command}, default=str))
+
+    def succeeded(self, event):
+        self._finished(event, event.reply)
+
+    def failed(self, event):
+        self._finished(event, None, error=str(event.failure.get("errmsg", event.failure)))
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def _thread_stack(frame) -> List[str]:
+    stack = []
+    while frame is not None and len(stack) < PROFILE_STACK_DEPTH:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    return stack[::-1]
+
+def _task_stack(task) -> List[str]:
+    """Chain of awaits of a suspended task, outermost first"""
+    stack = []
+    coro = task.get_coro()
+    while coro is not None and len(stack) < PROFILE_STACK_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        stack.append(_frame_label(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return stack
+
+class StackSampler:
+    """Samples where a request task is: running on the loop thread or awaiting.
+
+    Stacks are collapsed into "outer;...;inner" keys with sample counts, the
+    format flame graph tools read.
+    """
+
+    def __init__(self, task, loop, interval: float = SLOW_REQUEST_PROFILE_INTERVAL):
+        self.task = task
+        self.loop = loop
+        self.interval = interval
+        self.loop_thread = threading.get_ident()
+        self.samples: Dict[str, int] = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            if self.task.done():
+                break
+            try:
+                if asyncio.current_task(self.loop) is self.task:
+                    frame = sys._current_frames().get(self.loop_thread)
+                    stack = ["[running]"] + _thread_stack(frame)
+                else:
+                    stack = ["[awaiting]"] + _task_stack(self.task)
+            except (RuntimeError, ValueError):
+                continue  # стек поменялся во время чтения
+            key = ";".join(stack)
+            self.samples[key] = self.samples.get(key, 0) + 1
+
+    async def stop(self) -> Dict[str, int]:
+        self.stopped.set()
+        # Поток может ещё досыпать interval: ждём его вне цикла событий
+        await asyncio.to_thread(self.thread.join)
+        return dict(sorted(self.samples.items(), key=lambda item: -item[1]))
+
+class SlowRequestMiddleware:
+    """ASGI middleware tracing every request and keeping the slow ones"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        trace = RequestTrace(scope["method"], scope["path"])
+        token = current_trace.set(trace)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        sampler = None
+        if SLOW_REQUEST_PROFILE_RATE and random.random() < SLOW_REQUEST_PROFILE_RATE:
+            sampler = StackSampler(asyncio.current_task(), asyncio.get_running_loop())
+            sampler.start()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            current_trace.reset(token)
+            if sampler is not None:
+                trace.profile = await sampler.stop()
+            if elapsed_ms >= SLOW_REQUEST_MS:
+                record_slow_request(trace, scope, status_code, elapsed_ms)
+
+def record_slow_request(trace: RequestTrace, scope, status_code: int, elapsed_ms: float) -> None:
+    route = scope.get("route")
+    record = {
+        "event": "slow_request",
+        "at": datetime.utcnow().isoformat(),
+        "method": trace.method,
+        "route": getattr(route, "path", "unmatched"),
+        "path": trace.path,
+        "query": scope.get("query_string", b"").decode("latin-1"),
+        "status": status_code,
+        "user": trace.user,
+        "duration_ms": round(elapsed_ms, 2),
+        "mongo_ms": round(sum(c["duration_ms"] for c in trace.commands), 2),
+        "mongo_commands": trace.commands,
+        "dropped_commands": trace.dropped_commands,
+        "profile": trace.profile,
+    }
+    slow_requests.append(record)
+    slow_logger.warning(json.dumps(record, default=str, ensure_ascii=False))
+
 # Коннект к MongoDB
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(
-    mongo_url,
-    tls=True,
-    tlsCAFile=certifi.where()
-)
+# MONGO_TLS=false позволяет подключаться к локальному mongod без TLS
+mongo_tls = os.environ.get('MONGO_TLS', 'true').lower() != 'false'
+mongo_options = {"tls": mongo_tls}
+if mongo_tls:
+    mongo_options["tlsCAFile"] = certifi.where()
+mongo_options["event_listeners"] = [MongoCommandTracer()]
+if METRICS_ENABLED:
+    mongo_options["event_listeners"].append(MongoCommandMetrics())
+client = AsyncIOMotorClient(mongo_url, **mongo_options)
 db = client[os.environ['DB_NAME']]
 
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
 # Создаём FastAPI
-app = FastAPI(title="CRM Finance System", version="1.0.0")
+app = FastAPI(title="CRM Finance System", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Добавляем CORS (ТОЛЬКО ОДИН РАЗ!)
 app.add_middleware(
@@ -40,7 +457,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "ETag", "Last-Modified"],
 )
+app.add_middleware(SlowRequestMiddleware)
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 
 # Лог для отладки
 print("Running in demo mode without Firebase authentication")
@@ -65,6 +486,10 @@ class ClientStatus(str, Enum):
     completed = "completed"
     archived = "archived"
 
+class ClientView(str, Enum):
+    full = "full"
+    summary = "summary"  # Без графика и контактов, для списков
+
 class PaymentStatus(str, Enum):
     pending = "pending"
     paid = "paid"
@@ -74,7 +499,19 @@ class UserRole(str, Enum):
     admin = "admin"
     user = "user"
 
+class LedgerKind(str, Enum):
+    opening = "opening"  # Начальный баланс капитала
+    client_purchase = "client_purchase"
+    client_purchase_refund = "client_purchase_refund"
+    expense = "expense"
+    expense_refund = "expense_refund"
+    payment = "payment"
+    payment_reversal = "payment_reversal"
+    adjustment = "adjustment"  # Ручное изменение баланса
+    closing = "closing"  # Удаление капитала: остаток списывается, журнал остаётся
+
 # Models
+# Суммы в моделях - рубли, как в API; в базе они хранятся копейками (см. Money)
 class User(BaseModel):
     uid: str
     email: str
@@ -90,6 +527,8 @@ class Capital(BaseModel):
     balance: float = 0.0  # Баланс капитала
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = True
+    revision: int = 0  # Растёт при каждой записи по капиталу, для ETag
+    version: int = 0  # Растёт при каждой записи самого документа, для условных обновлений
 
 class PaymentSchedule(BaseModel):
     payment_date: str  # Changed from date to str for MongoDB compatibility
@@ -117,10 +556,13 @@ class Client(BaseModel):
     status: ClientStatus = ClientStatus.active
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    version: int = 0  # Растёт при каждой записи, для условных обновлений
     
     @property
     def effective_debt_amount(self) -> float:
-        """Get debt amount, falling back to total_amount for old data"""
+        """Debt amount, falling back to total_amount until the clients v1 migration completes"""
+        if "clients" in migrated_collections:
+            return self.debt_amount or 0
         return self.debt_amount or self.total_amount or 0
 
 class Expense(BaseModel):
@@ -141,6 +583,16 @@ class Payment(BaseModel):
     status: PaymentStatus = PaymentStatus.paid
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class LedgerEntry(BaseModel):
+    entry_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    capital_id: str
+    amount: float  # Со знаком: поступление > 0, списание < 0
+    kind: LedgerKind
+    ref_id: Optional[str] = None  # Клиент, расход или платёж, вызвавший движение
+    note: Optional[str] = None
+    entry_date: str = Field(default_factory=lambda: date.today().strftime("%Y-%m-%d"))
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
 class CapitalCreate(BaseModel):
     name: str
     description: Optional[str] = None
@@ -150,6 +602,7 @@ class CapitalUpdate(BaseModel):
     name: Optional[str] = None
     description: Optional[str] = None
     balance: Optional[float] = None
+    version: Optional[int] = None  # Ожидаемая версия: при расхождении 409
 
 class ExpenseCreate(BaseModel):
     capital_id: str
@@ -178,6 +631,33 @@ class ClientCreate(BaseModel):
     months: int
     schedule: Optional[List[PaymentSchedule]] = None  # Готовый график платежей (опционально)
 
+class ClientBulkCreate(BaseModel):
+    capital_id: str
+    clients: List[Dict[str, Any]]  # Строки импорта, каждая валидируется как ClientCreate
+    offset: int = 0  # Номер первой строки чанка в исходном файле
+
+class ImportJobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    completed = "completed"
+    failed = "failed"
+
+class ImportJob(BaseModel):
+    job_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    owner_id: str
+    capital_id: str
+    filename: str
+    status: ImportJobStatus = ImportJobStatus.queued
+    rows: int = 0  # Обработано строк файла
+    created: int = 0
+    failed: int = 0
+    total_amount: float = 0.0
+    errors: List[Dict[str, Any]] = []  # Первые IMPORT_MAX_ERRORS ошибок по строкам
+    error: Optional[str] = None  # Ошибка всего задания (файл не читается и т.п.)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
 class ClientUpdate(BaseModel):
     name: Optional[str] = None
     product: Optional[str] = None
@@ -189,6 +669,7 @@ class ClientUpdate(BaseModel):
     client_phone: Optional[str] = None
     guarantor_phone: Optional[str] = None
     status: Optional[ClientStatus] = None
+    version: Optional[int] = None  # Ожидаемая версия: при расхождении 409
 
 class PaymentCreate(BaseModel):
     client_id: str
@@ -210,26 +691,707 @@ def mongo_to_dict(mongo_doc):
         del mongo_doc['_id']
     return mongo_doc
 
-def generate_payment_schedule(start_date_str: str, monthly_payment: float, months: int) -> List[PaymentSchedule]:
-    schedule = []
-    start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date()
-    current_date = start_date
+# Money
+# Деньги хранятся целыми копейками, а API по-прежнему принимает и отдаёт рубли:
+# перевод выполняется на границе - при записи документа и в *_from_db при
+# чтении. Балансы, статистика и журнал складываются в целых числах, поэтому
+# ошибка float не накапливается за тысячи $inc. Старые документы с рублями
+# во float переводит manage.py money; до перевода их выдаёт тип значения:
+# копейки всегда целые (BSON int), а double - ещё не переведённые рубли,
+# которые чтение отдаёт как есть, не деля на 100.
+MONEY_FIELDS = {
+    "capitals": ("balance",),
+    "clients": ("purchase_amount", "debt_amount", "total_amount", "monthly_payment"),
+    "expenses": ("amount",),
+    "payments": ("amount",),
+    "ledger": ("amount",),
+    "ledger_snapshots": ("balance", "inflow", "outflow"),
+    "import_jobs": ("total_amount",),
+}
+STATS_MONEY_FIELDS = ("total_debt", "total_profit", "total_paid", "total_expenses")
+STATS_MONEY_MAPS = ("profit_by_month", "expected_by_month")
+
+def to_minor(amount: Optional[float]) -> Optional[int]:
+    """Rubles to kopecks, rounding half up as the amount reads in decimal"""
+    if amount is None:
+        return None
+    return int(Decimal(str(amount)).scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def from_minor(amount: Optional[int]) -> Optional[float]:
+    return None if amount is None else amount / 100
+
+def stored_to_rubles(amount: Optional[Union[int, float]]) -> Optional[float]:
+    """Stored amount in rubles: kopecks are ints, a float is a legacy ruble amount"""
+    if amount is None or isinstance(amount, float):
+        return amount
+    return amount / 100
+
+def stored_to_minor(amount: Optional[Union[int, float]]) -> Optional[int]:
+    """Stored amount in kopecks: a float is a legacy ruble amount"""
+    return to_minor(amount) if isinstance(amount, float) else amount
+
+class LegacyMoney(Exception):
+    """The operation would mix kopecks with amounts still stored in float rubles"""
+
+    def __init__(self, what: str):
+        super().__init__(f"{what} is not converted to kopecks yet, run manage.py money")
+
+@app.exception_handler(LegacyMoney)
+async def legacy_money_handler(request: Request, exc: LegacyMoney):
+    return ORJSONResponse(
+        {"detail": str(exc)}, status_code=503, headers={"Retry-After": str(LEGACY_MONEY_RECHECK_SECONDS)}
+    )
+
+def money_to_db(document: Dict[str, Any], fields: Sequence[str]) -> Dict[str, Any]:
+    """Copy of a document with the money ``fields`` converted to kopecks"""
+    converted = dict(document)
+    for field in fields:
+        if converted.get(field) is not None:
+            converted[field] = to_minor(converted[field])
+    return converted
+
+def money_from_db(document: Dict[str, Any], fields: Sequence[str]) -> Dict[str, Any]:
+    """Convert the money ``fields`` of a freshly read document to rubles in place"""
+    for field in fields:
+        value = document.get(field)
+        if value is not None:
+            document[field] = stored_to_rubles(value)
+    return document
+
+def schedule_to_db(schedule: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [{**entry, "amount": to_minor(entry.get("amount") or 0)} for entry in schedule]
+
+def schedule_from_db(schedule: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [{**entry, "amount": stored_to_rubles(entry.get("amount") or 0)} for entry in schedule]
+
+# Fast read path
+# Документы в MongoDB записаны нашими же моделями, поэтому на чтении их не нужно
+# заново валидировать: проекция оставляет только поля модели, недостающие поля
+# дополняются значениями по умолчанию, а ответ сразу сериализуется orjson.
+def model_projection(model) -> Dict[str, int]:
+    return {"_id": 0, **{name: 1 for name in model.model_fields}}
+
+def model_defaults(model) -> Dict[str, Any]:
+    """Static defaults of optional fields; factory defaults are always stored"""
+    return {
+        name: field.default
+        for name, field in model.model_fields.items()
+        if not field.is_required() and field.default_factory is None
+    }
+
+CAPITAL_PROJECTION = model_projection(Capital)
+CLIENT_PROJECTION = {**model_projection(Client), "sched": 1}  # sched - колоночный график
+PAYMENT_PROJECTION = model_projection(Payment)
+EXPENSE_PROJECTION = model_projection(Expense)
+
+_capital_defaults = model_defaults(Capital)
+_client_defaults = model_defaults(Client)
+_payment_defaults = model_defaults(Payment)
+_expense_defaults = model_defaults(Expense)
+
+# Результат только сериализуется: значения по умолчанию общие, их нельзя менять
+def capital_from_db(document: Dict[str, Any]) -> Dict[str, Any]:
+    return money_from_db({**_capital_defaults, **document}, MONEY_FIELDS["capitals"])
+
+def client_from_db(document: Dict[str, Any], defaults: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    client = {**(_client_defaults if defaults is None else defaults), **document}
+    columns = client.pop("sched", None)
+    if columns is not None:
+        client["schedule"] = decode_schedule(columns, rubles=True)
+    elif client.get("schedule"):
+        client["schedule"] = schedule_from_db(client["schedule"])
+    return money_from_db(client, MONEY_FIELDS["clients"])
+
+def payment_from_db(document: Dict[str, Any]) -> Dict[str, Any]:
+    return money_from_db({**_payment_defaults, **document}, MONEY_FIELDS["payments"])
+
+def expense_from_db(document: Dict[str, Any]) -> Dict[str, Any]:
+    return money_from_db({**_expense_defaults, **document}, MONEY_FIELDS["expenses"])
+
+def ledger_entry_from_db(document: Dict[str, Any]) -> Dict[str, Any]:
+    return money_from_db(mongo_to_dict(document), MONEY_FIELDS["ledger"])
+
+# Sparse client fieldsets
+CLIENT_SUMMARY_FIELDS = (
+    "client_id", "capital_id", "name", "product", "status",
+    "purchase_amount", "debt_amount", "total_amount", "monthly_payment",
+    "start_date", "end_date", "created_at", "updated_at",
+)
+# Нужны для курсора пагинации, ETag и условных обновлений, поэтому возвращаются всегда
+CLIENT_KEY_FIELDS = ("client_id", "created_at", "updated_at", "version")
+
+class ClientFieldset:
+    """Mongo projection and read defaults for a ``fields=`` / ``view=`` request"""
+
+    def __init__(self, fields: Optional[str] = None, view: ClientView = ClientView.full,
+                 schedule_slice: Optional[int] = None):
+        if fields:
+            requested = [name.strip() for name in fields.split(",") if name.strip()]
+            unknown = [name for name in requested if name not in Client.model_fields]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown client fields: {', '.join(unknown)}")
+        elif view == ClientView.summary:
+            requested = list(CLIENT_SUMMARY_FIELDS)
+        else:
+            requested = None
+
+        if requested is None:
+            self.projection = dict(CLIENT_PROJECTION)
+            self.defaults = _client_defaults
+        else:
+            names = list(dict.fromkeys([*CLIENT_KEY_FIELDS, *requested]))
+            self.projection = {"_id": 0, **{name: 1 for name in names}}
+            self.defaults = {name: _client_defaults[name] for name in names if name in _client_defaults}
+            if "schedule" in names:
+                self.projection["sched"] = 1
+        if schedule_slice is not None and "schedule" in self.projection:
+            # Положительное значение - первые N платежей, отрицательное - последние N
+            self.projection["schedule"] = {"$slice": schedule_slice}
+            del self.projection["sched"]
+            for column in SCHEDULE_COLUMNS.values():
+                self.projection[f"sched.{column}"] = {"$slice": schedule_slice}
+
+    def from_db(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        return client_from_db(document, self.defaults)
+
+def db_response(
+    content: Any,
+    response: Optional[Response] = None,
+    etag: Optional[str] = None,
+) -> ORJSONResponse:
+    """Serialize DB-sourced content with orjson, bypassing response_model validation.
+
+    Headers already set on the injected ``response`` (pagination cursors) are
+    carried over, since FastAPI ignores them when a Response is returned.
+    """
+    headers = dict(response.headers) if response is not None else {}
+    if etag:
+        headers.update(etag_headers(etag))
+    return ORJSONResponse(content, headers=headers)
+
+# Conditional GETs
+# ETag строится из версии данных: ревизий капиталов (для списков и агрегатов)
+# или updated_at (для одного клиента), а не из тела ответа, поэтому на 304 не
+# нужно ни сканировать коллекции, ни собирать ответ.
+def make_etag(*parts: Any) -> str:
+    payload = json.dumps(parts, default=str, separators=(",", ":"), sort_keys=True)
+    return '"' + hashlib.sha1(payload.encode()).hexdigest() + '"'
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    # no-cache: браузер хранит ответ, но каждый раз перепроверяет его по ETag
+    return {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=etag_headers(etag))
+
+async def capital_revisions(capital_ids: List[str]) -> Dict[str, int]:
+    capitals = await db.capitals.find(
+        {"id": {"$in": capital_ids}}, {"_id": 0, "id": 1, "revision": 1}
+    ).to_list(None)
+    return {capital["id"]: capital.get("revision", 0) for capital in capitals}
+
+# Даты платежей и журнала хранятся строками YYYY-MM-DD
+DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+
+# Payment schedules
+# Дата k-го платежа - дата начала плюс k месяцев. Если такого дня в месяце нет
+# (31-е, 29 февраля), берётся последний день месяца, а в следующих месяцах
+# снова исходный день.
+SCHEDULE_CACHE_SIZE = int(os.environ.get('SCHEDULE_CACHE_SIZE', '4096'))
+_schedule_dates_cache: LRUCache = LRUCache(maxsize=SCHEDULE_CACHE_SIZE)
+
+def parse_start_dates(start_dates: Sequence[str]) -> np.ndarray:
+    try:
+        starts = np.array(start_dates, dtype="datetime64[D]")
+        # NumPy принимает и неполные даты ("2024-05"), а пустую строку превращает в NaT
+        if (np.datetime_as_string(starts, unit="D") == np.array(start_dates, dtype=str)).all():
+            return starts
+    except ValueError:
+        pass
+    # Медленный путь: форматы, которые принимал strptime ("2024-1-5"), или ValueError
+    return np.array(
+        [datetime.strptime(value, "%Y-%m-%d").date() for value in start_dates], dtype="datetime64[D]"
+    )
+
+def compute_schedule_dates(start_dates: Sequence[str], months: Sequence[int]) -> List[Tuple[str, ...]]:
+    """Installment dates for many contracts in one vectorized NumPy pass"""
+    starts = parse_start_dates(start_dates)
+    counts = np.maximum(np.asarray(months, dtype=np.int64), 0)
+    start_months = starts.astype("datetime64[M]")
+    start_days = (starts - start_months.astype("datetime64[D]")).astype(np.int64)
+    
+    # Номер платежа 1..months для каждого договора, все договоры подряд
+    firsts = np.repeat(np.cumsum(counts) - counts, counts)
+    offsets = np.arange(counts.sum()) - firsts + 1
+    target_months = np.repeat(start_months, counts) + offsets
+    month_starts = target_months.astype("datetime64[D]")
+    month_lengths = ((target_months + 1).astype("datetime64[D]") - month_starts).astype(np.int64)
+    days = np.minimum(np.repeat(start_days, counts), month_lengths - 1)
+    dates = np.datetime_as_string(month_starts + days, unit="D").tolist()
     
-    for _ in range(months):
-        # Move to next month
-        if current_date.month == 12:
-            current_date = current_date.replace(year=current_date.year + 1, month=1)
+    result = []
+    begin = 0
+    for end in np.cumsum(counts).tolist():
+        result.append(tuple(dates[begin:end]))
+        begin = end
+    return result
+
+def schedule_dates(contracts: Iterable[Tuple[str, int]]) -> List[Tuple[str, ...]]:
+    """Memoized dates for (start_date, months) pairs; all misses are computed in one batch.
+
+    The amount does not affect the dates, so it is not part of the key.
+    """
+    contracts = list(contracts)
+    dates_by_key = {}
+    missing = []
+    for key in dict.fromkeys(contracts):
+        dates = _schedule_dates_cache.get(key)
+        if dates is None:
+            missing.append(key)
         else:
-            current_date = current_date.replace(month=current_date.month + 1)
-        
-        schedule.append(PaymentSchedule(
-            payment_date=current_date.strftime("%Y-%m-%d"),
-            amount=monthly_payment
-        ))
-    return schedule
+            dates_by_key[key] = dates
+    if missing:
+        computed = compute_schedule_dates([start for start, _ in missing], [months for _, months in missing])
+        for key, dates in zip(missing, computed):
+            _schedule_dates_cache[key] = dates
+            dates_by_key[key] = dates
+    return [dates_by_key[key] for key in contracts]
+
+def generate_schedules(contracts: Sequence[Tuple[str, float, int]]) -> List[List[Dict[str, Any]]]:
+    """Schedules for many (start_date, monthly_payment, months) contracts as plain dicts"""
+    all_dates = schedule_dates((start, months) for start, _, months in contracts)
+    return [
+        [
+            {"payment_date": payment_date, "amount": amount, "status": PaymentStatus.pending.value, "paid_date": None}
+            for payment_date in dates
+        ]
+        for (_, amount, _), dates in zip(contracts, all_dates)
+    ]
+
+def generate_payment_schedule(start_date_str: str, monthly_payment: float, months: int) -> List[Dict[str, Any]]:
+    return generate_schedules([(start_date_str, monthly_payment, months)])[0]
+
+# Columnar schedules
+# Альтернативный формат хранения графика - параллельные массивы в поле sched:
+#   d - дни от 1970-01-01, a - суммы в копейках (как и в строках), s - коды статусов,
+#   p - день оплаты или null.
+# Документ в несколько раз меньше, а отбор по датам и статусам сравнивает целые
+# числа без strptime. Наружу график всегда отдаётся списком словарей:
+# client_from_db и client_schedule декодируют sched. Новые клиенты пишутся в
+# формате SCHEDULE_STORAGE, существующие переводит manage.py schedules.
+SCHEDULE_STORAGE = os.environ.get('SCHEDULE_STORAGE', 'rows').lower()
+SCHEDULE_STATUSES = ("pending", "paid", "overdue")  # Код статуса - индекс в кортеже
+SCHEDULE_STATUS_CODES = {status: code for code, status in enumerate(SCHEDULE_STATUSES)}
+PENDING_CODE, PAID_CODE, OVERDUE_CODE = 0, 1, 2
+SCHEDULE_COLUMNS = {"payment_date": "d", "amount": "a", "status": "s", "paid_date": "p"}
+_date_pattern = re.compile(DATE_PATTERN)
+
+def to_epoch_day(value: str) -> int:
+    return int(np.datetime64(value, "D").astype(np.int64))
+
+def from_epoch_day(day: int) -> str:
+    return str(np.datetime64(int(day), "D"))
+
+def encode_schedule(entries: Sequence[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """Columnar form of a stored schedule; ValueError if an entry has no exact encoding"""
+    dates = [entry["payment_date"] for entry in entries]
+    paid = [entry.get("paid_date") for entry in entries]
+    if not all(isinstance(value, str) and _date_pattern.match(value) for value in dates):
+        raise ValueError("schedule has malformed payment dates")
+    if not all(value is None or (isinstance(value, str) and _date_pattern.match(value)) for value in paid):
+        raise ValueError("schedule has malformed paid dates")
+    amounts = [entry.get("amount", 0) or 0 for entry in entries]
+    if not all(isinstance(amount, int) for amount in amounts):
+        # Рубли во float из документов, не переведённых manage.py money
+        raise ValueError("schedule amounts are not in kopecks")
+    try:
+        statuses = [SCHEDULE_STATUS_CODES[entry.get("status") or "pending"] for entry in entries]
+    except KeyError as e:
+        raise ValueError(f"unknown payment status {e}")
+    days = np.array(dates, dtype="datetime64[D]").astype(np.int64)
+    return {
+        "d": days.tolist(),
+        "a": amounts,
+        "s": statuses,
+        "p": [to_epoch_day(value) if value else None for value in paid],
+    }
+
+def decode_schedule(columns: Dict[str, List[Any]], rubles: bool = False) -> List[Dict[str, Any]]:
+    """Stored rows of a columnar schedule; amounts in rubles for the API with ``rubles``"""
+    dates = np.array(columns["d"], dtype=np.int64).astype("datetime64[D]").astype(str).tolist()
+    amounts = (np.array(columns["a"], dtype=np.int64) / 100).tolist() if rubles else list(columns["a"])
+    return [
+        {
+            "payment_date": payment_date,
+            "amount": amount,
+            "status": SCHEDULE_STATUSES[status],
+            "paid_date": from_epoch_day(paid) if paid is not None else None,
+        }
+        for payment_date, amount, status, paid in zip(dates, amounts, columns["s"], columns["p"])
+    ]
+
+def schedule_entry(columns: Dict[str, List[Any]], index: int) -> Dict[str, Any]:
+    """Decode a single installment without decoding the whole schedule"""
+    paid = columns["p"][index]
+    return {
+        "payment_date": from_epoch_day(columns["d"][index]),
+        "amount": columns["a"][index],
+        "status": SCHEDULE_STATUSES[columns["s"][index]],
+        "paid_date": from_epoch_day(paid) if paid is not None else None,
+    }
+
+def encode_schedule_value(field: str, value: Any) -> Any:
+    if field in ("payment_date", "paid_date"):
+        return to_epoch_day(value) if value else None
+    if field == "amount":
+        return value
+    return SCHEDULE_STATUS_CODES[value]
+
+def client_schedule(document: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Stored schedule of a client as a list of dicts (amounts in kopecks), whatever its format"""
+    if "sched" in document:
+        return decode_schedule(document["sched"])
+    return document.get("schedule") or []
+
+def client_document(client: Dict[str, Any]) -> Dict[str, Any]:
+    """Stored form of a new client: money in kopecks, schedule in the SCHEDULE_STORAGE format.
+
+    Schedules without an exact columnar encoding stay rows.
+    """
+    document = money_to_db(client, MONEY_FIELDS["clients"])
+    document["schedule"] = schedule_to_db(client.get("schedule") or [])
+    document["schema_version"] = SCHEMA_VERSIONS["clients"]
+    if SCHEDULE_STORAGE != "columnar" or not document["schedule"]:
+        return document
+    try:
+        columns = encode_schedule(document["schedule"])
+    except ValueError:
+        return document
+    del document["schedule"]
+    document["sched"] = columns
+    return document
+
+def encode_cursor(created_at: datetime, item_id: str) -> str:
+    """Opaque keyset cursor pointing after the (created_at, id) pair"""
+    raw = json.dumps([created_at.isoformat(), item_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), item_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def after_cursor_query(cursor: str, id_field: str, direction: int = ASCENDING) -> Dict[str, Any]:
+    """Filter selecting documents after the cursor in (created_at, id_field) order"""
+    created_at, item_id = decode_cursor(cursor)
+    op = "$gt" if direction == ASCENDING else "$lt"
+    return {"$or": [
+        {"created_at": {op: created_at}},
+        {"created_at": created_at, id_field: {op: item_id}},
+    ]}
+
+def range_filter(low: Any = None, high: Any = None) -> Optional[Dict[str, Any]]:
+    condition = {}
+    if low is not None:
+        condition["$gte"] = low
+    if high is not None:
+        condition["$lte"] = high
+    return condition or None
+
+async def fetch_page(
+    collection,
+    query: Dict[str, Any],
+    id_field: str,
+    response: Response,
+    limit: int,
+    after: Optional[str] = None,
+    with_total: bool = False,
+    direction: int = ASCENDING,
+    projection: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """Fetch one keyset page ordered by (created_at, id_field).
+
+    The cursor of the next page goes to the X-Next-Cursor header and, when
+    requested, the number of matching documents to X-Total-Count.
+    """
+    page_query = query
+    if after:
+        page_query = {"$and": [query, after_cursor_query(after, id_field, direction)]}
+    documents = await collection.find(page_query, projection or {"_id": 0}).sort(
+        [("created_at", direction), (id_field, direction)]
+    ).limit(limit + 1).to_list(None)
+    if len(documents) > limit:
+        documents = documents[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(documents[-1]["created_at"], documents[-1][id_field])
+    if with_total:
+        response.headers["X-Total-Count"] = str(await collection.count_documents(query))
+    return documents
+
+def build_client(client: ClientCreate) -> Client:
+    """Build a Client document from creation data, generating the schedule if none is given"""
+    if client.schedule:
+        # Use provided schedule from import
+        schedule = []
+        for s in client.schedule:
+            if isinstance(s, dict):
+                schedule.append(PaymentSchedule(**s).dict())
+            elif hasattr(s, 'dict'):
+                schedule.append(PaymentSchedule(**s.dict()).dict())
+            else:
+                schedule.append(s)
+    else:
+        # Generate default schedule
+        schedule = generate_payment_schedule(client.start_date, client.monthly_payment, client.months)
+    
+    end_date = schedule[-1]["payment_date"] if schedule else client.start_date
+    
+    client_dict = client.dict()
+    
+    if client.total_amount is None and client.debt_amount is None:
+        raise HTTPException(status_code=400, detail="Either debt_amount or total_amount must be provided")
+    # Старая форма запроса (только total_amount) приводится к каноническим полям,
+    # как и документы миграцией clients v1
+    client_dict.update(canonical_client_amounts(client_dict))
+    
+    return Client(
+        **{k: v for k, v in client_dict.items() if k not in ['months', 'schedule']},
+        schedule=schedule,
+        end_date=end_date
+    )
+
+def columnar_past_due_query(today_day: int) -> Dict[str, Any]:
+    # Параллельные массивы sched не сопоставляются обычным фильтром, поэтому
+    # "ожидающий платёж в прошлом" проверяет $expr по кандидатам из индекса sched.d
+    pending_past_due = {"$anyElementTrue": [{"$map": {
+        "input": {"$range": [0, {"$size": "$sched.d"}]},
+        "as": "i",
+        "in": {"$and": [
+            {"$eq": [{"$arrayElemAt": ["$sched.s", "$$i"]}, PENDING_CODE]},
+            {"$lt": [{"$arrayElemAt": ["$sched.d", "$$i"]}, today_day]},
+        ]},
+    }}]}
+    return {"sched.d": {"$lt": today_day}, "sched.s": PENDING_CODE, "$expr": pending_past_due}
+
+def columnar_dashboard_query(capital_ids: List[str], today_day: int, tomorrow_day: int) -> Dict[str, Any]:
+    """Clients with columnar schedules that may fall into a dashboard bucket"""
+    return {
+        "capital_id": {"$in": capital_ids},
+        "$or": [
+            {"sched.s": OVERDUE_CODE},
+            {"sched.d": {"$in": [today_day, tomorrow_day]}},
+            columnar_past_due_query(today_day),
+        ],
+    }
+
+def overdue_sweep_query(today_key: str) -> Dict[str, Any]:
+    """Clients the overdue sweep has to look at (see Overdue sweeper); declared before HOT_QUERIES"""
+    today_day = to_epoch_day(today_key)
+    return {"$or": [
+        {"schedule": {"$elemMatch": {"status": "pending", "payment_date": {"$regex": DATE_PATTERN, "$lt": today_key}}}},
+        {"status": "active", "schedule.status": "overdue"},
+        {"status": "overdue", "status_source": {"$ne": "manual"}, "schedule.0": {"$exists": True},
+         "schedule.status": {"$ne": "overdue"}},
+        {"status": "active", "schedule.0": {"$exists": True}, "schedule.status": {"$nin": ["pending", "overdue"]}},
+        {"status": "completed", "status_source": "schedule", "schedule": {"$elemMatch": {"status": {"$ne": "paid"}}}},
+        columnar_past_due_query(today_day),
+        {"status": "active", "sched.s": OVERDUE_CODE},
+        {"status": "overdue", "status_source": {"$ne": "manual"}, "sched.d.0": {"$exists": True},
+         "sched.s": {"$ne": OVERDUE_CODE}},
+        {"status": "active", "sched.d.0": {"$exists": True}, "sched.s": {"$nin": [PENDING_CODE, OVERDUE_CODE]}},
+        {"status": "completed", "status_source": "schedule", "sched.s": {"$in": [PENDING_CODE, OVERDUE_CODE]}},
+    ]}
+
+# Indexes
+# Индексы, без которых горячие запросы API превращаются в полный скан коллекции
+REQUIRED_INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("uid", ASCENDING)], name="uid_unique", unique=True),
+    ],
+    "capitals": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("owner_id", ASCENDING), ("is_active", ASCENDING)], name="owner_active"),
+    ],
+    "clients": [
+        IndexModel([("client_id", ASCENDING)], name="client_id_unique", unique=True),
+        IndexModel(
+            [("capital_id", ASCENDING), ("created_at", ASCENDING), ("client_id", ASCENDING)],
+            name="capital_created_id",
+        ),
+        # Multikey index for dashboard/overdue lookups over schedule entries
+        IndexModel(
+            [("schedule.payment_date", ASCENDING), ("schedule.status", ASCENDING)],
+            name="schedule_date_status",
+        ),
+        # Status transitions picked up by the overdue sweeper
+        IndexModel([("status", ASCENDING), ("schedule.status", ASCENDING)], name="status_schedule_status"),
+        # Columnar schedules: MongoDB cannot index two parallel arrays in one
+        # compound key, so day and status codes get separate indexes
+        IndexModel([("sched.d", ASCENDING)], name="sched_day"),
+        IndexModel([("status", ASCENDING), ("sched.s", ASCENDING)], name="status_sched_status"),
+        # Every $or branch of the columnar dashboard query needs its own index
+        IndexModel([("capital_id", ASCENDING), ("sched.s", ASCENDING)], name="capital_sched_status"),
+        IndexModel([("capital_id", ASCENDING), ("sched.d", ASCENDING)], name="capital_sched_day"),
+        # Documents still waiting for a schema migration
+        IndexModel([("schema_version", ASCENDING)], name="schema_version"),
+    ],
+    "payments": [
+        IndexModel([("payment_id", ASCENDING)], name="payment_id_unique", unique=True),
+        IndexModel(
+            [("capital_id", ASCENDING), ("created_at", ASCENDING), ("payment_id", ASCENDING)],
+            name="capital_created_id",
+        ),
+        IndexModel([("client_id", ASCENDING)], name="client_id"),
+    ],
+    "expenses": [
+        IndexModel([("expense_id", ASCENDING)], name="expense_id_unique", unique=True),
+        IndexModel(
+            [("capital_id", ASCENDING), ("created_at", DESCENDING), ("expense_id", DESCENDING)],
+            name="capital_created_id",
+        ),
+    ],
+    "capital_stats": [
+        IndexModel([("capital_id", ASCENDING)], name="capital_id_unique", unique=True),
+    ],
+    "ledger": [
+        IndexModel([("entry_id", ASCENDING)], name="entry_id_unique", unique=True),
+        IndexModel(
+            [("capital_id", ASCENDING), ("created_at", ASCENDING), ("entry_id", ASCENDING)],
+            name="capital_created_id",
+        ),
+        IndexModel([("capital_id", ASCENDING), ("entry_date", ASCENDING)], name="capital_date"),
+    ],
+    "ledger_snapshots": [
+        IndexModel([("capital_id", ASCENDING), ("date", ASCENDING)], name="capital_date_unique", unique=True),
+    ],
+    "import_jobs": [
+        IndexModel([("job_id", ASCENDING)], name="job_id_unique", unique=True),
+    ],
+    "schema_migrations": [
+        IndexModel([("collection", ASCENDING), ("version", ASCENDING)], name="collection_version_unique", unique=True),
+    ],
+}
+
+# Representative shapes of the queries issued by the handlers below.
+# Values are placeholders: only the shape matters to the query planner.
+HOT_QUERIES = [
+    ("users", {"uid": "uid"}, None),
+    ("capitals", {"owner_id": "uid", "is_active": True}, None),
+    ("capitals", {"owner_id": "uid"}, None),
+    ("capitals", {"id": "capital"}, None),
+    ("clients", {"client_id": "client", "capital_id": {"$in": ["capital"]}}, None),
+    ("clients", {"capital_id": {"$in": ["capital"]}}, [("created_at", ASCENDING), ("client_id", ASCENDING)]),
+    ("clients", {"schedule.payment_date": {"$lt": "2000-01-01"}, "schedule.status": "pending"}, None),
+    ("clients", overdue_sweep_query("2000-01-01"), None),
+    ("clients", {"$or": [{"schema_version": {"$lt": 1}}, {"schema_version": None}]}, [("_id", ASCENDING)]),
+    ("clients", columnar_dashboard_query(["capital"], 0, 1), None),
+    ("payments", {"capital_id": {"$in": ["capital"]}}, [("created_at", ASCENDING), ("payment_id", ASCENDING)]),
+    ("payments", {"client_id": "client"}, None),
+    ("expenses", {"expense_id": "expense", "capital_id": {"$in": ["capital"]}}, None),
+    ("expenses", {"capital_id": {"$in": ["capital"]}}, [("created_at", DESCENDING), ("expense_id", DESCENDING)]),
+    ("capital_stats", {"capital_id": "capital"}, None),
+    ("ledger", {"capital_id": "capital", "entry_date": {"$gt": "2000-01-01"}}, None),
+    ("ledger", {"capital_id": "capital"}, [("created_at", ASCENDING), ("entry_id", ASCENDING)]),
+    ("ledger_snapshots", {"capital_id": "capital", "date": {"$lte": "2000-01-01"}}, [("date", DESCENDING)]),
+    ("import_jobs", {"job_id": "job", "owner_id": "uid"}, None),
+]
+
+def _index_key(spec) -> List[tuple]:
+    return [(field, direction) for field, direction in spec.items()] if isinstance(spec, dict) else list(spec)
+
+async def ensure_indexes() -> Dict[str, Any]:
+    """Create missing indexes and report drift against REQUIRED_INDEXES.
+
+    Index creation is idempotent: indexes that already exist with the same
+    name and key are left untouched.
+    """
+    report = {"created": [], "mismatched": [], "unexpected": [], "failed": []}
+    for collection_name, models in REQUIRED_INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        missing = []
+        for model in models:
+            spec = model.document
+            current = existing.get(spec["name"])
+            if current is None:
+                missing.append(model)
+            elif _index_key(current["key"]) != _index_key(spec["key"]) or \
+                    bool(current.get("unique")) != bool(spec.get("unique")):
+                report["mismatched"].append(f"{collection_name}.{spec['name']}")
+
+        declared = {model.document["name"] for model in models} | {"_id_"}
+        report["unexpected"].extend(
+            f"{collection_name}.{name}" for name in existing if name not in declared
+        )
+
+        for model in missing:
+            name = f"{collection_name}.{model.document['name']}"
+            try:
+                await collection.create_indexes([model])
+                report["created"].append(name)
+            except OperationFailure as e:
+                # Например, дубликаты не дают построить уникальный индекс
+                report["failed"].append(f"{name}: {e}")
+
+    if report["created"]:
+        logger.info("Created indexes: %s", ", ".join(report["created"]))
+    if report["mismatched"] or report["unexpected"]:
+        logger.warning(
+            "Index drift detected. Mismatched: %s; not declared: %s",
+            report["mismatched"], report["unexpected"]
+        )
+    for failure in report["failed"]:
+        logger.error("Index creation failed: %s", failure)
+    return report
+
+def _plan_uses_collscan(plan: Any) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(_plan_uses_collscan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(_plan_uses_collscan(item) for item in plan)
+    return False
+
+async def check_hot_queries() -> List[str]:
+    """Explain every hot query and return those not served by an index."""
+    unindexed = []
+    for collection_name, query, sort in HOT_QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explanation = await cursor.explain()
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+        if _plan_uses_collscan(winning_plan):
+            unindexed.append(f"{collection_name}: {query} sort={sort}")
+    return unindexed
 
 # Auth dependency (simplified for demo)
 async def get_current_user(authorization: Optional[str] = Header(None)) -> str:
+    user = resolve_user(authorization)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.user = user
+    return user
+
+# Служебные /api/admin/* отдают данные всех пользователей. Роль в users любой
+# может выдать себе через /init-mock-data, поэтому администраторы задаются
+# окружением: ADMIN_USERS=uid1,uid2. Демо-пользователь администратором не бывает.
+ADMIN_USERS = {uid.strip() for uid in os.environ.get('ADMIN_USERS', '').split(',') if uid.strip()} - {"demo_user_uid"}
+
+async def get_admin_user(current_user: str = Depends(get_current_user)) -> str:
+    if current_user not in ADMIN_USERS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+def resolve_user(authorization: Optional[str]) -> str:
     # Demo mode - simplified authentication
     if authorization and authorization.startswith('Bearer '):
         token = authorization.split(' ')[1]
@@ -255,6 +1417,532 @@ async def get_current_user(authorization: Optional[str] = Header(None)) -> str:
     # Fallback to demo user for requests without proper auth
     return "demo_user_uid"
 
+# Capital ownership
+# Кэш id капиталов пользователя: владелец -> список id. В пределах одного
+# процесса create/update/delete_capital сбрасывают его сразу, между воркерами
+# устаревание ограничено TTL.
+CAPITAL_CACHE_TTL = int(os.environ.get('CAPITAL_CACHE_TTL', '30'))
+CAPITAL_CACHE_SIZE = int(os.environ.get('CAPITAL_CACHE_SIZE', '10000'))
+capital_ids_cache: TTLCache = TTLCache(maxsize=CAPITAL_CACHE_SIZE, ttl=CAPITAL_CACHE_TTL)
+
+async def load_user_capital_ids(owner_id: str) -> List[str]:
+    capitals = await db.capitals.find({"owner_id": owner_id}, {"_id": 0, "id": 1}).to_list(None)
+    capital_ids = [capital["id"] for capital in capitals]
+    capital_ids_cache[owner_id] = capital_ids
+    return capital_ids
+
+def invalidate_user_capitals(owner_id: str) -> None:
+    capital_ids_cache.pop(owner_id, None)
+
+class OwnedCapitals:
+    """Ids of the capitals owned by the current user, resolved once per request."""
+
+    def __init__(self, owner_id: str, ids: List[str]):
+        self.owner_id = owner_id
+        self.ids = ids
+
+    async def check(self, capital_id: str) -> None:
+        """Raise 403 unless the capital belongs to the user.
+
+        A miss is confirmed against the database once, so a capital created
+        by another worker is visible before the cached entry expires.
+        """
+        if capital_id in self.ids:
+            return
+        self.ids = await load_user_capital_ids(self.owner_id)
+        if capital_id not in self.ids:
+            raise HTTPException(status_code=403, detail="Access denied")
+
+async def get_owned_capitals(current_user: str = Depends(get_current_user)) -> OwnedCapitals:
+    capital_ids = capital_ids_cache.get(current_user)
+    if capital_ids is None:
+        capital_ids = await load_user_capital_ids(current_user)
+    return OwnedCapitals(current_user, capital_ids)
+
+# Capital statistics
+# Материализованная аналитика капитала (коллекция capital_stats). Обработчики,
+# меняющие клиентов, график платежей или расходы, применяют к ней $inc-дельты,
+# поэтому /api/analytics читает один документ вместо скана всех клиентов.
+# Просроченность зависит от текущей даты, поэтому ожидающие платежи хранятся
+# счётчиками по датам (pending_by_date) и сравниваются с сегодняшним днём при чтении.
+STATS_MAPS = ("profit_by_month", "expected_by_month", "pending_by_date")
+
+def add_stats(target: Dict[str, float], delta: Dict[str, float]) -> Dict[str, float]:
+    for key, value in delta.items():
+        target[key] = target.get(key, 0) + value
+    return target
+
+def schedule_entry_stats(entry: Dict[str, Any], sign: int = 1) -> Dict[str, float]:
+    """Contribution of one schedule entry to capital stats"""
+    try:
+        payment_date = datetime.strptime(entry["payment_date"], "%Y-%m-%d").date()
+    except (ValueError, KeyError, TypeError):
+        # Invalid entries are skipped by the analytics as well
+        return {}
+    amount = entry.get("amount", 0) or 0
+    status = entry.get("status", "pending")
+    delta = {
+        "total_payments": sign,
+        f"expected_by_month.{payment_date.strftime('%Y-%m')}": sign * amount,
+    }
+    if status == "paid":
+        delta["total_paid"] = sign * amount
+        delta["paid_payments"] = sign
+    elif status == "overdue":
+        delta["overdue_payments"] = sign
+    elif status == "pending":
+        delta[f"pending_by_date.{payment_date.strftime('%Y-%m-%d')}"] = sign
+    return delta
+
+def client_summary_stats(client: Dict[str, Any], sign: int = 1) -> Dict[str, float]:
+    """Contribution of the client's own fields (without the schedule) to capital stats"""
+    client = stored_client_amounts(client)
+    debt = client.get("debt_amount") or 0
+    profit = debt - (client.get("purchase_amount") or 0)  # Прибыль = долг - покупка
+    try:
+        contract_month = datetime.strptime(client.get("start_date", ""), "%Y-%m-%d").strftime("%Y-%m")
+    except (ValueError, TypeError):
+        # Attributed to the current month when analytics are read
+        contract_month = "unknown"
+    delta = {
+        "total_clients": sign,
+        "total_debt": sign * debt,
+        "total_profit": sign * profit,
+        f"profit_by_month.{contract_month}": sign * profit,
+    }
+    if client.get("status") == "active":
+        delta["active_clients"] = sign
+    return delta
+
+def client_stats(client: Dict[str, Any], sign: int = 1) -> Dict[str, float]:
+    delta = client_summary_stats(client, sign)
+    for entry in client_schedule(client):
+        add_stats(delta, schedule_entry_stats(entry, sign))
+    return delta
+
+async def apply_stats_delta(capital_id: str, delta: Dict[str, float], session=None) -> None:
+    """Apply a stats delta with a single atomic $inc.
+
+    The document is not upserted: a missing one is rebuilt from scratch on
+    the next analytics read, and a partial document would be wrong.
+    """
+    inc = {key: value for key, value in delta.items() if value}
+    if not inc:
+        return
+    await db.capital_stats.update_one(
+        {"capital_id": capital_id},
+        {"$inc": inc, "$set": {"updated_at": datetime.utcnow()}},
+        session=session
+    )
+
+def empty_capital_stats(capital_id: str) -> Dict[str, Any]:
+    stats = {
+        "capital_id": capital_id,
+        "total_clients": 0,
+        "active_clients": 0,
+        "total_debt": 0,
+        "total_profit": 0,
+        "total_paid": 0,
+        "total_payments": 0,
+        "paid_payments": 0,
+        "overdue_payments": 0,
+        "total_expenses": 0,
+        "updated_at": datetime.utcnow(),
+    }
+    stats.update({name: {} for name in STATS_MAPS})
+    return stats
+
+def flatten_stats(stats: Dict[str, Any]) -> Dict[str, float]:
+    flat = {}
+    for key, value in stats.items():
+        if key in STATS_MAPS:
+            flat.update({f"{key}.{sub_key}": sub_value for sub_key, sub_value in value.items()})
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[key] = value
+    return flat
+
+async def compute_capital_stats(capital_id: str) -> Dict[str, Any]:
+    """Recompute capital stats from the clients and expenses collections"""
+    flat: Dict[str, float] = {}
+    async for client in db.clients.find({"capital_id": capital_id}, {"_id": 0}):
+        add_stats(flat, client_stats(client))
+    
+    totals = await db.expenses.aggregate([
+        {"$match": {"capital_id": capital_id}},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+    ]).to_list(1)
+    flat["total_expenses"] = totals[0]["total"] if totals else 0
+    
+    stats = empty_capital_stats(capital_id)
+    for key, value in flat.items():
+        if "." in key:
+            name, sub_key = key.split(".", 1)
+            if value:
+                stats[name][sub_key] = value
+        else:
+            stats[key] = value
+    return stats
+
+async def rebuild_capital_stats(capital_id: str, dry_run: bool = False) -> Dict[str, Any]:
+    """Recompute stats for a capital, store them and return the drift found.
+
+    Drift maps every differing counter to its (stored, actual) pair.
+    """
+    stats = await compute_capital_stats(capital_id)
+    stored = await db.capital_stats.find_one({"capital_id": capital_id}, {"_id": 0})
+    
+    drift = {}
+    if stored is not None:
+        stored_flat = flatten_stats(stored)
+        actual_flat = flatten_stats(stats)
+        for key in stored_flat.keys() | actual_flat.keys():
+            before = stored_flat.get(key, 0)
+            after = actual_flat.get(key, 0)
+            if before != after:
+                drift[key] = (before, after)
+    
+    if not dry_run:
+        await db.capital_stats.replace_one({"capital_id": capital_id}, stats, upsert=True)
+        if drift:
+            # Сбросить ETag и кэш аналитики, посчитанные по неверной статистике
+            await bump_capital_revision(capital_id)
+    return {"capital_id": capital_id, "missing": stored is None, "drift": drift, "stats": stats}
+
+async def get_capital_stats(capital_id: str) -> Dict[str, Any]:
+    stats = await db.capital_stats.find_one({"capital_id": capital_id}, {"_id": 0})
+    if stats is None:
+        # Capitals created before materialized stats existed
+        stats = (await rebuild_capital_stats(capital_id))["stats"]
+    return stats
+
+# Transactions
+# Составные операции (клиент/платёж/расход + баланс + статистика) выполняются
+# в транзакции. На standalone mongod транзакций нет, и колбэк выполняется без
+# сессии, как раньше. MONGO_TRANSACTIONS=false отключает их принудительно.
+MONGO_TRANSACTIONS = os.environ.get('MONGO_TRANSACTIONS', 'auto').lower()
+_transactions_supported: Optional[bool] = None
+
+async def transactions_supported() -> bool:
+    global _transactions_supported
+    if _transactions_supported is None:
+        if MONGO_TRANSACTIONS == 'false':
+            _transactions_supported = False
+        else:
+            hello = await client.admin.command("hello")
+            # Transactions need a replica set member or a mongos
+            _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+            if not _transactions_supported:
+                logger.warning("MongoDB deployment is standalone, running without transactions")
+    return _transactions_supported
+
+async def run_in_transaction(callback):
+    """Run ``callback(session)`` as one unit of work and return its result.
+
+    The driver retries the whole callback on TransientTransactionError and
+    the commit on UnknownTransactionCommitResult, so the callback must not
+    have side effects outside the database. Without transaction support it
+    is called once with ``session=None``.
+    """
+    if not await transactions_supported():
+        return await callback(None)
+    async with await client.start_session() as session:
+        return await session.with_transaction(callback)
+
+# Optimistic concurrency
+# Клиенты и капиталы несут поле version, которое растёт ($inc) при каждой записи.
+# Запись от пользователя с ожидаемой версией выполняется условно и при
+# расхождении получает 409 с текущим документом. Внутренние операции
+# "прочитал - посчитал - записал" перечитывают документ и повторяют запись
+# не более MAX_VERSION_RETRIES раз.
+MAX_VERSION_RETRIES = int(os.environ.get('MAX_VERSION_RETRIES', '3'))
+
+conditional_writes_total = metrics.register(Counter(
+    "conditional_writes_total", "Writes conditioned on a document version", ("entity",)
+))
+version_conflicts_total = metrics.register(Counter(
+    "version_conflicts_total", "Version conflicts by outcome: retried, rejected (409) or exhausted",
+    ("entity", "outcome")
+))
+
+class VersionConflict(Exception):
+    """The document changed since the version the write was based on"""
+
+    def __init__(self, entity: str, current: Dict[str, Any]):
+        super().__init__(f"{entity} was modified concurrently")
+        self.entity = entity
+        self.current = current
+
+def version_filter(version: int) -> Dict[str, Any]:
+    # Документы, записанные до появления поля, считаются версией 0
+    return {"version": version} if version else {"version": {"$in": [0, None]}}
+
+@app.exception_handler(VersionConflict)
+async def version_conflict_handler(request: Request, exc: VersionConflict):
+    version_conflicts_total.inc((exc.entity, "rejected"))
+    return ORJSONResponse(
+        {"detail": f"{exc.entity.capitalize()} was modified by someone else", "current": exc.current},
+        status_code=409
+    )
+
+# Capital balance
+# Все изменения баланса идут одной атомарной операцией $inc: проверка
+# достаточности средств и списание выполняются за один запрос к базе.
+# Суммы здесь и в журнале - копейки.
+async def adjust_capital_balance(
+    capital_id: str,
+    amount: int,
+    require_funds: bool = False,
+    owner_id: Optional[str] = None,
+    session=None,
+    kind: LedgerKind = LedgerKind.adjustment,
+    ref_id: Optional[str] = None,
+    note: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """Add ``amount`` (negative for a debit) to the capital balance.
+
+    With ``require_funds`` the update only matches while the balance covers
+    the debit. Every applied change is recorded in the ledger as ``kind``.
+    Returns the updated capital, or None if nothing matched; a balance still
+    in float rubles raises LegacyMoney.
+    """
+    query = {"id": capital_id}
+    if owner_id is not None:
+        query["owner_id"] = owner_id
+    # Рублёвый (double) баланс не трогаем: копейки в нём исказили бы сумму
+    query["balance"] = {"$not": {"$type": "double"}}
+    if require_funds:
+        query["balance"]["$gte"] = -amount
+    capital = await db.capitals.find_one_and_update(
+        query,
+        {"$inc": {"balance": amount, "version": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+    if capital is None:
+        legacy = await db.capitals.count_documents(
+            {"id": capital_id, "balance": {"$type": "double"}}, limit=1, session=session
+        )
+        if legacy:
+            raise LegacyMoney("Capital balance")
+    if capital is not None and amount:
+        await record_ledger_entry(capital_id, amount, kind, ref_id=ref_id, note=note, session=session)
+    return capital
+
+async def bump_capital_revision(capital_id: str, session=None) -> Optional[Dict[str, Any]]:
+    """Mark data derived from the capital as changed and return the capital.
+
+    Call it as the last write of a unit of work: without a transaction a
+    reader must not see the new revision together with the old data.
+    """
+    return await db.capitals.find_one_and_update(
+        {"id": capital_id},
+        {"$inc": {"revision": 1, "version": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
+        session=session
+    )
+
+async def debit_capital(
+    capital_id: str,
+    amount: int,
+    owner_id: Optional[str] = None,
+    detail: Optional[str] = None,
+    session=None,
+    kind: LedgerKind = LedgerKind.adjustment,
+    ref_id: Optional[str] = None,
+    note: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Debit the capital, raising 404/400 when it is missing or short of funds"""
+    capital = await adjust_capital_balance(
+        capital_id, -amount, require_funds=True, owner_id=owner_id, session=session,
+        kind=kind, ref_id=ref_id, note=note
+    )
+    if capital is not None:
+        return capital
+    
+    # Only the failure path pays for an extra read, to explain what went wrong
+    query = {"id": capital_id}
+    if owner_id is not None:
+        query["owner_id"] = owner_id
+    current = await db.capitals.find_one(query, {"balance": 1}, session=session)
+    if not current:
+        raise HTTPException(status_code=404, detail="Capital not found")
+    raise HTTPException(
+        status_code=400,
+        detail=detail or (
+            f"Недостаточно средств в капитале. Доступно: {stored_to_rubles(current.get('balance', 0))}₽, "
+            f"требуется: {from_minor(amount)}₽"
+        )
+    )
+
+# Ledger
+# Журнал движений по капиталу (коллекция ledger) только дополняется: каждое
+# изменение баланса пишется сюда в той же единице работы. Ежедневные снимки
+# (ledger_snapshots) хранят баланс на конец дня и обороты за день, поэтому
+# баланс на дату и движение денег считаются по последнему снимку и хвосту
+# журнала после него, а не по всей истории. При удалении капитала журнал
+# не удаляется: остаток списывается записью closing.
+async def record_ledger_entry(
+    capital_id: str,
+    amount: int,
+    kind: LedgerKind,
+    ref_id: Optional[str] = None,
+    note: Optional[str] = None,
+    session=None,
+) -> LedgerEntry:
+    entry = LedgerEntry(capital_id=capital_id, amount=from_minor(amount), kind=kind, ref_id=ref_id, note=note)
+    await db.ledger.insert_one({**entry.dict(), "amount": amount}, session=session)
+    return entry
+
+def ledger_day_totals_pipeline(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": "$entry_date",
+            "inflow": {"$sum": {"$cond": [{"$gt": ["$amount", 0]}, "$amount", 0]}},
+            "outflow": {"$sum": {"$cond": [{"$lt": ["$amount", 0]}, {"$subtract": [0, "$amount"]}, 0]}},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+
+async def check_ledger_converted(capital_id: str) -> None:
+    # Суммы по дням складывают записи журнала как есть: рублёвые (double)
+    # записи или снимки дали бы смесь единиц, поэтому до manage.py money
+    # баланс по журналу не считается и снимки не пишутся
+    for collection in ("ledger", "ledger_snapshots"):
+        query = {"$and": [{"capital_id": capital_id}, legacy_money_query(collection)]}
+        if await db[collection].count_documents(query, limit=1):
+            raise LegacyMoney(f"Ledger of capital {capital_id}")
+
+async def latest_ledger_snapshot(capital_id: str, on_or_before: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    query = {"capital_id": capital_id}
+    if on_or_before is not None:
+        query["date"] = {"$lte": on_or_before}
+    return await db.ledger_snapshots.find_one(query, {"_id": 0}, sort=[("date", DESCENDING)])
+
+async def ledger_days(capital_id: str, after: Optional[str], until: Optional[str]) -> List[Dict[str, Any]]:
+    """Per-day inflow/outflow from the raw ledger for dates in (after, until]"""
+    date_range = {}
+    if after is not None:
+        date_range["$gt"] = after
+    if until is not None:
+        date_range["$lte"] = until
+    match = {"capital_id": capital_id}
+    if date_range:
+        match["entry_date"] = date_range
+    return await db.ledger.aggregate(ledger_day_totals_pipeline(match)).to_list(None)
+
+async def snapshot_ledger(capital_id: str, until: date) -> int:
+    """Write daily snapshots for closed days up to ``until``; returns how many were written"""
+    await check_ledger_converted(capital_id)
+    until_key = until.strftime("%Y-%m-%d")
+    last = await latest_ledger_snapshot(capital_id)
+    balance = last["balance"] if last else 0
+    operations = []
+    for day in await ledger_days(capital_id, last["date"] if last else None, until_key):
+        balance += day["inflow"] - day["outflow"]
+        operations.append(UpdateOne(
+            {"capital_id": capital_id, "date": day["_id"]},
+            {"$set": {"inflow": day["inflow"], "outflow": day["outflow"], "balance": balance}},
+            upsert=True
+        ))
+    if operations:
+        await db.ledger_snapshots.bulk_write(operations, ordered=True)
+    return len(operations)
+
+async def snapshot_ledgers(until: Optional[date] = None) -> Dict[str, int]:
+    """Snapshot every capital up to ``until`` (default: yesterday, the last closed day)"""
+    until = until or date.today() - timedelta(days=1)
+    if until >= date.today():
+        # Снимок незакрытого дня зафиксировал бы неполные обороты
+        raise ValueError(f"Cannot snapshot {until}: only days before today are closed")
+    report = {"capitals": 0, "snapshots": 0}
+    for capital_id in await db.ledger.distinct("capital_id"):
+        report["capitals"] += 1
+        report["snapshots"] += await snapshot_ledger(capital_id, until)
+    logger.info("Ledger snapshots up to %s: %s", until, report)
+    return report
+
+async def minor_balance_at(capital_id: str, at: str) -> int:
+    """Balance in kopecks at the end of day ``at``: last snapshot on or before it plus the ledger tail"""
+    await check_ledger_converted(capital_id)
+    snapshot = await latest_ledger_snapshot(capital_id, at)
+    balance = snapshot["balance"] if snapshot else 0
+    for day in await ledger_days(capital_id, snapshot["date"] if snapshot else None, at):
+        balance += day["inflow"] - day["outflow"]
+    return balance
+
+async def balance_at(capital_id: str, at: str) -> Dict[str, Any]:
+    return {"capital_id": capital_id, "date": at, "balance": from_minor(await minor_balance_at(capital_id, at))}
+
+async def cash_flow(capital_id: str, date_from: str, date_to: str) -> Dict[str, Any]:
+    """Daily inflow/outflow between two dates with opening and closing balances"""
+    opening_day = (datetime.strptime(date_from, "%Y-%m-%d").date() - timedelta(days=1)).strftime("%Y-%m-%d")
+    opening = await minor_balance_at(capital_id, opening_day)
+    
+    snapshots = await db.ledger_snapshots.find(
+        {"capital_id": capital_id, "date": {"$gte": date_from, "$lte": date_to}}, {"_id": 0}
+    ).sort("date", ASCENDING).to_list(None)
+    days = [{"date": s["date"], "inflow": s["inflow"], "outflow": s["outflow"]} for s in snapshots]
+    # Дни после последнего снимка берутся из журнала
+    last = await latest_ledger_snapshot(capital_id)
+    tail_after = max(last["date"], opening_day) if last else opening_day
+    for day in await ledger_days(capital_id, tail_after, date_to):
+        days.append({"date": day["_id"], "inflow": day["inflow"], "outflow": day["outflow"]})
+    
+    balance = opening
+    for day in days:
+        balance += day["inflow"] - day["outflow"]
+        day["balance"] = balance
+    return {
+        "capital_id": capital_id,
+        "date_from": date_from,
+        "date_to": date_to,
+        "opening_balance": from_minor(opening),
+        "closing_balance": from_minor(balance),
+        "inflow": from_minor(sum(day["inflow"] for day in days)),
+        "outflow": from_minor(sum(day["outflow"] for day in days)),
+        "days": [money_from_db(day, MONEY_FIELDS["ledger_snapshots"]) for day in days],
+    }
+
+async def verify_ledger(capital_id: str, full: bool = False) -> Dict[str, Any]:
+    """Compare capital.balance with the balance derived from the ledger.
+
+    By default the ledger balance is the last snapshot plus the tail; with
+    ``full`` the whole ledger is summed, which also checks the snapshots.
+    """
+    capital = await db.capitals.find_one({"id": capital_id}, {"_id": 0, "balance": 1})
+    if not capital:
+        raise HTTPException(status_code=404, detail="Capital not found")
+    await check_ledger_converted(capital_id)
+    snapshot = None if full else await latest_ledger_snapshot(capital_id)
+    ledger_balance = snapshot["balance"] if snapshot else 0
+    for day in await ledger_days(capital_id, snapshot["date"] if snapshot else None, None):
+        ledger_balance += day["inflow"] - day["outflow"]
+    difference = capital.get("balance", 0) - ledger_balance
+    return {
+        "capital_id": capital_id,
+        "balance": stored_to_rubles(capital.get("balance", 0)),
+        "ledger_balance": from_minor(ledger_balance),
+        "snapshot_date": snapshot["date"] if snapshot else None,
+        "difference": from_minor(difference),
+        "ok": difference == 0,
+    }
+
+async def backfill_ledger_openings() -> int:
+    """Record the current balance as the opening entry of capitals without a ledger"""
+    with_ledger = set(await db.ledger.distinct("capital_id"))
+    created = 0
+    async for capital in db.capitals.find({}, {"_id": 0, "id": 1, "balance": 1}):
+        if capital["id"] in with_ledger:
+            continue
+        await record_ledger_entry(
+            capital["id"], capital.get("balance", 0), LedgerKind.opening, note="balance before the ledger existed"
+        )
+        created += 1
+    return created
+
 # Routes
 
 # User management
@@ -280,20 +1968,43 @@ async def get_current_user_info(current_user: str = Depends(get_current_user)):
 async def create_capital(capital: CapitalCreate, current_user: str = Depends(get_current_user)):
     capital_dict = capital.dict()
     capital_obj = Capital(**capital_dict, owner_id=current_user)
-    await db.capitals.insert_one(capital_obj.dict())
+    
+    async def insert_capital(session):
+        document = money_to_db(capital_obj.dict(), MONEY_FIELDS["capitals"])
+        await db.capitals.insert_one(document, session=session)
+        await db.capital_stats.insert_one(empty_capital_stats(capital_obj.id), session=session)
+        await record_ledger_entry(capital_obj.id, document["balance"], LedgerKind.opening, session=session)
+    
+    await run_in_transaction(insert_capital)
+    invalidate_user_capitals(current_user)
     return capital_obj
 
 @api_router.get("/capitals", response_model=List[Capital])
-async def get_user_capitals(current_user: str = Depends(get_current_user)):
-    capitals = await db.capitals.find({"owner_id": current_user, "is_active": True}).to_list(100)
-    return [Capital(**mongo_to_dict(capital)) for capital in capitals]
+async def get_user_capitals(
+    current_user: str = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None)
+):
+    capitals = await db.capitals.find(
+        {"owner_id": current_user, "is_active": True}, CAPITAL_PROJECTION
+    ).to_list(100)
+    etag = make_etag("capitals", [(capital["id"], capital.get("revision", 0)) for capital in capitals])
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    return db_response([capital_from_db(capital) for capital in capitals], etag=etag)
 
 @api_router.get("/capitals/{capital_id}", response_model=Capital)
-async def get_capital(capital_id: str, current_user: str = Depends(get_current_user)):
-    capital = await db.capitals.find_one({"id": capital_id, "owner_id": current_user})
+async def get_capital(
+    capital_id: str,
+    current_user: str = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None)
+):
+    capital = await db.capitals.find_one({"id": capital_id, "owner_id": current_user}, CAPITAL_PROJECTION)
     if not capital:
         raise HTTPException(status_code=404, detail="Capital not found")
-    return Capital(**mongo_to_dict(capital))
+    etag = make_etag("capital", capital_id, capital.get("revision", 0))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    return db_response(capital_from_db(capital), etag=etag)
 
 @api_router.put("/capitals/{capital_id}", response_model=Capital)
 async def update_capital(capital_id: str, updates: CapitalUpdate, current_user: str = Depends(get_current_user)):
@@ -303,167 +2014,691 @@ async def update_capital(capital_id: str, updates: CapitalUpdate, current_user:
         raise HTTPException(status_code=404, detail="Capital not found")
     
     # Convert updates to dict and filter out None values
-    update_dict = {k: v for k, v in updates.dict().items() if v is not None}
+    update_dict = money_to_db(
+        {k: v for k, v in updates.dict(exclude={"version"}).items() if v is not None}, MONEY_FIELDS["capitals"]
+    )
+    query = {"id": capital_id, "owner_id": current_user}
+    if updates.version is not None:
+        query.update(version_filter(updates.version))
+        conditional_writes_total.inc(("capital",))
     
-    if update_dict:
-        result = await db.capitals.update_one(
-            {"id": capital_id, "owner_id": current_user},
-            {"$set": update_dict}
+    async def apply_update(session):
+        previous = await db.capitals.find_one_and_update(
+            query,
+            {"$set": update_dict, "$inc": {"revision": 1, "version": 1}},
+            projection={"_id": 0, "balance": 1},
+            return_document=ReturnDocument.BEFORE,
+            session=session
         )
-        
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Capital not found")
+        if previous is None:
+            current = await db.capitals.find_one(
+                {"id": capital_id, "owner_id": current_user}, CAPITAL_PROJECTION, session=session
+            )
+            if current is None:
+                raise HTTPException(status_code=404, detail="Capital not found")
+            raise VersionConflict("capital", capital_from_db(current))
+        # Ручная установка баланса записывается в журнал как корректировка на разницу
+        if "balance" in update_dict:
+            difference = update_dict["balance"] - previous.get("balance", 0)
+            if difference:
+                await record_ledger_entry(capital_id, difference, LedgerKind.adjustment, session=session)
+    
+    if update_dict:
+        await run_in_transaction(apply_update)
+        invalidate_user_capitals(current_user)
     
     updated_capital = await db.capitals.find_one({"id": capital_id})
-    return Capital(**mongo_to_dict(updated_capital))
+    return Capital(**capital_from_db(mongo_to_dict(updated_capital)))
 
 # Client management
 @api_router.post("/clients", response_model=Client)
 async def create_client(client: ClientCreate, current_user: str = Depends(get_current_user)):
-    # Verify capital ownership
-    capital = await db.capitals.find_one({"id": client.capital_id, "owner_id": current_user})
-    if not capital:
-        raise HTTPException(status_code=404, detail="Capital not found")
+    client_obj = build_client(client)
+    logger.debug(
+        "create_client: %s schedule with %d installments",
+        "custom" if client.schedule else "generated", len(client_obj.schedule)
+    )
     
-    # Check if there's enough balance for the purchase
-    current_balance = capital.get("balance", 0.0)
-    purchase_amount = client.purchase_amount or client.debt_amount or client.total_amount or 0
+    purchase_amount = to_minor(client_obj.purchase_amount)
+    client_doc = client_document(client_obj.dict())
     
-    if current_balance < purchase_amount:
+    async def insert_client(session):
+        # Verify capital ownership and deduct the purchase amount in one step
+        await debit_capital(
+            client.capital_id, purchase_amount, owner_id=current_user, session=session,
+            kind=LedgerKind.client_purchase, ref_id=client_obj.client_id
+        )
+        try:
+            await db.clients.insert_one(dict(client_doc), session=session)
+        except Exception:
+            if session is None:
+                # No transaction to roll back: return the money by hand
+                await adjust_capital_balance(
+                    client.capital_id, purchase_amount,
+                    kind=LedgerKind.client_purchase_refund, ref_id=client_obj.client_id
+                )
+            raise
+        await apply_stats_delta(client.capital_id, client_stats(client_doc), session=session)
+        await bump_capital_revision(client.capital_id, session=session)
+    
+    await run_in_transaction(insert_client)
+    return client_obj
+
+# Максимальный размер одного чанка массового импорта
+MAX_BULK_CLIENTS = int(os.environ.get('MAX_BULK_CLIENTS', '1000'))
+
+def format_row_error(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors()
+        )
+    if isinstance(error, HTTPException):
+        return str(error.detail)
+    return str(error)
+
+@api_router.post("/clients/bulk")
+async def create_clients_bulk(payload: ClientBulkCreate, current_user: str = Depends(get_current_user)):
+    """Create many clients at once with a single balance debit.
+
+    Large files are sent as several requests; ``offset`` keeps row numbers
+    in the report relative to the whole file.
+    """
+    if len(payload.clients) > MAX_BULK_CLIENTS:
         raise HTTPException(
-            status_code=400, 
-            detail=f"Недостаточно средств в капитале. Доступно: {current_balance}₽, требуется: {purchase_amount}₽"
+            status_code=413,
+            detail=f"Слишком много клиентов в одном запросе: {len(payload.clients)}, максимум {MAX_BULK_CLIENTS}"
         )
     
-    # Generate payment schedule
-    print(f"DEBUG: client.schedule is not None: {client.schedule is not None}")
-    if client.schedule:
-        print(f"DEBUG: client.schedule length: {len(client.schedule)}")
-        print(f"DEBUG: First schedule item: {client.schedule[0] if client.schedule else 'None'}")
-        # Use provided schedule from import
-        schedule = []
-        for s in client.schedule:
-            if isinstance(s, dict):
-                schedule.append(PaymentSchedule(**s))
-            elif hasattr(s, 'dict'):
-                schedule.append(PaymentSchedule(**s.dict()))
-            else:
-                schedule.append(s)
-        print(f"DEBUG: Converted schedule length: {len(schedule)}")
-        print(f"DEBUG: First converted item status: {schedule[0].status if schedule else 'None'}")
-    else:
-        print("DEBUG: Using generated schedule")
-        # Generate default schedule
-        schedule = generate_payment_schedule(client.start_date, client.monthly_payment, client.months)
+    # Verify capital ownership
+    capital = await db.capitals.find_one({"id": payload.capital_id, "owner_id": current_user})
+    if not capital:
+        raise HTTPException(status_code=404, detail="Capital not found")
     
-    end_date = schedule[-1].payment_date if schedule else client.start_date
+    rows = [(payload.offset + index, row) for index, row in enumerate(payload.clients)]
+    return await import_client_rows(payload.capital_id, rows)
+
+async def import_client_rows(capital_id: str, rows: List[Tuple[int, Dict[str, Any]]]) -> Dict[str, Any]:
+    """Validate import rows and insert the valid ones with a single balance debit.
+
+    Each row is ``(row_number, data)``; the report refers to rows by that number.
+    """
+    results = []
+    parsed = []
+    for row_number, row in rows:
+        try:
+            parsed.append((row_number, ClientCreate(**{**row, "capital_id": capital_id})))
+        except ValueError as e:
+            results.append({"row": row_number, "status": "error", "detail": format_row_error(e)})
     
-    client_dict = client.dict()
+    # Графики всего чанка считаются одним вызовом и попадают в кэш для build_client;
+    # при ошибке в дате строки ниже проходят по одной и получают свою ошибку
+    try:
+        schedule_dates((client.start_date, client.months) for _, client in parsed if not client.schedule)
+    except ValueError:
+        pass
     
-    # Handle both old and new data models
-    if client.debt_amount is None and client.total_amount is not None:
-        # Old model: use total_amount as debt_amount
-        client_dict["debt_amount"] = client_dict["total_amount"]
-    elif client.total_amount is None and client.debt_amount is not None:
-        # New model: use debt_amount as total_amount for backward compatibility
-        client_dict["total_amount"] = client_dict["debt_amount"]
-    elif client.total_amount is None and client.debt_amount is None:
-        # Neither provided, raise error
-        raise HTTPException(status_code=400, detail="Either debt_amount or total_amount must be provided")
+    documents = []
+    amounts = []
+    for row_number, client in parsed:
+        try:
+            client_obj = build_client(client)
+        except (ValueError, HTTPException) as e:
+            results.append({"row": row_number, "status": "error", "detail": format_row_error(e)})
+            continue
+        documents.append(client_document(client_obj.dict()))
+        amounts.append(to_minor(client_obj.purchase_amount))
+        results.append({"row": row_number, "status": "created", "client_id": client_obj.client_id})
     
-    # If purchase_amount is not provided, use debt_amount
-    if client_dict["purchase_amount"] is None:
-        client_dict["purchase_amount"] = client_dict["debt_amount"]
+    total_amount = sum(amounts)
     
-    client_obj = Client(
-        **{k: v for k, v in client_dict.items() if k not in ['months', 'schedule']},
-        schedule=[s.dict() for s in schedule],  # Convert to dict for MongoDB
-        end_date=end_date
-    )
+    async def insert_clients(session):
+        # Check and debit the whole chunk in one atomic update
+        await debit_capital(
+            capital_id, total_amount, session=session,
+            kind=LedgerKind.client_purchase, note=f"bulk import of {len(documents)} clients"
+        )
+        inserted = documents
+        refund = 0
+        try:
+            await db.clients.insert_many([dict(doc) for doc in documents], ordered=False, session=session)
+        except BulkWriteError as e:
+            if session is not None:
+                # The transaction is rolled back as a whole
+                raise
+            # Return the money for the rows that were not inserted
+            failed = {err["index"]: err.get("errmsg", "insert failed") for err in e.details.get("writeErrors", [])}
+            refund = sum(amounts[i] for i in failed)
+            await adjust_capital_balance(
+                capital_id, refund,
+                kind=LedgerKind.client_purchase_refund, note=f"{len(failed)} clients were not inserted"
+            )
+            created = [r for r in results if r["status"] == "created"]
+            for i, message in failed.items():
+                created[i].update({"status": "error", "detail": message})
+                created[i].pop("client_id", None)
+            inserted = [doc for i, doc in enumerate(documents) if i not in failed]
+        
+        delta = {}
+        for document in inserted:
+            add_stats(delta, client_stats(document))
+        await apply_stats_delta(capital_id, delta, session=session)
+        await bump_capital_revision(capital_id, session=session)
+        return total_amount - refund
     
-    # Insert the client
-    await db.clients.insert_one(client_obj.dict())
+    if documents:
+        total_amount = await run_in_transaction(insert_clients)
     
-    # Deduct the purchase amount from capital balance
-    new_balance = current_balance - purchase_amount
-    await db.capitals.update_one(
-        {"id": client.capital_id},
-        {"$set": {"balance": new_balance}}
-    )
+    results.sort(key=lambda r: r["row"])
+    created_count = sum(1 for r in results if r["status"] == "created")
+    return {
+        "created": created_count,
+        "failed": len(results) - created_count,
+        "total_amount": from_minor(total_amount),
+        "results": results
+    }
+
+# Server-side import
+# Файл сохраняется во временный файл и разбирается потоково в фоновой задаче:
+# строки читаются пачками в потоке (csv / openpyxl read_only) и проходят через
+# тот же import_client_rows, что и /clients/bulk. Прогресс и ошибки по строкам
+# лежат в import_jobs, поэтому статус виден из любого воркера.
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '500'))
+IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', '1000'))
+MAX_IMPORT_BYTES = int(os.environ.get('MAX_IMPORT_BYTES', str(50 * 1024 * 1024)))
+IMPORT_FORM_OVERHEAD = 64 * 1024  # Границы multipart и поле capital_id
+IMPORT_UPLOAD_CHUNK = 1024 * 1024
+import_tasks: set = set()
+
+# Колонки листа Excel в том виде, в каком его разбирал фронтенд:
+# B — ФИО, C-E — суммы, F — начало, H.. — пары (дата платежа, статус), BD-BG — контакты
+XLSX_NAME, XLSX_PURCHASE, XLSX_DEBT, XLSX_MONTHLY, XLSX_START = 1, 2, 3, 4, 5
+XLSX_SCHEDULE_START, XLSX_SCHEDULE_END = 7, 55
+XLSX_CONTACTS = ("guarantor_name", "client_address", "client_phone", "guarantor_phone")
+IMPORT_DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y")
+
+def import_date(value) -> str:
+    """Normalize an Excel serial, datetime or DD.MM.YYYY-like string to YYYY-MM-DD"""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, (int, float)):
+        return from_excel(value).strftime("%Y-%m-%d")
+    text = str(value).strip()
+    for date_format in IMPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized date: {text}")
+
+def import_payment_status(value) -> str:
+    text = str(value or "").strip().lower()
+    if "оплачен" in text or "выплачен" in text or "paid" in text:
+        return PaymentStatus.paid.value
+    if "просрочен" in text or "overdue" in text:
+        return PaymentStatus.overdue.value
+    return PaymentStatus.pending.value
+
+def import_number(value) -> float:
+    if value in (None, ""):
+        return 0.0
+    return float(str(value).replace(",", ".").replace(" ", "")) if isinstance(value, str) else float(value)
+
+def xlsx_client_row(cells: Tuple[Any, ...]) -> Dict[str, Any]:
+    """Map a positional spreadsheet row to ClientCreate fields"""
+    cells = tuple(cells) + (None,) * max(0, XLSX_SCHEDULE_END + len(XLSX_CONTACTS) - len(cells))
+    monthly_payment = import_number(cells[XLSX_MONTHLY])
+    schedule = []
+    for index in range(XLSX_SCHEDULE_START, XLSX_SCHEDULE_END, 2):
+        payment_date, payment_status = cells[index], cells[index + 1]
+        if payment_date in (None, "") or not str(payment_date).strip():
+            continue
+        payment_date = import_date(payment_date)
+        payment_status = import_payment_status(payment_status)
+        schedule.append({
+            "payment_date": payment_date,
+            "amount": monthly_payment,
+            "status": payment_status,
+            "paid_date": payment_date if payment_status == PaymentStatus.paid.value else None,
+        })
+    start = cells[XLSX_START]
+    row = {
+        "name": str(cells[XLSX_NAME] or "").strip(),
+        "product": "Товар не указан",
+        "purchase_amount": import_number(cells[XLSX_PURCHASE]),
+        "debt_amount": import_number(cells[XLSX_DEBT]),
+        "monthly_payment": monthly_payment,
+        "start_date": import_date(start) if start not in (None, "") else date.today().strftime("%Y-%m-%d"),
+        "months": len(schedule) or 12,
+        "schedule": schedule,
+    }
+    for offset, field in enumerate(XLSX_CONTACTS):
+        value = cells[XLSX_SCHEDULE_END + offset]
+        row[field] = str(value).strip() if value not in (None, "") else None
+    return row
+
+def csv_client_row(values: Dict[str, str]) -> Dict[str, Any]:
+    """CSV columns are named after ClientCreate fields; empty cells are left out"""
+    return {key: value for key, value in values.items() if key in ClientCreate.model_fields}
+
+def read_import_batches(path: str, file_format: str) -> Iterator[List[Tuple[int, Any]]]:
+    """Yield batches of (row number in the file, raw row) without loading the whole file.
+
+    Blocking: iterate it from a worker thread.
+    """
+    batch = []
+    if file_format == "xlsx":
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            sheet = workbook.worksheets[0]
+            for row_number, cells in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
+                if not any(cell is not None and str(cell).strip() for cell in cells):
+                    continue
+                batch.append((row_number, cells))
+                if len(batch) == IMPORT_BATCH_SIZE:
+                    yield batch
+                    batch = []
+        finally:
+            workbook.close()
+    else:
+        with open(path, encoding="utf-8-sig", newline="") as file:
+            sample = file.read(4096)
+            file.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+            except csv.Error:
+                dialect = csv.excel
+            reader = csv.DictReader(file, dialect=dialect)
+            for values in reader:
+                values = {
+                    key.strip(): value.strip() for key, value in values.items()
+                    if key and isinstance(value, str) and value.strip()
+                }
+                if values:
+                    batch.append((reader.line_num, values))
+                if len(batch) == IMPORT_BATCH_SIZE:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+async def update_import_job(job_id: str, update: Dict[str, Any]) -> None:
+    update.setdefault("$set", {})["updated_at"] = datetime.utcnow()
+    await db.import_jobs.update_one({"job_id": job_id}, update)
+
+async def run_import_job(job_id: str, capital_id: str, path: str, file_format: str) -> None:
+    to_row = xlsx_client_row if file_format == "xlsx" else csv_client_row
+    batches = None
+    read = None
+    try:
+        await update_import_job(job_id, {"$set": {"status": ImportJobStatus.running.value}})
+        batches = read_import_batches(path, file_format)
+        while True:
+            # shield: при отмене поток дочитывает пачку, и генератор можно закрыть после него
+            read = asyncio.ensure_future(asyncio.to_thread(next, batches, None))
+            batch = await asyncio.shield(read)
+            if batch is None:
+                break
+            rows = []
+            errors = []
+            for row_number, raw in batch:
+                try:
+                    rows.append((row_number, to_row(raw)))
+                except ValueError as e:
+                    errors.append({"row": row_number, "status": "error", "detail": format_row_error(e)})
+            report = await import_client_rows(capital_id, rows)
+            errors.extend(r for r in report["results"] if r["status"] == "error")
+            errors.sort(key=lambda r: r["row"])
+            await update_import_job(job_id, {
+                "$inc": {
+                    "rows": len(batch),
+                    "created": report["created"],
+                    "failed": len(batch) - report["created"],
+                    "total_amount": to_minor(report["total_amount"]),
+                },
+                "$push": {"errors": {"$each": errors, "$slice": IMPORT_MAX_ERRORS}},
+            })
+        await update_import_job(job_id, {"$set": {
+            "status": ImportJobStatus.completed.value, "finished_at": datetime.utcnow()
+        }})
+    except asyncio.CancelledError:
+        await update_import_job(job_id, {"$set": {
+            "status": ImportJobStatus.failed.value, "error": "interrupted by server shutdown",
+            "finished_at": datetime.utcnow(),
+        }})
+        raise
+    except Exception as e:
+        logger.exception("Import job %s failed", job_id)
+        await update_import_job(job_id, {"$set": {
+            "status": ImportJobStatus.failed.value, "error": format_row_error(e), "finished_at": datetime.utcnow()
+        }})
+    finally:
+        if batches is not None:
+            # Закрытие генератора закрывает книгу openpyxl и её файл до удаления
+            if read is not None:
+                await asyncio.wait({read})
+            await asyncio.to_thread(batches.close)
+        os.unlink(path)
+
+class ImportSizeLimitMiddleware:
+    """Reject oversized imports by Content-Length before the body is read.
+
+    FastAPI spools the whole multipart body before the endpoint runs, so a
+    check in the handler would not bound memory or disk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != "/api/import":
+            return await self.app(scope, receive, send)
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is None or not length.isdigit():
+            response = ORJSONResponse({"detail": "Content-Length is required"}, status_code=411)
+        elif int(length) > MAX_IMPORT_BYTES + IMPORT_FORM_OVERHEAD:
+            response = ORJSONResponse({"detail": f"Файл больше {MAX_IMPORT_BYTES} байт"}, status_code=413)
+        else:
+            return await self.app(scope, receive, send)
+        await response(scope, receive, send)
+
+app.add_middleware(ImportSizeLimitMiddleware)
+
+async def save_upload(upload: UploadFile) -> str:
+    """Copy the upload to a temporary file in chunks, enforcing MAX_IMPORT_BYTES.
+
+    The request size is bounded up front by ImportSizeLimitMiddleware; this
+    check only catches a file that fits the request but not the limit.
+    """
+    suffix = os.path.splitext(upload.filename or "")[1]
+    file = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+    size = 0
+    try:
+        while True:
+            chunk = await upload.read(IMPORT_UPLOAD_CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > MAX_IMPORT_BYTES:
+                raise HTTPException(status_code=413, detail=f"Файл больше {MAX_IMPORT_BYTES} байт")
+            await asyncio.to_thread(file.write, chunk)
+    except BaseException:
+        file.close()
+        os.unlink(file.name)
+        raise
+    file.close()
+    return file.name
+
+@api_router.post("/import", status_code=202)
+async def start_import(
+    file: UploadFile = File(...),
+    capital_id: str = Form(...),
+    current_user: str = Depends(get_current_user)
+):
+    """Import clients from an uploaded .xlsx or .csv file in the background.
+
+    Requests above MAX_IMPORT_BYTES (by Content-Length) are rejected with
+    413 before the body is read. Returns the job right away; poll
+    ``/api/import/{job_id}`` for progress.
+    """
+    file_format = os.path.splitext(file.filename or "")[1].lower().lstrip(".")
+    if file_format not in ("xlsx", "csv"):
+        raise HTTPException(status_code=415, detail="Поддерживаются только файлы .xlsx и .csv")
+    capital = await db.capitals.find_one({"id": capital_id, "owner_id": current_user}, {"_id": 1})
+    if not capital:
+        raise HTTPException(status_code=404, detail="Capital not found")
     
-    return client_obj
+    path = await save_upload(file)
+    job = ImportJob(owner_id=current_user, capital_id=capital_id, filename=file.filename or "")
+    await db.import_jobs.insert_one(money_to_db(job.dict(), MONEY_FIELDS["import_jobs"]))
+    task = asyncio.create_task(run_import_job(job.job_id, capital_id, path, file_format))
+    # Держим ссылку, иначе задачу может собрать GC
+    import_tasks.add(task)
+    task.add_done_callback(import_tasks.discard)
+    return job
+
+@api_router.get("/import/{job_id}", response_model=ImportJob)
+async def get_import_job(job_id: str, current_user: str = Depends(get_current_user)):
+    job = await db.import_jobs.find_one({"job_id": job_id, "owner_id": current_user}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return db_response(money_from_db(job, MONEY_FIELDS["import_jobs"]))
 
 @api_router.get("/clients", response_model=List[Client])
-async def get_clients(capital_id: Optional[str] = None, current_user: str = Depends(get_current_user)):
-    # Get user's capitals
-    user_capitals = await db.capitals.find({"owner_id": current_user}).to_list(100)
-    capital_ids = [cap["id"] for cap in user_capitals]
-    
-    query = {"capital_id": {"$in": capital_ids}}
+async def get_clients(
+    request: Request,
+    response: Response,
+    capital_id: Optional[str] = None,
+    status: Optional[ClientStatus] = None,
+    product: Optional[str] = None,
+    start_from: Optional[str] = None,
+    start_to: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    limit: int = Query(1000, ge=1, le=5000),
+    after: Optional[str] = None,
+    with_total: bool = False,
+    fields: Optional[str] = None,
+    view: ClientView = ClientView.full,
+    schedule_slice: Optional[int] = None,
+    capitals: OwnedCapitals = Depends(get_owned_capitals),
+    if_none_match: Optional[str] = Header(None)
+):
+    """List clients; ``fields`` (comma separated) or ``view=summary`` trim the documents"""
+    fieldset = ClientFieldset(fields, view, schedule_slice)
+    query = {"capital_id": {"$in": capitals.ids}}
     if capital_id:
-        if capital_id not in capital_ids:
-            raise HTTPException(status_code=403, detail="Access denied")
+        await capitals.check(capital_id)
         query = {"capital_id": capital_id}
     
-    clients = await db.clients.find(query).to_list(1000)
-    return [Client(**mongo_to_dict(client)) for client in clients]
+    revisions = await capital_revisions([capital_id] if capital_id else capitals.ids)
+    etag = make_etag("clients", revisions, request.url.query)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    if status:
+        query["status"] = status.value
+    if product:
+        query["product"] = product
+    if start_from or start_to:
+        query["start_date"] = range_filter(start_from, start_to)
+    if min_amount is not None or max_amount is not None:
+        query["debt_amount"] = range_filter(to_minor(min_amount), to_minor(max_amount))
+    
+    clients = await fetch_page(
+        db.clients, query, "client_id", response, limit, after, with_total, projection=fieldset.projection
+    )
+    return db_response([fieldset.from_db(client) for client in clients], response, etag)
 
 @api_router.get("/clients/{client_id}", response_model=Client)
-async def get_client(client_id: str, current_user: str = Depends(get_current_user)):
-    # Get user's capitals
-    user_capitals = await db.capitals.find({"owner_id": current_user}).to_list(100)
-    capital_ids = [cap["id"] for cap in user_capitals]
-    
-    client = await db.clients.find_one({"client_id": client_id, "capital_id": {"$in": capital_ids}})
+async def get_client(
+    request: Request,
+    client_id: str,
+    fields: Optional[str] = None,
+    view: ClientView = ClientView.full,
+    schedule_slice: Optional[int] = None,
+    capitals: OwnedCapitals = Depends(get_owned_capitals),
+    if_none_match: Optional[str] = Header(None)
+):
+    fieldset = ClientFieldset(fields, view, schedule_slice)
+    client = await db.clients.find_one(
+        {"client_id": client_id, "capital_id": {"$in": capitals.ids}}, fieldset.projection
+    )
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
-    return Client(**mongo_to_dict(client))
+    
+    updated_at = client.get("updated_at")
+    etag = make_etag("client", client_id, updated_at, request.url.query)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    response = db_response(fieldset.from_db(client), etag=etag)
+    if isinstance(updated_at, datetime):
+        response.headers["Last-Modified"] = format_datetime(updated_at.replace(tzinfo=timezone.utc), usegmt=True)
+    return response
 
 @api_router.put("/clients/{client_id}", response_model=Client)
-async def update_client(client_id: str, updates: ClientUpdate, current_user: str = Depends(get_current_user)):
-    # Get user's capitals
-    user_capitals = await db.capitals.find({"owner_id": current_user}).to_list(100)
-    capital_ids = [cap["id"] for cap in user_capitals]
-    
+async def update_client(client_id: str, updates: ClientUpdate, capitals: OwnedCapitals = Depends(get_owned_capitals)):
     # Convert updates to dict and filter out None values
-    update_dict = {k: v for k, v in updates.dict().items() if v is not None}
-    update_dict["updated_at"] = datetime.utcnow()
-    
-    result = await db.clients.update_one(
-        {"client_id": client_id, "capital_id": {"$in": capital_ids}},
-        {"$set": update_dict}
+    update_dict = money_to_db(
+        {k: v for k, v in updates.dict(exclude={"version"}).items() if v is not None}, MONEY_FIELDS["clients"]
     )
+    if "debt_amount" in update_dict:
+        update_dict["total_amount"] = update_dict["debt_amount"]
+    if "status" in update_dict:
+        update_dict["status_source"] = "manual"  # пересчёт по графику его не трогает
+    update_dict["updated_at"] = datetime.utcnow()
+    query = {"client_id": client_id, "capital_id": {"$in": capitals.ids}}
+    if updates.version is not None:
+        query.update(version_filter(updates.version))
+        conditional_writes_total.inc(("client",))
     
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Client not found")
+    async def apply_update(session):
+        previous = await db.clients.find_one_and_update(
+            query,
+            {"$set": update_dict, "$inc": {"version": 1}},
+            projection={"schedule": 0, "sched": 0},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        
+        if previous is None:
+            current = await db.clients.find_one(
+                {"client_id": client_id, "capital_id": {"$in": capitals.ids}}, CLIENT_PROJECTION, session=session
+            )
+            if current is None:
+                raise HTTPException(status_code=404, detail="Client not found")
+            raise VersionConflict("client", client_from_db(current))
+        
+        client = await db.clients.find_one({"client_id": client_id}, session=session)
+        await apply_stats_delta(
+            client["capital_id"],
+            add_stats(client_summary_stats(client), client_summary_stats(previous, -1)),
+            session=session
+        )
+        await bump_capital_revision(client["capital_id"], session=session)
+        return client
     
-    client = await db.clients.find_one({"client_id": client_id})
-    return Client(**mongo_to_dict(client))
+    client = await run_in_transaction(apply_update)
+    return Client(**client_from_db(mongo_to_dict(client)))
 
 @api_router.delete("/clients/{client_id}")
-async def delete_client(client_id: str, current_user: str = Depends(get_current_user)):
-    # Get user's capitals
-    user_capitals = await db.capitals.find({"owner_id": current_user}).to_list(100)
-    capital_ids = [cap["id"] for cap in user_capitals]
-    
-    # Delete client
-    result = await db.clients.delete_one({"client_id": client_id, "capital_id": {"$in": capital_ids}})
-    
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Client not found")
+async def delete_client(client_id: str, capitals: OwnedCapitals = Depends(get_owned_capitals)):
+    async def remove_client(session):
+        # Delete client
+        client = await db.clients.find_one_and_delete(
+            {"client_id": client_id, "capital_id": {"$in": capitals.ids}},
+            session=session
+        )
+        
+        if client is None:
+            raise HTTPException(status_code=404, detail="Client not found")
+        await apply_stats_delta(client["capital_id"], client_stats(client, -1), session=session)
+        
+        # Delete related payments
+        await db.payments.delete_many({"client_id": client_id}, session=session)
+        await bump_capital_revision(client["capital_id"], session=session)
     
-    # Delete related payments
-    await db.payments.delete_many({"client_id": client_id})
+    await run_in_transaction(remove_client)
     
     return {"message": "Client and related payments deleted successfully"}
 
 # Update payment status
+def installment_matches(entry: Dict[str, Any], installment: Dict[str, Any]) -> bool:
+    """Python counterpart of the array filter: equality and $in conditions"""
+    for field, condition in installment.items():
+        value = entry.get(field)
+        if isinstance(condition, dict):
+            if value not in condition["$in"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+async def update_installment(
+    query: Dict[str, Any],
+    installment: Dict[str, Any],
+    changes: Dict[str, Any],
+    session=None,
+    require_match: bool = False
+) -> Optional[Dict[str, Any]]:
+    """Set ``changes`` on the first schedule entry matching ``installment`` in place.
+
+    One find_one_and_update with the positional operator instead of rewriting
+    the whole schedule, so concurrent changes to other installments are not
+    lost. Only one entry is changed even if several match, so the returned
+    entry is exactly the one that was updated.
+    Returns the client's capital_id and, under ``schedule``, the matching
+    entry as it was before the update (absent if none matched);
+    None if no client matched ``query`` or, with ``require_match``, no
+    installment of the client matched ``installment``.
+    """
+    update = {f"schedule.$.{field}": value for field, value in changes.items()}
+    update["updated_at"] = datetime.utcnow()
+    rows_query = {**query, "sched": {"$exists": False}, "schedule": {"$elemMatch": installment}}
+    client = await db.clients.find_one_and_update(
+        rows_query,
+        {"$set": update, "$inc": {"version": 1}},
+        projection={"_id": 0, "capital_id": 1, "schedule": {"$elemMatch": installment}},
+        return_document=ReturnDocument.BEFORE,
+        session=session
+    )
+    if client:
+        return client
+    if not require_match:
+        # Клиент без подходящего платежа: возвращаем только capital_id
+        client = await db.clients.find_one(
+            {**query, "sched": {"$exists": False}}, {"_id": 0, "capital_id": 1}, session=session
+        )
+        if client:
+            return client
+    return await update_columnar_installment(query, installment, changes, session, require_match)
+
+async def update_columnar_installment(
+    query: Dict[str, Any],
+    installment: Dict[str, Any],
+    changes: Dict[str, Any],
+    session=None,
+    require_match: bool = False
+) -> Optional[Dict[str, Any]]:
+    # Параллельные массивы не отфильтровать позиционным оператором: номер
+    # первого подходящего платежа находим в Python и пишем по нему, условно
+    # на прочитанную версию
+    projection = {"_id": 0, "capital_id": 1, "sched": 1, "version": 1}
+    for attempt in range(MAX_VERSION_RETRIES + 1):
+        client = await db.clients.find_one({**query, "sched": {"$exists": True}}, projection, session=session)
+        if not client:
+            return None
+        schedule = decode_schedule(client["sched"])
+        index = next((index for index, entry in enumerate(schedule) if installment_matches(entry, installment)), None)
+        if index is None:
+            return None if require_match else {"capital_id": client["capital_id"]}
+        update = {
+            f"sched.{SCHEDULE_COLUMNS[field]}.{index}": encode_schedule_value(field, value)
+            for field, value in changes.items()
+        }
+        update["updated_at"] = datetime.utcnow()
+        conditional_writes_total.inc(("client",))
+        result = await db.clients.update_one(
+            {**query, **version_filter(client.get("version", 0))},
+            {"$set": update, "$inc": {"version": 1}},
+            session=session
+        )
+        if result.matched_count:
+            return {"capital_id": client["capital_id"], "schedule": [schedule[index]]}
+        if attempt < MAX_VERSION_RETRIES:
+            version_conflicts_total.inc(("client", "retried"))
+    # Исчерпанные попытки уходят клиенту 409 и считаются обработчиком как rejected
+    current = await db.clients.find_one(query, CLIENT_PROJECTION, session=session)
+    if current is None:
+        return None
+    raise VersionConflict("client", client_from_db(current))
+
 @api_router.put("/clients/{client_id}/payments/{payment_date}")
 async def update_payment_status(
     client_id: str, 
     payment_date: str,
     request: dict,
-    current_user: str = Depends(get_current_user)
+    capitals: OwnedCapitals = Depends(get_owned_capitals)
 ):
     # Get status from request body
     status = request.get("status")
@@ -475,359 +2710,406 @@ async def update_payment_status(
     if status not in valid_statuses:
         raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {valid_statuses}")
     
-    # Get user's capitals
-    user_capitals = await db.capitals.find({"owner_id": current_user}).to_list(100)
-    capital_ids = [cap["id"] for cap in user_capitals]
-    
-    # Find the client
-    client = await db.clients.find_one({"client_id": client_id, "capital_id": {"$in": capital_ids}})
-    if not client:
-        raise HTTPException(status_code=404, detail="Client not found")
-    
-    # Get capital for balance update
-    capital = await db.capitals.find_one({"id": client["capital_id"]})
-    if not capital:
-        raise HTTPException(status_code=404, detail="Capital not found")
+    changes = {
+        "status": status,
+        "paid_date": date.today().strftime("%Y-%m-%d") if status == "paid" else None,
+    }
     
-    # Update the payment status in schedule
-    schedule = client.get("schedule", [])
-    updated = False
-    payment_amount = 0
-    previous_status = None
+    async def apply_status(session):
+        # Previous state of the installment comes back from the same atomic update
+        client = await update_installment(
+            {"client_id": client_id, "capital_id": {"$in": capitals.ids}},
+            {"payment_date": payment_date}, changes, session=session, require_match=True
+        )
+        if not client:
+            exists = await db.clients.count_documents(
+                {"client_id": client_id, "capital_id": {"$in": capitals.ids}}, limit=1, session=session
+            )
+            raise HTTPException(status_code=404, detail="Payment not found" if exists else "Client not found")
     
-    for payment in schedule:
-        if payment["payment_date"] == payment_date:
-            previous_status = payment.get("status", "pending")
-            payment_amount = payment.get("amount", 0)
-            
-            # Update payment status
-            payment["status"] = status
-            if status == "paid":
-                payment["paid_date"] = date.today().strftime("%Y-%m-%d")
-            else:
-                payment["paid_date"] = None
-            updated = True
-            break
+        payment = client["schedule"][0]
+        previous_status = payment.get("status", "pending")
+        payment_amount = stored_to_minor(payment.get("amount", 0))
+        stats_delta = add_stats(schedule_entry_stats(payment, -1), schedule_entry_stats({**payment, **changes}))
+        add_stats(stats_delta, await refresh_client_status(client_id, session=session))
     
-    if not updated:
-        raise HTTPException(status_code=404, detail="Payment not found")
+        # Update capital balance based on status change
+        balance_change = 0
     
-    # Update capital balance based on status change
-    current_balance = capital.get("balance", 0.0)
-    new_balance = current_balance
+        # If changing TO paid status, add payment to balance
+        if status == "paid" and previous_status != "paid":
+            balance_change = payment_amount
+        # If changing FROM paid status, subtract payment from balance
+        elif previous_status == "paid" and status != "paid":
+            balance_change = -payment_amount
     
-    # If changing TO paid status, add payment to balance
-    if status == "paid" and previous_status != "paid":
-        new_balance = current_balance + payment_amount
-    # If changing FROM paid status, subtract payment from balance
-    elif previous_status == "paid" and status != "paid":
-        new_balance = current_balance - payment_amount
+        await apply_stats_delta(client["capital_id"], stats_delta, session=session)
     
-    # Update the client with new schedule
-    await db.clients.update_one(
-        {"client_id": client_id},
-        {"$set": {"schedule": schedule, "updated_at": datetime.utcnow()}}
-    )
+        # Update capital balance if it changed
+        if balance_change:
+            await adjust_capital_balance(
+                client["capital_id"], balance_change, session=session,
+                kind=LedgerKind.payment if balance_change > 0 else LedgerKind.payment_reversal,
+                ref_id=client_id, note=payment_date
+            )
+        capital = await bump_capital_revision(client["capital_id"], session=session)
+        if not capital:
+            raise HTTPException(status_code=404, detail="Capital not found")
+        return balance_change, capital.get("balance", 0)
     
-    # Update capital balance if it changed
-    if abs(new_balance - current_balance) > 0.01:  # Only update if balance actually changed
-        await db.capitals.update_one(
-            {"id": client["capital_id"]},
-            {"$set": {"balance": new_balance}}
-        )
+    balance_change, new_balance = await run_in_transaction(apply_status)
     
     return {
         "message": "Payment status updated successfully",
-        "balance_change": new_balance - current_balance if abs(new_balance - current_balance) > 0.01 else 0,
-        "new_balance": new_balance
+        "balance_change": from_minor(balance_change),
+        "new_balance": stored_to_rubles(new_balance)
     }
 
 @api_router.put("/clients/{client_id}", response_model=Client)
-async def update_client_old(client_id: str, updates: dict, current_user: str = Depends(get_current_user)):
-    # Get user's capitals
-    user_capitals = await db.capitals.find({"owner_id": current_user}).to_list(100)
-    capital_ids = [cap["id"] for cap in user_capitals]
-    
+async def update_client_old(client_id: str, updates: dict, capitals: OwnedCapitals = Depends(get_owned_capitals)):
+    updates.pop("version", None)
+    updates = money_to_db(updates, MONEY_FIELDS["clients"])
+    if isinstance(updates.get("schedule"), list):
+        updates["schedule"] = schedule_to_db(updates["schedule"])
+    if updates.get("debt_amount") is not None:
+        updates["total_amount"] = updates["debt_amount"]
+    if "status" in updates:
+        updates["status_source"] = "manual"
     updates["updated_at"] = datetime.utcnow()
     result = await db.clients.update_one(
-        {"client_id": client_id, "capital_id": {"$in": capital_ids}},
-        {"$set": updates}
+        {"client_id": client_id, "capital_id": {"$in": capitals.ids}},
+        {"$set": updates, "$inc": {"version": 1}}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Client not found")
     
     client = await db.clients.find_one({"client_id": client_id})
-    return Client(**mongo_to_dict(client))
+    return Client(**client_from_db(mongo_to_dict(client)))
 
 # Payment management
 @api_router.post("/payments", response_model=Payment)
-async def create_payment(payment: PaymentCreate, current_user: str = Depends(get_current_user)):
-    # Verify client ownership
-    user_capitals = await db.capitals.find({"owner_id": current_user}).to_list(100)
-    capital_ids = [cap["id"] for cap in user_capitals]
-    
-    client = await db.clients.find_one({"client_id": payment.client_id, "capital_id": {"$in": capital_ids}})
-    if not client:
-        raise HTTPException(status_code=404, detail="Client not found")
+async def create_payment(payment: PaymentCreate, capitals: OwnedCapitals = Depends(get_owned_capitals)):
+    # Matching unpaid installment becomes paid (missing status means pending)
+    installment = {
+        "payment_date": payment.payment_date,
+        "amount": to_minor(payment.amount),
+        "status": {"$in": [PaymentStatus.pending.value, PaymentStatus.overdue.value, None]},
+    }
+    changes = {"status": PaymentStatus.paid.value, "paid_date": payment.payment_date}
     
-    payment_dict = payment.dict()
-    payment_obj = Payment(**payment_dict, capital_id=client["capital_id"])
+    async def record_payment(session):
+        client = await update_installment(
+            {"client_id": payment.client_id, "capital_id": {"$in": capitals.ids}},
+            installment, changes, session=session
+        )
+        if not client:
+            raise HTTPException(status_code=404, detail="Client not found")
     
-    await db.payments.insert_one(payment_obj.dict())
+        payment_dict = payment.dict()
+        payment_obj = Payment(**payment_dict, capital_id=client["capital_id"])
     
-    # Update client schedule
-    client_obj = Client(**client)
-    for schedule_item in client_obj.schedule:
-        if (schedule_item.payment_date == payment.payment_date and 
-            schedule_item.amount == payment.amount and 
-            schedule_item.status == PaymentStatus.pending):
-            schedule_item.status = PaymentStatus.paid
-            schedule_item.paid_date = payment.payment_date
-            break
+        await db.payments.insert_one(money_to_db(payment_obj.dict(), MONEY_FIELDS["payments"]), session=session)
     
-    await db.clients.update_one(
-        {"client_id": payment.client_id},
-        {"$set": {"schedule": [s.dict() for s in client_obj.schedule], "updated_at": datetime.utcnow()}}
-    )
+        stats_delta = {}
+        for entry in client.get("schedule", []):
+            add_stats(stats_delta, schedule_entry_stats(entry, -1))
+            add_stats(stats_delta, schedule_entry_stats({**entry, **changes}))
+        if client.get("schedule"):
+            # Оплата последнего просроченного платежа меняет статус клиента
+            add_stats(stats_delta, await refresh_client_status(payment.client_id, session=session))
+        await apply_stats_delta(client["capital_id"], stats_delta, session=session)
+        await bump_capital_revision(client["capital_id"], session=session)
+        return payment_obj
     
-    return payment_obj
+    return await run_in_transaction(record_payment)
 
 @api_router.get("/payments", response_model=List[Payment])
-async def get_payments(capital_id: Optional[str] = None, current_user: str = Depends(get_current_user)):
-    user_capitals = await db.capitals.find({"owner_id": current_user}).to_list(100)
-    capital_ids = [cap["id"] for cap in user_capitals]
-    
-    query = {"capital_id": {"$in": capital_ids}}
+async def get_payments(
+    response: Response,
+    capital_id: Optional[str] = None,
+    client_id: Optional[str] = None,
+    status: Optional[PaymentStatus] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    limit: int = Query(1000, ge=1, le=5000),
+    after: Optional[str] = None,
+    with_total: bool = False,
+    capitals: OwnedCapitals = Depends(get_owned_capitals)
+):
+    query = {"capital_id": {"$in": capitals.ids}}
     if capital_id:
-        if capital_id not in capital_ids:
-            raise HTTPException(status_code=403, detail="Access denied")
+        await capitals.check(capital_id)
         query = {"capital_id": capital_id}
+    if client_id:
+        query["client_id"] = client_id
+    if status:
+        query["status"] = status.value
+    if date_from or date_to:
+        query["payment_date"] = range_filter(date_from, date_to)
+    if min_amount is not None or max_amount is not None:
+        query["amount"] = range_filter(to_minor(min_amount), to_minor(max_amount))
     
-    payments = await db.payments.find(query).to_list(1000)
-    return [Payment(**mongo_to_dict(payment)) for payment in payments]
+    payments = await fetch_page(
+        db.payments, query, "payment_id", response, limit, after, with_total, projection=PAYMENT_PROJECTION
+    )
+    return db_response([payment_from_db(payment) for payment in payments], response)
 
 # Expense management
 @api_router.post("/expenses", response_model=Expense)
 async def create_expense(expense: ExpenseCreate, current_user: str = Depends(get_current_user)):
-    # Verify capital ownership
-    capital = await db.capitals.find_one({"id": expense.capital_id, "owner_id": current_user})
-    if not capital:
-        raise HTTPException(status_code=404, detail="Capital not found")
-    
-    # Check if there's enough balance for the expense
-    current_balance = capital.get("balance", 0.0)
-    if current_balance < expense.amount:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Недостаточно средств в капитале. Доступно: {current_balance}₽, требуется: {expense.amount}₽"
-        )
-    
     expense_dict = expense.dict()
     expense_dict["expense_date"] = datetime.utcnow().strftime("%Y-%m-%d")
     expense_obj = Expense(**expense_dict)
-    await db.expenses.insert_one(expense_obj.dict())
     
-    # Deduct the expense amount from capital balance
-    new_balance = current_balance - expense.amount
-    await db.capitals.update_one(
-        {"id": expense.capital_id},
-        {"$set": {"balance": new_balance}}
-    )
+    amount = to_minor(expense.amount)
     
+    async def record_expense(session):
+        # Verify capital ownership and deduct the expense amount in one step
+        await debit_capital(
+            expense.capital_id, amount, owner_id=current_user, session=session,
+            kind=LedgerKind.expense, ref_id=expense_obj.expense_id
+        )
+        try:
+            await db.expenses.insert_one(money_to_db(expense_obj.dict(), MONEY_FIELDS["expenses"]), session=session)
+        except Exception:
+            # Без транзакции списание нужно вернуть вручную
+            if session is None:
+                await adjust_capital_balance(
+                    expense.capital_id, amount,
+                    kind=LedgerKind.expense_refund, ref_id=expense_obj.expense_id
+                )
+            raise
+        await apply_stats_delta(expense.capital_id, {"total_expenses": amount}, session=session)
+        await bump_capital_revision(expense.capital_id, session=session)
+    
+    await run_in_transaction(record_expense)
     return expense_obj
 
 @api_router.get("/expenses", response_model=List[Expense])
-async def get_expenses(capital_id: Optional[str] = None, current_user: str = Depends(get_current_user)):
-    # Get user's capitals
-    user_capitals = await db.capitals.find({"owner_id": current_user}).to_list(100)
-    capital_ids = [cap["id"] for cap in user_capitals]
-    
-    query = {"capital_id": {"$in": capital_ids}}
+async def get_expenses(
+    response: Response,
+    capital_id: Optional[str] = None,
+    category: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    limit: int = Query(1000, ge=1, le=5000),
+    after: Optional[str] = None,
+    with_total: bool = False,
+    capitals: OwnedCapitals = Depends(get_owned_capitals)
+):
+    query = {"capital_id": {"$in": capitals.ids}}
     if capital_id:
-        if capital_id not in capital_ids:
-            raise HTTPException(status_code=403, detail="Access denied")
+        await capitals.check(capital_id)
         query = {"capital_id": capital_id}
+    if category:
+        query["category"] = category
+    if date_from or date_to:
+        query["expense_date"] = range_filter(date_from, date_to)
+    if min_amount is not None or max_amount is not None:
+        query["amount"] = range_filter(to_minor(min_amount), to_minor(max_amount))
     
-    expenses = await db.expenses.find(query).sort("created_at", -1).to_list(1000)
-    return [Expense(**mongo_to_dict(expense)) for expense in expenses]
+    # Newest first, as before
+    expenses = await fetch_page(
+        db.expenses, query, "expense_id", response, limit, after, with_total,
+        direction=DESCENDING, projection=EXPENSE_PROJECTION
+    )
+    return db_response([expense_from_db(expense) for expense in expenses], response)
 
 @api_router.get("/expenses/{expense_id}", response_model=Expense)
-async def get_expense(expense_id: str, current_user: str = Depends(get_current_user)):
-    # Get user's capitals
-    user_capitals = await db.capitals.find({"owner_id": current_user}).to_list(100)
-    capital_ids = [cap["id"] for cap in user_capitals]
-    
-    expense = await db.expenses.find_one({"expense_id": expense_id, "capital_id": {"$in": capital_ids}})
+async def get_expense(expense_id: str, capitals: OwnedCapitals = Depends(get_owned_capitals)):
+    expense = await db.expenses.find_one(
+        {"expense_id": expense_id, "capital_id": {"$in": capitals.ids}}, EXPENSE_PROJECTION
+    )
     if not expense:
         raise HTTPException(status_code=404, detail="Expense not found")
-    return Expense(**mongo_to_dict(expense))
+    return db_response(expense_from_db(expense))
 
 @api_router.put("/expenses/{expense_id}", response_model=Expense)
-async def update_expense(expense_id: str, updates: ExpenseUpdate, current_user: str = Depends(get_current_user)):
-    # Get user's capitals
-    user_capitals = await db.capitals.find({"owner_id": current_user}).to_list(100)
-    capital_ids = [cap["id"] for cap in user_capitals]
-    
-    # Get the original expense
-    original_expense = await db.expenses.find_one({"expense_id": expense_id, "capital_id": {"$in": capital_ids}})
-    if not original_expense:
-        raise HTTPException(status_code=404, detail="Expense not found")
-    
+async def update_expense(expense_id: str, updates: ExpenseUpdate, capitals: OwnedCapitals = Depends(get_owned_capitals)):
     # Convert updates to dict and filter out None values
-    update_dict = {k: v for k, v in updates.dict().items() if v is not None}
-    
-    # If amount is being updated, adjust the capital balance
-    if "amount" in update_dict:
-        capital = await db.capitals.find_one({"id": original_expense["capital_id"]})
-        if capital:
-            original_amount = original_expense["amount"]
-            new_amount = update_dict["amount"]
-            amount_difference = new_amount - original_amount
-            
-            current_balance = capital.get("balance", 0.0)
-            if current_balance < amount_difference:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Недостаточно средств в капитале для увеличения расхода на {amount_difference}₽"
-                )
-            
-            # Update capital balance
-            new_balance = current_balance - amount_difference
-            await db.capitals.update_one(
-                {"id": original_expense["capital_id"]},
-                {"$set": {"balance": new_balance}}
-            )
+    update_dict = money_to_db({k: v for k, v in updates.dict().items() if v is not None}, MONEY_FIELDS["expenses"])
     
-    if update_dict:
-        result = await db.expenses.update_one(
-            {"expense_id": expense_id, "capital_id": {"$in": capital_ids}},
-            {"$set": update_dict}
-        )
+    async def apply_update(session):
+        query = {"expense_id": expense_id, "capital_id": {"$in": capitals.ids}}
+        if not update_dict:
+            expense = await db.expenses.find_one(query, session=session)
+            if not expense:
+                raise HTTPException(status_code=404, detail="Expense not found")
+            return expense
         
-        if result.matched_count == 0:
+        # The previous amount comes back from the same atomic update, so two
+        # concurrent edits each see the state the other one left behind
+        original_expense = await db.expenses.find_one_and_update(
+            query, {"$set": update_dict}, return_document=ReturnDocument.BEFORE, session=session
+        )
+        if not original_expense:
             raise HTTPException(status_code=404, detail="Expense not found")
+        
+        # If amount is being updated, adjust the capital balance
+        if "amount" in update_dict:
+            amount_difference = update_dict["amount"] - original_expense["amount"]
+            if amount_difference > 0:
+                try:
+                    await debit_capital(
+                        original_expense["capital_id"],
+                        amount_difference,
+                        detail=f"Недостаточно средств в капитале для увеличения расхода на {from_minor(amount_difference)}₽",
+                        session=session,
+                        kind=LedgerKind.expense,
+                        ref_id=expense_id
+                    )
+                except Exception:
+                    # Без транзакции прежнюю сумму нужно вернуть вручную,
+                    # если её не успел сменить другой запрос
+                    if session is None:
+                        await db.expenses.update_one(
+                            {"expense_id": expense_id, "amount": update_dict["amount"]},
+                            {"$set": {"amount": original_expense["amount"]}}
+                        )
+                    raise
+            elif amount_difference < 0:
+                await adjust_capital_balance(
+                    original_expense["capital_id"], -amount_difference, session=session,
+                    kind=LedgerKind.expense_refund, ref_id=expense_id
+                )
+            if amount_difference:
+                await apply_stats_delta(
+                    original_expense["capital_id"], {"total_expenses": amount_difference}, session=session
+                )
+        await bump_capital_revision(original_expense["capital_id"], session=session)
+        
+        return await db.expenses.find_one({"expense_id": expense_id}, session=session)
     
-    updated_expense = await db.expenses.find_one({"expense_id": expense_id})
-    return Expense(**mongo_to_dict(updated_expense))
+    updated_expense = await run_in_transaction(apply_update)
+    return Expense(**expense_from_db(mongo_to_dict(updated_expense)))
 
 @api_router.delete("/expenses/{expense_id}")
-async def delete_expense(expense_id: str, current_user: str = Depends(get_current_user)):
-    # Get user's capitals
-    user_capitals = await db.capitals.find({"owner_id": current_user}).to_list(100)
-    capital_ids = [cap["id"] for cap in user_capitals]
-    
-    # Get the expense to return the amount to balance
-    expense = await db.expenses.find_one({"expense_id": expense_id, "capital_id": {"$in": capital_ids}})
-    if not expense:
-        raise HTTPException(status_code=404, detail="Expense not found")
-    
-    # Delete the expense
-    result = await db.expenses.delete_one({"expense_id": expense_id, "capital_id": {"$in": capital_ids}})
-    
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Expense not found")
-    
-    # Return the expense amount to capital balance
-    capital = await db.capitals.find_one({"id": expense["capital_id"]})
-    if capital:
-        current_balance = capital.get("balance", 0.0)
-        new_balance = current_balance + expense["amount"]
-        await db.capitals.update_one(
-            {"id": expense["capital_id"]},
-            {"$set": {"balance": new_balance}}
+async def delete_expense(expense_id: str, capitals: OwnedCapitals = Depends(get_owned_capitals)):
+    async def remove_expense(session):
+        # Delete the expense, keeping the document to return the amount to balance
+        expense = await db.expenses.find_one_and_delete(
+            {"expense_id": expense_id, "capital_id": {"$in": capitals.ids}},
+            session=session
+        )
+        if not expense:
+            raise HTTPException(status_code=404, detail="Expense not found")
+        await apply_stats_delta(expense["capital_id"], {"total_expenses": -expense["amount"]}, session=session)
+        
+        # Return the expense amount to capital balance
+        await adjust_capital_balance(
+            expense["capital_id"], expense["amount"], session=session,
+            kind=LedgerKind.expense_refund, ref_id=expense_id
         )
+        await bump_capital_revision(expense["capital_id"], session=session)
     
+    await run_in_transaction(remove_expense)
     return {"message": "Expense deleted successfully"}
 
-# Analytics
-@api_router.get("/analytics/{capital_id}")
-async def get_capital_analytics(capital_id: str, current_user: str = Depends(get_current_user)):
-    # Verify capital ownership
-    capital = await db.capitals.find_one({"id": capital_id, "owner_id": current_user})
-    if not capital:
-        raise HTTPException(status_code=404, detail="Capital not found")
-    
-    clients = await db.clients.find({"capital_id": capital_id}).to_list(1000)
-    
-    # Calculate analytics from schedule data
-    total_debt = 0
-    total_paid = 0
-    total_payments_count = 0
-    paid_payments_count = 0
-    overdue_count = 0
-    current_month_expected = 0
-    monthly_profits = {}
-    total_profit = 0  # Общая прибыль (долг - покупка)
+# Analytics cache
+# Ключ включает ревизию капитала, так что любая запись по капиталу делает старые
+# записи недостижимыми; они вытесняются по TTL или LRU. Дата тоже входит в ключ.
+ANALYTICS_CACHE_TTL = int(os.environ.get('ANALYTICS_CACHE_TTL', '300'))
+ANALYTICS_CACHE_SIZE = int(os.environ.get('ANALYTICS_CACHE_SIZE', '1000'))
+
+def _retrieve_exception(task: asyncio.Task) -> None:
+    # не логировать "exception was never retrieved", если ожидающих не осталось
+    if not task.cancelled():
+        task.exception()
+
+class SingleFlightCache:
+    """TTL/LRU cache in which concurrent misses for one key share one computation"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.inflight: Dict[Any, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def get_or_compute(self, key, compute):
+        try:
+            value = self.cache[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return value
+
+        task = self.inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            # Расчёт идёт отдельной задачей: отмена запроса, который его начал,
+            # не отменяет его для остальных ожидающих
+            task = asyncio.create_task(self._compute(key, compute))
+            task.add_done_callback(_retrieve_exception)
+            self.inflight[key] = task
+        # shield: отмена одного ожидающего запроса не отменяет общий расчёт
+        return await asyncio.shield(task)
+
+    async def _compute(self, key, compute):
+        try:
+            value = await compute()
+            self.cache[key] = value
+            return value
+        finally:
+            del self.inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "size": len(self.cache),
+            "maxsize": self.cache.maxsize,
+            "ttl": self.cache.ttl,
+        }
+
+analytics_cache = SingleFlightCache(maxsize=ANALYTICS_CACHE_SIZE, ttl=ANALYTICS_CACHE_TTL)
+analytics_cache_gauge = metrics.register(Gauge(
+    "analytics_cache", "Analytics cache counters of this worker", ("counter",)
+))
+
+def collect_analytics_cache_metrics() -> None:
+    for name, value in analytics_cache.stats().items():
+        analytics_cache_gauge.set((name,), value)
+
+metrics.collectors.append(collect_analytics_cache_metrics)
+
+async def compute_capital_analytics(capital: Dict[str, Any], today: date) -> Dict[str, Any]:
+    stats = await get_capital_stats(capital["id"])
     
-    today = date.today()
     current_month = today.strftime("%Y-%m")
+    today_key = today.strftime("%Y-%m-%d")
     
-    # Initialize 12 months of data (current year)
-    for month in range(1, 13):
-        month_key = f"{today.year}-{month:02d}"
-        monthly_profits[month_key] = 0
-    
-    for client in clients:
-        # Use debt_amount if available, otherwise fall back to total_amount
-        debt = client.get("debt_amount") or client.get("total_amount", 0)
-        purchase = client.get("purchase_amount", 0) or debt  # Если нет purchase_amount, используем debt
-        client_profit = debt - purchase  # Прибыль = долг - покупка
-        
-        total_debt += debt
-        total_profit += client_profit
-        
-        # Get contract date to determine profit attribution month
-        try:
-            contract_date = datetime.strptime(client.get("start_date", ""), "%Y-%m-%d")
-            contract_month = contract_date.strftime("%Y-%m")
-            
-            # Add profit to the contract month
-            if contract_month in monthly_profits:
-                monthly_profits[contract_month] += client_profit
-        except (ValueError, TypeError):
-            # If no valid date, add to current month
-            if current_month in monthly_profits:
-                monthly_profits[current_month] += client_profit
-        
-        # Calculate from schedule
-        for schedule_item in client.get("schedule", []):
-            try:
-                payment_date = datetime.strptime(schedule_item["payment_date"], "%Y-%m-%d").date()
-                payment_amount = schedule_item.get("amount", 0)
-                payment_status = schedule_item.get("status", "pending")
-                payment_month = payment_date.strftime("%Y-%m")
-                
-                total_payments_count += 1
-                
-                # Expected payments for current month
-                if payment_month == current_month:
-                    current_month_expected += payment_amount
-                
-                # Count paid payments and their amounts
-                if payment_status == "paid":
-                    total_paid += payment_amount
-                    paid_payments_count += 1
-                
-                # Count overdue payments
-                elif (payment_status == "overdue" or 
-                      (payment_status == "pending" and payment_date < today)):
-                    overdue_count += 1
-                    
-            except (ValueError, KeyError):
-                continue
+    # Статистика, записанная до перевода в копейки, хранит рубли во float
+    total_debt = stored_to_minor(stats["total_debt"])
+    total_paid = stored_to_minor(stats["total_paid"])
+    total_payments_count = stats["total_payments"]
+    paid_payments_count = stats["paid_payments"]
+    total_expenses = stored_to_minor(stats["total_expenses"])
     
-    active_clients = len([c for c in clients if c["status"] == "active"])
+    # Overdue = status "overdue" or still pending with a date before today
+    overdue_count = stats["overdue_payments"] + sum(
+        count for payment_date, count in stats.get("pending_by_date", {}).items() if payment_date < today_key
+    )
     
-    # Get expenses for this capital
-    expenses = await db.expenses.find({"capital_id": capital_id}).to_list(1000)
-    total_expenses = sum(expense.get("amount", 0) for expense in expenses)
+    monthly_profits = {month: stored_to_minor(value) for month, value in stats.get("profit_by_month", {}).items()}
     
     # Convert monthly_profits to list format for frontend
     monthly_profits_list = []
     for month in range(1, 13):
         month_key = f"{today.year}-{month:02d}"
         profit = monthly_profits.get(month_key, 0)
+        if month_key == current_month:
+            # If no valid contract date, profit goes to the current month
+            profit += monthly_profits.get("unknown", 0)
         
         try:
             month_name = datetime(today.year, month, 1).strftime("%B")
@@ -837,28 +3119,126 @@ async def get_capital_analytics(capital_id: str, current_user: str = Depends(get
         monthly_profits_list.append({
             "month": month_key,
             "month_name": month_name,
-            "profit": profit
+            "profit": from_minor(profit)
         })
     
+    # Статистика и баланс в копейках, наружу - рубли
     return {
-        "total_amount": total_debt,
-        "total_paid": total_paid,
-        "outstanding": total_debt - total_paid,
-        "active_clients": active_clients,
-        "total_clients": len(clients),
+        "total_amount": from_minor(total_debt),
+        "total_paid": from_minor(total_paid),
+        "outstanding": from_minor(total_debt - total_paid),
+        "active_clients": stats["active_clients"],
+        "total_clients": stats["total_clients"],
         "overdue_payments": overdue_count,
         "collection_rate": (total_paid / total_debt * 100) if total_debt > 0 else 0,
         "total_payments": total_payments_count,
         "paid_payments": paid_payments_count,
         "payment_completion_rate": (paid_payments_count / total_payments_count * 100) if total_payments_count > 0 else 0,
-        "total_expenses": total_expenses,
-        "current_balance": capital.get("balance", 0),
-        "total_profit": total_profit,  # Общая прибыль (долг - покупка)
-        "net_income": total_paid - total_expenses,  # Чистый доход (поступления - расходы)
-        "current_month_expected": current_month_expected,
+        "total_expenses": from_minor(total_expenses),
+        "current_balance": stored_to_rubles(capital.get("balance", 0)),
+        "total_profit": from_minor(stored_to_minor(stats["total_profit"])),  # Общая прибыль (долг - покупка)
+        "net_income": from_minor(total_paid - total_expenses),  # Чистый доход (поступления - расходы)
+        "current_month_expected": from_minor(stored_to_minor(stats.get("expected_by_month", {}).get(current_month, 0))),
         "monthly_profits": monthly_profits_list
     }
 
+@api_router.get("/analytics/{capital_id}")
+async def get_capital_analytics(
+    capital_id: str,
+    current_user: str = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None)
+):
+    # Verify capital ownership
+    capital = await db.capitals.find_one({"id": capital_id, "owner_id": current_user})
+    if not capital:
+        raise HTTPException(status_code=404, detail="Capital not found")
+    
+    today = date.today()
+    revision = capital.get("revision", 0)
+    # Просрочка и текущий месяц зависят от даты, поэтому она входит в ETag
+    etag = make_etag("analytics", capital_id, revision, today)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    
+    analytics = await analytics_cache.get_or_compute(
+        (capital_id, revision, today),
+        lambda: compute_capital_analytics(capital, today)
+    )
+    return db_response(analytics, etag=etag)
+
+@api_router.get("/admin/cache-stats")
+async def get_cache_stats(current_user: str = Depends(get_admin_user)):
+    """Hit/miss/coalesce counters of the in-process caches (per worker, admins only)"""
+    return {
+        "analytics": analytics_cache.stats(),
+        "capital_ids": {
+            "size": len(capital_ids_cache),
+            "maxsize": capital_ids_cache.maxsize,
+            "ttl": capital_ids_cache.ttl,
+        },
+    }
+
+@api_router.get("/admin/slow-requests")
+async def get_slow_requests(
+    limit: int = Query(50, ge=1, le=1000),
+    route: Optional[str] = None,
+    current_user: str = Depends(get_admin_user)
+):
+    """Most recent requests slower than SLOW_REQUEST_MS, newest first (per worker, admins only)"""
+    records = [r for r in reversed(slow_requests) if route is None or r["route"] == route]
+    return db_response({
+        "threshold_ms": SLOW_REQUEST_MS,
+        "capacity": slow_requests.maxlen,
+        "requests": records[:limit],
+    })
+
+# Capital ledger
+@api_router.get("/capitals/{capital_id}/ledger", response_model=List[LedgerEntry])
+async def get_capital_ledger(
+    capital_id: str,
+    response: Response,
+    limit: int = Query(1000, ge=1, le=5000),
+    after: Optional[str] = None,
+    with_total: bool = False,
+    capitals: OwnedCapitals = Depends(get_owned_capitals)
+):
+    await capitals.check(capital_id)
+    entries = await fetch_page(
+        db.ledger, {"capital_id": capital_id}, "entry_id", response, limit, after, with_total
+    )
+    return db_response([ledger_entry_from_db(entry) for entry in entries], response)
+
+@api_router.get("/capitals/{capital_id}/balance")
+async def get_capital_balance_at(
+    capital_id: str,
+    at: str = Query(..., pattern=DATE_PATTERN),
+    capitals: OwnedCapitals = Depends(get_owned_capitals)
+):
+    """Balance at the end of the given day, from snapshots and the ledger"""
+    await capitals.check(capital_id)
+    return await balance_at(capital_id, at)
+
+@api_router.get("/capitals/{capital_id}/cash-flow")
+async def get_capital_cash_flow(
+    capital_id: str,
+    date_from: str = Query(..., pattern=DATE_PATTERN),
+    date_to: str = Query(..., pattern=DATE_PATTERN),
+    capitals: OwnedCapitals = Depends(get_owned_capitals)
+):
+    await capitals.check(capital_id)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+    return await cash_flow(capital_id, date_from, date_to)
+
+@api_router.get("/capitals/{capital_id}/ledger/verify")
+async def verify_capital_ledger(
+    capital_id: str,
+    full: bool = False,
+    capitals: OwnedCapitals = Depends(get_owned_capitals)
+):
+    await capitals.check(capital_id)
+    return await verify_ledger(capital_id, full=full)
+
 # Initialize mock data
 @api_router.post("/init-mock-data")
 async def init_mock_data(current_user: str = Depends(get_current_user)):
@@ -871,7 +3251,7 @@ async def init_mock_data(current_user: str = Depends(get_current_user)):
     # Check if mock data already exists
     existing_capitals = await db.capitals.find({"owner_id": current_user}).to_list(10)
     if existing_capitals:
-        return {"message": "Mock data already exists", "capitals": [mongo_to_dict(capital) for capital in existing_capitals]}
+        return {"message": "Mock data already exists", "capitals": [capital_from_db(mongo_to_dict(capital)) for capital in existing_capitals]}
     
     # Create 2 capitals
     capital1 = Capital(
@@ -888,8 +3268,10 @@ async def init_mock_data(current_user: str = Depends(get_current_user)):
         balance=300000.0  # Начальный баланс 300,000₽
     )
     
-    await db.capitals.insert_one(capital1.dict())
-    await db.capitals.insert_one(capital2.dict())
+    for capital in (capital1, capital2):
+        await db.capitals.insert_one(money_to_db(capital.dict(), MONEY_FIELDS["capitals"]))
+        await record_ledger_entry(capital.id, to_minor(capital.balance), LedgerKind.opening)
+    invalidate_user_capitals(current_user)
     
     # Create mock clients for capital 1
     clients_data1 = [
@@ -965,9 +3347,11 @@ async def init_mock_data(current_user: str = Depends(get_current_user)):
     ]
     
     # Create clients for both capitals
-    for client_data in clients_data1:
-        schedule = generate_payment_schedule(client_data["start_date"], client_data["monthly_payment"], client_data["months"])
-        end_date = schedule[-1].payment_date if schedule else client_data["start_date"]
+    schedules1 = generate_schedules(
+        [(c["start_date"], c["monthly_payment"], c["months"]) for c in clients_data1]
+    )
+    for client_data, schedule in zip(clients_data1, schedules1):
+        end_date = schedule[-1]["payment_date"] if schedule else client_data["start_date"]
         
         client_obj = Client(
             capital_id=capital1.id,
@@ -982,13 +3366,15 @@ async def init_mock_data(current_user: str = Depends(get_current_user)):
             guarantor_phone=client_data.get("guarantor_phone"),
             start_date=client_data["start_date"],
             end_date=end_date,
-            schedule=[s.dict() for s in schedule]  # Convert to dict for MongoDB
+            schedule=schedule
         )
-        await db.clients.insert_one(client_obj.dict())
+        await db.clients.insert_one(client_document(client_obj.dict()))
     
-    for client_data in clients_data2:
-        schedule = generate_payment_schedule(client_data["start_date"], client_data["monthly_payment"], client_data["months"])
-        end_date = schedule[-1].payment_date if schedule else client_data["start_date"]
+    schedules2 = generate_schedules(
+        [(c["start_date"], c["monthly_payment"], c["months"]) for c in clients_data2]
+    )
+    for client_data, schedule in zip(clients_data2, schedules2):
+        end_date = schedule[-1]["payment_date"] if schedule else client_data["start_date"]
         
         client_obj = Client(
             capital_id=capital2.id,
@@ -1003,9 +3389,12 @@ async def init_mock_data(current_user: str = Depends(get_current_user)):
             guarantor_phone=client_data.get("guarantor_phone"),
             start_date=client_data["start_date"],
             end_date=end_date,
-            schedule=[s.dict() for s in schedule]  # Convert to dict for MongoDB
+            schedule=schedule
         )
-        await db.clients.insert_one(client_obj.dict())
+        await db.clients.insert_one(client_document(client_obj.dict()))
+    
+    await rebuild_capital_stats(capital1.id)
+    await rebuild_capital_stats(capital2.id)
     
     return {"message": "Mock data initialized successfully", "capitals": [capital1.dict(), capital2.dict()]}
 
@@ -1016,95 +3405,857 @@ async def auto_init_data(current_user: str = Depends(get_current_user)):
     existing_capitals = await db.capitals.find({"owner_id": current_user}).to_list(10)
     if not existing_capitals:
         return await init_mock_data(current_user)
-    return {"message": "Data already exists", "capitals": [mongo_to_dict(capital) for capital in existing_capitals]}
+    return {"message": "Data already exists", "capitals": [capital_from_db(mongo_to_dict(capital)) for capital in existing_capitals]}
 
 # Delete capital
 @api_router.delete("/capitals/{capital_id}")
 async def delete_capital(capital_id: str, current_user: str = Depends(get_current_user)):
-    # Verify capital ownership
-    capital = await db.capitals.find_one({"id": capital_id, "owner_id": current_user})
-    if not capital:
-        raise HTTPException(status_code=404, detail="Capital not found")
+    async def remove_capital(session):
+        # Verify capital ownership
+        capital = await db.capitals.find_one({"id": capital_id, "owner_id": current_user}, session=session)
+        if not capital:
+            raise HTTPException(status_code=404, detail="Capital not found")
+        
+        # Delete all clients in this capital
+        await db.clients.delete_many({"capital_id": capital_id}, session=session)
+        
+        # Delete all payments in this capital
+        await db.payments.delete_many({"capital_id": capital_id}, session=session)
+        
+        # Delete all expenses in this capital
+        await db.expenses.delete_many({"capital_id": capital_id}, session=session)
+        
+        await db.capital_stats.delete_one({"capital_id": capital_id}, session=session)
+        # Журнал только дополняется: он и снимки переживают капитал, а
+        # закрывающая запись сводит его сумму к нулю
+        balance = stored_to_minor(capital.get("balance", 0))
+        if balance:
+            await record_ledger_entry(capital_id, -balance, LedgerKind.closing, session=session)
+        
+        # Delete the capital
+        result = await db.capitals.delete_one({"id": capital_id, "owner_id": current_user}, session=session)
+        if result.deleted_count == 0:
+            raise HTTPException(status_code=404, detail="Capital not found")
     
-    # Delete all clients in this capital
-    await db.clients.delete_many({"capital_id": capital_id})
+    try:
+        await run_in_transaction(remove_capital)
+    finally:
+        invalidate_user_capitals(current_user)
     
-    # Delete all payments in this capital
-    await db.payments.delete_many({"capital_id": capital_id})
+    return {"message": "Capital deleted successfully"}
+
+# Overdue sweeper
+# Раз в сутки (сразу после полуночи) и по запросу ожидающие платежи с прошедшей
+# датой помечаются overdue, а статусы клиентов пересчитываются по графику.
+# Поэтому чтения ищут просрочку равенством status == "overdue" без сравнения дат.
+OVERDUE_SWEEP_BATCH = int(os.environ.get('OVERDUE_SWEEP_BATCH', '500'))
+
+def is_past_due(entry: Dict[str, Any], today_key: str) -> bool:
+    payment_date = entry.get("payment_date")
+    return (
+        entry.get("status", "pending") == "pending"
+        and isinstance(payment_date, str)
+        and re.match(DATE_PATTERN, payment_date) is not None
+        and payment_date < today_key
+    )
+
+# Статус клиента выводится из графика, только если его не задали вручную:
+# active - всегда, overdue и completed - если их поставил сам пересчёт
+# (status_source == "schedule"). Статус из API помечается "manual". У клиентов,
+# просроченных до появления поля, его нет: их overdue по-прежнему пересчитывается.
+def status_derivable(client: Dict[str, Any]) -> bool:
+    status, source = client.get("status"), client.get("status_source")
+    if status == ClientStatus.active.value or source == "schedule":
+        return True
+    return status == ClientStatus.overdue.value and source is None
+
+def derived_client_status(client: Dict[str, Any]) -> Optional[str]:
+    """Status a client should have given its schedule; None if it is not derived or the schedule is empty"""
+    if not status_derivable(client):
+        return None
+    statuses = [entry.get("status", "pending") for entry in client_schedule(client)]
+    if not statuses:
+        return None
+    if all(status == "paid" for status in statuses):
+        return ClientStatus.completed.value
+    if "overdue" in statuses:
+        return ClientStatus.overdue.value
+    return ClientStatus.active.value
+
+async def refresh_client_status(client_id: str, session=None) -> Dict[str, float]:
+    """Re-derive an active or overdue client's status after a schedule change.
+
+    Written conditionally on the version read, like the overdue sweep;
+    returns the stats delta of the transition (empty if none).
+    """
+    projection = {"_id": 0, "status": 1, "status_source": 1, "schedule": 1, "sched": 1, "version": 1}
+    for attempt in range(MAX_VERSION_RETRIES + 1):
+        client = await db.clients.find_one({"client_id": client_id}, projection, session=session)
+        if not client:
+            return {}
+        new_status = derived_client_status(client)
+        if not new_status or new_status == client.get("status"):
+            return {}
+        conditional_writes_total.inc(("client",))
+        result = await db.clients.update_one(
+            {"client_id": client_id, **version_filter(client.get("version", 0))},
+            {"$set": {"status": new_status, "status_source": "schedule", "updated_at": datetime.utcnow()},
+             "$inc": {"version": 1}},
+            session=session
+        )
+        if result.matched_count:
+            return {"active_clients": (new_status == "active") - (client.get("status") == "active")}
+        version_conflicts_total.inc(("client", "retried" if attempt < MAX_VERSION_RETRIES else "exhausted"))
+    # Статус досчитает следующий проход overdue sweep
+    logger.warning("Client %s kept changing, status left for the overdue sweep", client_id)
+    return {}
+
+async def sweep_overdue_batch(client_ids: List[str], today_key: str, session=None) -> Dict[str, int]:
+    """Sweep one batch; clients written concurrently are re-read and retried"""
+    report = {"clients": 0, "payments": 0, "status_changes": 0}
+    for attempt in range(MAX_VERSION_RETRIES + 1):
+        client_ids = await sweep_clients(client_ids, today_key, report, session)
+        if not client_ids:
+            break
+        outcome = "retried" if attempt < MAX_VERSION_RETRIES else "exhausted"
+        version_conflicts_total.inc(("client", outcome), len(client_ids))
+    if client_ids:
+        logger.warning("Overdue sweep: %d clients kept changing, left for the next run", len(client_ids))
+    return report
+
+async def sweep_clients(client_ids: List[str], today_key: str, report: Dict[str, int], session=None) -> List[str]:
+    """Write overdue changes conditioned on the version read; return ids that lost the race"""
+    operations = []
+    changes: Dict[str, Tuple[str, Dict[str, float], int, int]] = {}
+    now = datetime.utcnow()
+    projection = {
+        "_id": 0, "client_id": 1, "capital_id": 1, "status": 1, "status_source": 1,
+        "schedule": 1, "sched": 1, "version": 1,
+    }
+    async for client in db.clients.find({"client_id": {"$in": client_ids}}, projection, session=session):
+        update = {}
+        array_filters = None
+        delta = {}
+        schedule = client_schedule(client)
+        due = [index for index, entry in enumerate(schedule) if is_past_due(entry, today_key)]
+        if due:
+            for index in due:
+                add_stats(delta, schedule_entry_stats(schedule[index], -1))
+                schedule[index]["status"] = "overdue"
+                add_stats(delta, schedule_entry_stats(schedule[index]))
+            if "sched" in client:
+                # В колоночном графике платежи адресуются по номеру
+                update.update({f"sched.s.{index}": OVERDUE_CODE for index in due})
+            else:
+                update["schedule.$[due].status"] = "overdue"
+                array_filters = [{"due.status": "pending", "due.payment_date": {"$regex": DATE_PATTERN, "$lt": today_key}}]
+        
+        new_status = derived_client_status(
+            {"status": client.get("status"), "status_source": client.get("status_source"), "schedule": schedule}
+        )
+        status_change = 0
+        if new_status and new_status != client.get("status"):
+            update["status"] = new_status
+            update["status_source"] = "schedule"
+            delta["active_clients"] = (new_status == "active") - (client.get("status") == "active")
+            status_change = 1
+        
+        if update:
+            update["updated_at"] = now
+            operations.append(UpdateOne(
+                {"client_id": client["client_id"], **version_filter(client.get("version", 0))},
+                {"$set": update, "$inc": {"version": 1}},
+                array_filters=array_filters
+            ))
+            changes[client["client_id"]] = (client["capital_id"], delta, len(due), status_change)
     
-    # Delete all expenses in this capital
-    await db.expenses.delete_many({"capital_id": capital_id})
+    if not operations:
+        return []
+    conditional_writes_total.inc(("client",), len(operations))
+    result = await db.clients.bulk_write(operations, ordered=False, session=session)
+    applied = set(changes)
+    if result.matched_count < len(operations):
+        # Записанных этим проходом узнаём по метке updated_at
+        written = db.clients.find(
+            {"client_id": {"$in": list(changes)}, "updated_at": now}, {"_id": 0, "client_id": 1}, session=session
+        )
+        applied = {client["client_id"] async for client in written}
     
-    # Delete the capital
-    result = await db.capitals.delete_one({"id": capital_id, "owner_id": current_user})
+    deltas: Dict[str, Dict[str, float]] = {}
+    for client_id in applied:
+        capital_id, delta, payments, status_change = changes[client_id]
+        add_stats(deltas.setdefault(capital_id, {}), delta)
+        add_stats(report, {"clients": 1, "payments": payments, "status_changes": status_change})
+    for capital_id, delta in deltas.items():
+        await apply_stats_delta(capital_id, delta, session=session)
+        await bump_capital_revision(capital_id, session=session)
+    return [client_id for client_id in changes if client_id not in applied]
+
+async def sweep_overdue(today: Optional[date] = None) -> Dict[str, int]:
+    """Persist overdue installments and client status transitions as of ``today``.
+
+    Clients are processed in batches of OVERDUE_SWEEP_BATCH, each batch as one
+    transaction that re-reads its clients, so concurrent payments are not lost.
+    """
+    today_key = (today or date.today()).strftime("%Y-%m-%d")
+    candidates = db.clients.find(overdue_sweep_query(today_key), {"_id": 0, "client_id": 1})
+    client_ids = [client["client_id"] async for client in candidates]
     
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Capital not found")
+    report = {"clients": 0, "payments": 0, "status_changes": 0}
+    for start in range(0, len(client_ids), OVERDUE_SWEEP_BATCH):
+        batch = client_ids[start:start + OVERDUE_SWEEP_BATCH]
+        result = await run_in_transaction(
+            lambda session, batch=batch: sweep_overdue_batch(batch, today_key, session)
+        )
+        add_stats(report, result)
+    logger.info("Overdue sweep for %s: %s", today_key, report)
+    return report
+
+@api_router.post("/admin/sweep-overdue")
+async def run_overdue_sweep(current_user: str = Depends(get_admin_user)):
+    """Run the overdue sweep now instead of waiting for the nightly run (admins only)"""
+    return await sweep_overdue()
+
+async def convert_schedules(to_columnar: bool, capital_id: Optional[str] = None, batch_size: int = 500) -> Dict[str, int]:
+    """Move stored schedules to the columnar format or back.
+
+    Only the storage form changes, so stats and capital revisions stay as they
+    are. Each write is conditioned on the version read; a client written
+    meanwhile is counted as a conflict and picked up by the next run, as are
+    clients left over from an interrupted one.
+    """
+    source, target = ("schedule", "sched") if to_columnar else ("sched", "schedule")
+    query: Dict[str, Any] = {f"{source}.0" if to_columnar else source: {"$exists": True}}
+    if capital_id:
+        query["capital_id"] = capital_id
+    projection = {"_id": 0, "client_id": 1, "version": 1, source: 1}
+    report = {"converted": 0, "skipped": 0, "conflicts": 0}
+    last_id = None
+    while True:
+        page_query = {**query, "client_id": {"$gt": last_id}} if last_id else query
+        clients = await db.clients.find(page_query, projection).sort("client_id", ASCENDING).limit(batch_size).to_list(None)
+        if not clients:
+            break
+        last_id = clients[-1]["client_id"]
+        operations = []
+        for client in clients:
+            try:
+                value = encode_schedule(client[source]) if to_columnar else decode_schedule(client[source])
+            except ValueError as e:
+                logger.warning("Schedule of client %s left as is: %s", client["client_id"], e)
+                report["skipped"] += 1
+                continue
+            operations.append(UpdateOne(
+                {"client_id": client["client_id"], **version_filter(client.get("version", 0))},
+                {"$set": {target: value}, "$unset": {source: ""}, "$inc": {"version": 1}}
+            ))
+        if operations:
+            conditional_writes_total.inc(("client",), len(operations))
+            result = await db.clients.bulk_write(operations, ordered=False)
+            report["converted"] += result.modified_count
+            report["conflicts"] += len(operations) - result.matched_count
+    logger.info("Schedule conversion to %s: %s", target, report)
+    return report
+
+# Money migration
+# Документы, записанные до перевода денег в копейки, хранят рубли во float
+# (BSON double), а новые суммы пишутся только целыми. Поэтому непереведённые
+# документы находятся по типу поля, и прерванный перевод продолжается
+# повторным запуском. Переводить при остановленной записи: $inc копеек
+# в ещё рублёвый документ исказит сумму.
+def legacy_money_query(collection: str) -> Dict[str, Any]:
+    fields = MONEY_FIELDS[collection] + (("schedule.amount",) if collection == "clients" else ())
+    return {"$or": [{field: {"$type": "double"}} for field in fields]}
+
+def legacy_stats_query() -> Dict[str, Any]:
+    return {"$or": [{field: {"$type": "double"}} for field in STATS_MONEY_FIELDS]}
+
+async def count_legacy_money() -> Dict[str, int]:
+    counts = {
+        collection: await db[collection].count_documents(legacy_money_query(collection))
+        for collection in MONEY_FIELDS
+    }
+    counts["capital_stats"] = await db.capital_stats.count_documents(legacy_stats_query())
+    return counts
+
+# Пока перевод не закончен, запросы на запись получают 503: $inc копеек в
+# рублёвый документ исказил бы его. Состояние проверяется при старте, а пока
+# рублёвые документы есть - не чаще раза в LEGACY_MONEY_RECHECK_SECONDS, так
+# что после manage.py money запись открывается без перезапуска.
+LEGACY_MONEY_RECHECK_SECONDS = int(os.environ.get('LEGACY_MONEY_RECHECK_SECONDS', '60'))
+legacy_money_collections: Set[str] = set()
+legacy_money_checked_at: Optional[float] = None
+
+async def refresh_legacy_money() -> Set[str]:
+    """Collections that still hold at least one float ruble amount"""
+    global legacy_money_checked_at
+    found = {
+        collection for collection in MONEY_FIELDS
+        if await db[collection].count_documents(legacy_money_query(collection), limit=1)
+    }
+    if await db.capital_stats.count_documents(legacy_stats_query(), limit=1):
+        found.add("capital_stats")
+    legacy_money_collections.clear()
+    legacy_money_collections.update(found)
+    legacy_money_checked_at = time.monotonic()
+    if found:
+        logger.warning("Float ruble amounts left in %s: writes are refused until manage.py money", sorted(found))
+    return found
+
+async def require_converted_money(request: Request) -> None:
+    """Router dependency refusing writes while float ruble amounts remain"""
+    if request.method in ("GET", "HEAD", "OPTIONS"):
+        return
+    stale = legacy_money_checked_at is None or (
+        legacy_money_collections and time.monotonic() - legacy_money_checked_at >= LEGACY_MONEY_RECHECK_SECONDS
+    )
+    if stale:
+        await refresh_legacy_money()
+    if legacy_money_collections:
+        raise LegacyMoney(f"Money in {', '.join(sorted(legacy_money_collections))}")
+
+async def migrate_money(batch_size: int = 500) -> Dict[str, Dict[str, int]]:
+    """Convert float ruble amounts to integer kopecks in every money collection.
+
+    Each write is conditioned on the values it converts (and on the version
+    for clients and capitals), so a document changed meanwhile is counted as
+    a conflict and left for the next run. Capital stats are rebuilt from the
+    converted clients and expenses rather than converted with their float drift.
+    """
+    report = {}
+    for collection, fields in MONEY_FIELDS.items():
+        versioned = collection in ("clients", "capitals")
+        counts = {"converted": 0, "conflicts": 0}
+        last_id = None
+        while True:
+            query = legacy_money_query(collection)
+            if last_id is not None:
+                query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+            documents = await db[collection].find(query).sort("_id", ASCENDING).limit(batch_size).to_list(None)
+            if not documents:
+                break
+            last_id = documents[-1]["_id"]
+            operations = []
+            for document in documents:
+                condition = {"_id": document["_id"]}
+                update = {}
+                for field in fields:
+                    if isinstance(document.get(field), float):
+                        condition[field] = document[field]
+                        update[field] = to_minor(document[field])
+                schedule = document.get("schedule")
+                if collection == "clients" and any(isinstance(entry.get("amount"), float) for entry in schedule or []):
+                    update["schedule"] = [
+                        {**entry, "amount": to_minor(entry["amount"])} if isinstance(entry.get("amount"), float) else entry
+                        for entry in schedule
+                    ]
+                change = {"$set": update}
+                if versioned:
+                    condition.update(version_filter(document.get("version", 0)))
+                    change["$inc"] = {"version": 1}
+                operations.append(UpdateOne(condition, change))
+            result = await db[collection].bulk_write(operations, ordered=False)
+            counts["converted"] += result.modified_count
+            counts["conflicts"] += len(operations) - result.matched_count
+        report[collection] = counts
     
-    return {"message": "Capital deleted successfully"}
+    rebuilt = 0
+    for capital_id in await db.capital_stats.distinct("capital_id", legacy_stats_query()):
+        await rebuild_capital_stats(capital_id)
+        rebuilt += 1
+    report["capital_stats"] = {"converted": rebuilt, "conflicts": 0}
+    logger.info("Money migration: %s", report)
+    return report
+
+# Schema migrations
+# Документ несёт schema_version - номер последней применённой к нему миграции
+# своей коллекции (нет поля - версия 0). Новые документы сразу пишутся в
+# текущей версии, старые доводит manage.py migrate: пачками по
+# MIGRATION_BATCH_SIZE с паузой MIGRATION_THROTTLE_MS между ними, чтобы не
+# мешать рабочей нагрузке. Прогресс лежит в schema_migrations, поэтому
+# прерванный запуск продолжается с последнего обработанного _id.
+MIGRATION_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', '500'))
+MIGRATION_THROTTLE_MS = int(os.environ.get('MIGRATION_THROTTLE_MS', '50'))
+
+def canonical_client_amounts(client: Dict[str, Any]) -> Dict[str, Any]:
+    """clients v1: debt_amount and purchase_amount always set, total_amount mirrors debt_amount"""
+    debt = client.get("debt_amount") or client.get("total_amount") or 0
+    return {"debt_amount": debt, "purchase_amount": client.get("purchase_amount") or debt, "total_amount": debt}
+
+# Коллекция -> миграции по возрастанию версии: (версия, описание, документ -> поля для $set).
+# Функция видит документ в предыдущей версии и должна давать тот же результат
+# при повторном применении.
+MIGRATIONS = {
+    "clients": [
+        (1, "backfill debt_amount, purchase_amount and total_amount", canonical_client_amounts),
+    ],
+}
+SCHEMA_VERSIONS = {collection: migrations[-1][0] for collection, migrations in MIGRATIONS.items()}
+
+def below_schema_version(version: int) -> Dict[str, Any]:
+    # Два индексируемых условия вместо $not: {"$gte": version}
+    return {"$or": [{"schema_version": {"$lt": version}}, {"schema_version": None}]}
+
+async def migrate_collection(
+    collection: str,
+    version: int,
+    description: str,
+    transform,
+    batch_size: int = MIGRATION_BATCH_SIZE,
+    throttle_ms: int = MIGRATION_THROTTLE_MS,
+) -> Dict[str, Any]:
+    """Bring every document of ``collection`` below ``version`` up to it.
+
+    Each write is conditioned on the schema version read (and on the
+    document version for clients and capitals), so a document changed
+    meanwhile is retried on the next pass instead of being overwritten.
+    """
+    key = {"collection": collection, "version": version}
+    state = await db.schema_migrations.find_one_and_update(
+        key,
+        {
+            "$set": {"status": "running", "description": description, "updated_at": datetime.utcnow()},
+            "$setOnInsert": {"migrated": 0, "conflicts": 0, "last_id": None, "started_at": datetime.utcnow()},
+        },
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    versioned = collection in ("clients", "capitals")
+    last_id = state.get("last_id")
+    for attempt in range(MAX_VERSION_RETRIES + 1):
+        while True:
+            query = below_schema_version(version)
+            if last_id is not None:
+                query = {"$and": [query, {"_id": {"$gt": last_id}}]}
+            documents = await db[collection].find(query).sort("_id", ASCENDING).limit(batch_size).to_list(None)
+            if not documents:
+                break
+            operations = []
+            for document in documents:
+                condition = {"_id": document["_id"], "schema_version": document.get("schema_version")}
+                change = {"$set": {**transform(document), "schema_version": version}}
+                if versioned:
+                    condition.update(version_filter(document.get("version", 0)))
+                    change["$inc"] = {"version": 1}
+                operations.append(UpdateOne(condition, change))
+            result = await db[collection].bulk_write(operations, ordered=False)
+            last_id = documents[-1]["_id"]
+            await db.schema_migrations.update_one(key, {
+                "$set": {"last_id": last_id, "updated_at": datetime.utcnow()},
+                "$inc": {"migrated": result.modified_count, "conflicts": len(operations) - result.matched_count},
+            })
+            await asyncio.sleep(throttle_ms / 1000)
+        # Проигравшие гонку документы остались позади last_id: ещё один проход с начала
+        last_id = None
+        remaining = await db[collection].count_documents(below_schema_version(version))
+        if not remaining:
+            break
+    status = "completed" if not remaining else "incomplete"
+    return await db.schema_migrations.find_one_and_update(
+        key,
+        {"$set": {
+            "status": status, "last_id": None, "remaining": remaining,
+            "updated_at": datetime.utcnow(), "finished_at": datetime.utcnow(),
+        }},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def run_migrations(
+    collections: Optional[Sequence[str]] = None,
+    batch_size: int = MIGRATION_BATCH_SIZE,
+    throttle_ms: int = MIGRATION_THROTTLE_MS,
+) -> List[Dict[str, Any]]:
+    """Apply pending migrations in version order; a collection stops at its first incomplete one"""
+    results = []
+    for collection, migrations in MIGRATIONS.items():
+        if collections and collection not in collections:
+            continue
+        for version, description, transform in migrations:
+            result = await migrate_collection(collection, version, description, transform, batch_size, throttle_ms)
+            results.append(result)
+            logger.info("Migration %s v%d: %s", collection, version, result)
+            if result["status"] != "completed":
+                break
+    return results
+
+async def pending_migrations() -> Dict[str, int]:
+    """Number of documents below the current schema version, per collection"""
+    pending = {}
+    for collection, version in SCHEMA_VERSIONS.items():
+        count = await db[collection].count_documents(below_schema_version(version))
+        if count:
+            pending[collection] = count
+    return pending
+
+# Коллекции, у которых последняя миграция завершена (status "completed" в
+# schema_migrations). Только для них чтение обходится без запасных вариантов
+# старой схемы; до проверки при старте их нет, и запасные варианты работают.
+migrated_collections: Set[str] = set()
+
+def stored_client_amounts(client: Dict[str, Any]) -> Dict[str, Any]:
+    """Client with canonical amounts: as stored once clients v1 is complete, else derived like it"""
+    if "clients" in migrated_collections:
+        return client
+    return {**client, **canonical_client_amounts(client)}
+
+async def refresh_migrated_collections() -> None:
+    for collection, version in SCHEMA_VERSIONS.items():
+        state = await db.schema_migrations.find_one(
+            {"collection": collection, "version": version, "status": "completed"}, {"_id": 1}
+        )
+        if state:
+            migrated_collections.add(collection)
+        else:
+            migrated_collections.discard(collection)
+
+async def warn_pending_migrations() -> None:
+    try:
+        await refresh_migrated_collections()
+        pending = await pending_migrations()
+    except Exception:
+        logger.exception("Could not check schema migrations")
+        return
+    if pending:
+        logger.warning("Documents below the current schema version: %s; run manage.py migrate", pending)
+    if SCHEMA_VERSIONS.keys() - migrated_collections:
+        logger.info("Reading with old schema fallbacks for %s", sorted(SCHEMA_VERSIONS.keys() - migrated_collections))
+
+# Nightly jobs
+# Просрочка и снимки журнала запускаются при старте и сразу после полуночи.
+# При нескольких воркерах достаточно включить их в одном: NIGHTLY_JOBS=false.
+NIGHTLY_JOBS = os.environ.get('NIGHTLY_JOBS', 'true').lower() != 'false'
+
+async def nightly_jobs_loop():
+    while True:
+        for job in (sweep_overdue, snapshot_ledgers):
+            try:
+                await job()
+            except Exception:
+                logger.exception("Nightly job %s failed", job.__name__)
+        # Следующий запуск - в начале следующих суток
+        now = datetime.now()
+        next_run = datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) + timedelta(minutes=1)
+        await asyncio.sleep((next_run - now).total_seconds())
 
 # Dashboard data
+
+# Поля клиента, которые нужны в корзинах дашборда (без графика платежей)
+DASHBOARD_CLIENT_FIELDS = (
+    "client_id", "capital_id", "name", "product", "monthly_payment", "debt_amount",
+    "client_phone", "guarantor_name", "guarantor_phone", "status",
+)
+
+async def columnar_dashboard_buckets(capital_ids: List[str], today: str, tomorrow: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Dashboard buckets of clients with columnar schedules.
+
+    The index narrows the clients down by day or status code; which element of
+    the parallel arrays matched is sorted out here.
+    """
+    today_day, tomorrow_day = to_epoch_day(today), to_epoch_day(tomorrow)
+    buckets = {"overdue": [], "today": [], "tomorrow": []}
+    cursor = db.clients.find(
+        columnar_dashboard_query(capital_ids, today_day, tomorrow_day),
+        {"_id": 0, "sched": 1, **{field: 1 for field in DASHBOARD_CLIENT_FIELDS}},
+    )
+    async for document in cursor:
+        columns = document["sched"]
+        client = {field: document.get(field) for field in DASHBOARD_CLIENT_FIELDS}
+        for index, (day, status) in enumerate(zip(columns["d"], columns["s"])):
+            if status == OVERDUE_CODE or (status == PENDING_CODE and day < today_day):
+                name = "overdue"
+            elif status == PENDING_CODE and day == today_day:
+                name = "today"
+            elif status == PENDING_CODE and day == tomorrow_day:
+                name = "tomorrow"
+            else:
+                continue
+            buckets[name].append({"client": client, "payment": schedule_entry(columns, index)})
+    return buckets
+
 @api_router.get("/dashboard")
-async def get_dashboard_data(capital_id: Optional[str] = None, current_user: str = Depends(get_current_user)):
-    user_capitals = await db.capitals.find({"owner_id": current_user}).to_list(100)
-    capital_ids = [cap["id"] for cap in user_capitals]
+async def get_dashboard_data(
+    request: Request,
+    capital_id: Optional[str] = None,
+    include_clients: bool = True,
+    clients_limit: int = Query(1000, ge=1, le=5000),
+    clients_after: Optional[str] = None,
+    clients_fields: Optional[str] = None,
+    clients_view: ClientView = ClientView.full,
+    clients_schedule_slice: Optional[int] = None,
+    capitals: OwnedCapitals = Depends(get_owned_capitals),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Today/tomorrow/overdue payment buckets, bucketed by MongoDB.
+
+    ``all_clients`` is a page of client documents, trimmed by
+    ``clients_fields`` / ``clients_view`` / ``clients_schedule_slice`` the
+    same way as ``/api/clients``; pass ``all_clients_next_cursor`` back as
+    ``clients_after`` for the next page or ``include_clients=false`` to skip
+    the list entirely.
+    """
+    fieldset = ClientFieldset(clients_fields, clients_view, clients_schedule_slice)
+    if capital_id:
+        await capitals.check(capital_id)
     
-    if capital_id and capital_id not in capital_ids:
-        raise HTTPException(status_code=403, detail="Access denied")
+    query_capital_ids = [capital_id] if capital_id else capitals.ids
     
-    query_capital_ids = [capital_id] if capital_id else capital_ids
+    today = date.today().strftime("%Y-%m-%d")
+    tomorrow = (date.today() + timedelta(days=1)).strftime("%Y-%m-%d")
     
-    clients = await db.clients.find({"capital_id": {"$in": query_capital_ids}}).to_list(1000)
-    clients = [mongo_to_dict(client) for client in clients]
+    # Корзины сегодня/завтра/просрочка зависят от даты, поэтому она входит в ETag
+    revisions = await capital_revisions(query_capital_ids)
+    etag = make_etag("dashboard", revisions, today, request.url.query)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
     
-    today = date.today()
-    from datetime import timedelta
-    tomorrow = today + timedelta(days=1)
+    # Прошедшие ожидающие платежи переводит в overdue ночная задача, но до её
+    # прогона (и для только что импортированной истории) они тоже просрочка,
+    # как и в аналитике по pending_by_date
+    past_due = {"$regex": DATE_PATTERN, "$lt": today}
     
-    today_payments = []
-    tomorrow_payments = []
-    overdue_payments = []
+    def bucket_conditions(prefix: str) -> Dict[str, Dict[str, Any]]:
+        # Условия на платёж: в $elemMatch без префикса, после $unwind - с "schedule."
+        return {
+            "overdue": {"$or": [
+                {f"{prefix}status": "overdue", f"{prefix}payment_date": {"$regex": DATE_PATTERN}},
+                {f"{prefix}status": "pending", f"{prefix}payment_date": past_due},
+            ]},
+            "today": {f"{prefix}status": "pending", f"{prefix}payment_date": today},
+            "tomorrow": {f"{prefix}status": "pending", f"{prefix}payment_date": tomorrow},
+        }
     
-    for client in clients:
-        for schedule_item in client.get("schedule", []):
-            try:
-                # Handle both string and date formats
-                if isinstance(schedule_item["payment_date"], str):
-                    payment_date = datetime.strptime(schedule_item["payment_date"], "%Y-%m-%d").date()
-                else:
-                    payment_date = schedule_item["payment_date"]
-                
-                # Check if payment is overdue OR has overdue status
-                is_overdue = (schedule_item["status"] == "overdue" or 
-                            (schedule_item["status"] == "pending" and payment_date < today))
-                
-                if is_overdue:
-                    overdue_payments.append({
-                        "client": client,
-                        "payment": schedule_item
-                    })
-                elif schedule_item["status"] == "pending" and payment_date == today:
-                    today_payments.append({
-                        "client": client,
-                        "payment": schedule_item
-                    })
-                elif schedule_item["status"] == "pending" and payment_date == tomorrow:
-                    tomorrow_payments.append({
-                        "client": client,
-                        "payment": schedule_item
-                    })
-            except (ValueError, KeyError) as e:
-                continue  # Skip invalid date entries
+    bucket_projection = {
+        "_id": 0,
+        "client": {field: f"${field}" for field in DASHBOARD_CLIENT_FIELDS},
+        "payment": "$schedule",
+    }
     
-    return {
-        "today": today_payments,
-        "tomorrow": tomorrow_payments,
-        "overdue": overdue_payments,
-        "all_clients": clients
+    def bucket_pipeline(name: str) -> List[Dict[str, Any]]:
+        # Каждая корзина - отдельный запрос с курсором: один документ $facet со
+        # всеми корзинами упирается в лимит BSON 16 МБ на большом портфеле
+        return [
+            {"$match": {
+                "capital_id": {"$in": query_capital_ids},
+                "schedule": {"$elemMatch": bucket_conditions("")[name]},
+            }},
+            {"$project": {"_id": 0, "schedule": 1, **{field: 1 for field in DASHBOARD_CLIENT_FIELDS}}},
+            {"$unwind": "$schedule"},
+            {"$match": bucket_conditions("schedule.")[name]},
+            {"$project": bucket_projection},
+        ]
+    
+    names = ("overdue", "today", "tomorrow")
+    *rows_buckets, columnar_buckets = await asyncio.gather(
+        *(db.clients.aggregate(bucket_pipeline(name)).to_list(None) for name in names),
+        columnar_dashboard_buckets(query_capital_ids, today, tomorrow),
+    )
+    buckets = dict(zip(names, rows_buckets))
+    for name, entries in columnar_buckets.items():
+        buckets[name].extend(entries)
+    for entry in (entry for bucket in buckets.values() for entry in bucket):
+        # Колоночные корзины делят один словарь клиента на несколько платежей
+        entry["client"] = money_from_db(dict(entry["client"]), MONEY_FIELDS["clients"])
+        entry["payment"] = {**entry["payment"], "amount": stored_to_rubles(entry["payment"].get("amount"))}
+    
+    response = {
+        "today": buckets["today"],
+        "tomorrow": buckets["tomorrow"],
+        "overdue": buckets["overdue"],
     }
+    
+    if include_clients:
+        query = {"capital_id": {"$in": query_capital_ids}}
+        if clients_after:
+            query = {"$and": [query, after_cursor_query(clients_after, "client_id")]}
+        clients = await db.clients.find(query, fieldset.projection).sort(
+            [("created_at", ASCENDING), ("client_id", ASCENDING)]
+        ).limit(clients_limit + 1).to_list(None)
+        next_cursor = None
+        if len(clients) > clients_limit:
+            clients = clients[:clients_limit]
+            next_cursor = encode_cursor(clients[-1]["created_at"], clients[-1]["client_id"])
+        response["all_clients"] = [fieldset.from_db(client) for client in clients]
+        response["all_clients_next_cursor"] = next_cursor
+    
+    return db_response(response, etag=etag)
+
+# Export
+# Выгрузка капитала потоком по курсору MongoDB: в памяти только текущая пачка
+# строк, сколько бы клиентов ни было. При обрыве соединения Starlette отменяет
+# генератор, и курсор закрывается в finally.
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+EXPORT_CHUNK_BYTES = 256 * 1024
+
+class ExportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+    xlsx = "xlsx"
+
+class ExportEntity(str, Enum):
+    schedules = "schedules"  # одна строка на платёж графика
+    clients = "clients"
+    payments = "payments"
+    expenses = "expenses"
+
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.csv: "text/csv; charset=utf-8",
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.xlsx: "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+CLIENT_EXPORT_COLUMNS = [
+    "client_id", "name", "product", "purchase_amount", "debt_amount", "monthly_payment",
+    "guarantor_name", "client_address", "client_phone", "guarantor_phone",
+    "start_date", "end_date", "status",
+]
+SCHEDULE_EXPORT_COLUMNS = [
+    "client_id", "name", "product", "client_phone", "debt_amount", "monthly_payment",
+    "start_date", "end_date", "client_status",
+    "installment", "payment_date", "amount", "payment_status", "paid_date",
+]
+PAYMENT_EXPORT_COLUMNS = ["payment_id", "client_id", "amount", "payment_date", "status", "created_at"]
+EXPENSE_EXPORT_COLUMNS = ["expense_id", "amount", "description", "category", "expense_date", "created_at"]
+
+def export_timestamp(value) -> Optional[str]:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+# Суммы в выгрузке - рубли, как в API
+def client_export_rows(doc: Dict[str, Any]) -> Iterator[List[Any]]:
+    doc = money_from_db(stored_client_amounts(doc), MONEY_FIELDS["clients"])
+    yield [doc.get(column) for column in CLIENT_EXPORT_COLUMNS]
+
+def schedule_export_rows(doc: Dict[str, Any]) -> Iterator[List[Any]]:
+    doc = money_from_db(stored_client_amounts(doc), MONEY_FIELDS["clients"])
+    client = [
+        doc.get("client_id"), doc.get("name"), doc.get("product"), doc.get("client_phone"),
+        doc.get("debt_amount"), doc.get("monthly_payment"),
+        doc.get("start_date"), doc.get("end_date"), doc.get("status", ClientStatus.active.value),
+    ]
+    schedule = client_schedule(doc)
+    if not schedule:
+        yield client + [None] * 5
+    for number, entry in enumerate(schedule, start=1):
+        yield client + [
+            number, entry.get("payment_date"), stored_to_rubles(entry.get("amount")),
+            entry.get("status", PaymentStatus.pending.value), entry.get("paid_date"),
+        ]
+
+def payment_export_rows(doc: Dict[str, Any]) -> Iterator[List[Any]]:
+    yield [
+        doc.get("payment_id"), doc.get("client_id"), stored_to_rubles(doc.get("amount")), doc.get("payment_date"),
+        doc.get("status", PaymentStatus.paid.value), export_timestamp(doc.get("created_at")),
+    ]
+
+def expense_export_rows(doc: Dict[str, Any]) -> Iterator[List[Any]]:
+    yield [
+        doc.get("expense_id"), stored_to_rubles(doc.get("amount")), doc.get("description"), doc.get("category"),
+        doc.get("expense_date"), export_timestamp(doc.get("created_at")),
+    ]
+
+# Сущность -> (коллекция, проекция, сортировка по индексу capital_created_id, колонки, строки)
+EXPORT_SOURCES = {
+    ExportEntity.schedules: (
+        "clients", {field: 1 for field in SCHEDULE_EXPORT_COLUMNS[:8] + ["status", "total_amount", "schedule", "sched"]},
+        [("created_at", ASCENDING), ("client_id", ASCENDING)], SCHEDULE_EXPORT_COLUMNS, schedule_export_rows,
+    ),
+    ExportEntity.clients: (
+        "clients", {field: 1 for field in CLIENT_EXPORT_COLUMNS + ["total_amount"]},
+        [("created_at", ASCENDING), ("client_id", ASCENDING)], CLIENT_EXPORT_COLUMNS, client_export_rows,
+    ),
+    ExportEntity.payments: (
+        "payments", {field: 1 for field in PAYMENT_EXPORT_COLUMNS},
+        [("created_at", ASCENDING), ("payment_id", ASCENDING)], PAYMENT_EXPORT_COLUMNS, payment_export_rows,
+    ),
+    ExportEntity.expenses: (
+        "expenses", {field: 1 for field in EXPENSE_EXPORT_COLUMNS},
+        [("created_at", DESCENDING), ("expense_id", DESCENDING)], EXPENSE_EXPORT_COLUMNS, expense_export_rows,
+    ),
+}
+
+async def export_rows(entity: ExportEntity, capital_id: str) -> AsyncIterator[List[Any]]:
+    collection, projection, sort, _, to_rows = EXPORT_SOURCES[entity]
+    projection = {**projection, "_id": 0}
+    cursor = db[collection].find({"capital_id": capital_id}, projection).sort(sort).batch_size(EXPORT_BATCH_SIZE)
+    try:
+        async for doc in cursor:
+            for row in to_rows(doc):
+                yield row
+    finally:
+        await cursor.close()
+
+async def csv_stream(columns: List[str], rows: AsyncIterator[List[Any]]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")  # BOM, чтобы Excel открыл кириллицу в UTF-8
+    writer.writerow(columns)
+    count = 0
+    async for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+async def ndjson_stream(columns: List[str], rows: AsyncIterator[List[Any]]) -> AsyncIterator[bytes]:
+    chunk = []
+    async for row in rows:
+        chunk.append(orjson.dumps(dict(zip(columns, row))))
+        if len(chunk) == EXPORT_BATCH_SIZE:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
+
+async def xlsx_stream(columns: List[str], rows: AsyncIterator[List[Any]]) -> AsyncIterator[bytes]:
+    """XLSX is a zip with the directory at the end, so the file is built first.
+
+    A write-only workbook spools rows to a temporary file, which keeps memory
+    flat; the finished file is then sent in chunks.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(columns)
+    async for row in rows:
+        sheet.append(row)
+    with tempfile.TemporaryFile() as file:
+        await asyncio.to_thread(workbook.save, file)
+        file.seek(0)
+        while True:
+            chunk = await asyncio.to_thread(file.read, EXPORT_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+EXPORT_WRITERS = {
+    ExportFormat.csv: csv_stream,
+    ExportFormat.ndjson: ndjson_stream,
+    ExportFormat.xlsx: xlsx_stream,
+}
+
+@api_router.get("/export/{capital_id}")
+async def export_capital(
+    capital_id: str,
+    export_format: ExportFormat = Query(ExportFormat.csv, alias="format"),
+    entity: ExportEntity = ExportEntity.schedules,
+    capitals: OwnedCapitals = Depends(get_owned_capitals)
+):
+    """Stream all clients, schedule installments, payments or expenses of a capital"""
+    await capitals.check(capital_id)
+    columns = EXPORT_SOURCES[entity][3]
+    stream = EXPORT_WRITERS[export_format](columns, export_rows(entity, capital_id))
+    filename = f"{entity.value}-{capital_id}.{export_format.value}"
+    return StreamingResponse(
+        stream,
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 # Include the router in the main app
-app.include_router(api_router)
+app.include_router(api_router, dependencies=[Depends(require_converted_money)])
 
 app.add_middleware(
     CORSMiddleware,
@@ -1112,15 +4263,39 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "ETag", "Last-Modified"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint; counters are per worker process"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.on_event("startup")
+async def startup_ensure_indexes():
+    # Индексы строятся в фоне, чтобы не задерживать старт приложения
+    app.state.index_task = asyncio.create_task(ensure_indexes())
+
+@app.on_event("startup")
+async def startup_check_migrations():
+    app.state.migration_check_task = asyncio.create_task(warn_pending_migrations())
+
+@app.on_event("startup")
+async def startup_check_money():
+    app.state.money_check_task = asyncio.create_task(refresh_legacy_money())
+
+@app.on_event("startup")
+async def startup_nightly_jobs():
+    if NIGHTLY_JOBS:
+        app.state.nightly_task = asyncio.create_task(nightly_jobs_loop())
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    nightly_task = getattr(app.state, "nightly_task", None)
+    if nightly_task is not None:
+        nightly_task.cancel()
+    # Незавершённые импорты помечаются как прерванные
+    for task in list(import_tasks):
+        task.cancel()
+    await asyncio.gather(*import_tasks, return_exceptions=True)
     client.close()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+import requests
+import uuid
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# Get the backend URL from the frontend .env file
+BACKEND_URL = None
+try:
+    with open('/app/frontend/.env', 'r') as f:
+        for line in f:
+            if line.startswith('REACT_APP_BACKEND_URL='):
+                BACKEND_URL = line.strip().split('=')[1].strip('"\'')
+                break
+except Exception as e:
+    print(f"Error reading .env file: {e}")
+    sys.exit(1)
+
+if not BACKEND_URL:
+    print("Could not find REACT_APP_BACKEND_URL in .env file")
+    sys.exit(1)
+
+API_URL = f"{BACKEND_URL}/api"
+print(f"Using API URL: {API_URL}")
+
+# Unique user so the test never touches real data
+TEST_USER_ID = f"test_user_balance_{uuid.uuid4()}"
+
+headers = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {TEST_USER_ID}"
+}
+
+INITIAL_BALANCE = 10000.0
+EXPENSE_AMOUNT = 100.0
+PARALLEL_REQUESTS = 150  # More than the balance can cover
+WORKERS = 30
+
+def print_separator(title):
+    """Print a separator with a title for better readability"""
+    print("\n" + "="*80)
+    print(f" {title} ".center(80, "="))
+    print("="*80 + "\n")
+
+def get_balance(capital_id):
+    response = requests.get(f"{API_URL}/capitals/{capital_id}", headers=headers)
+    response.raise_for_status()
+    return response.json()["balance"]
+
+def create_expense(capital_id, index):
+    response = requests.post(f"{API_URL}/expenses", headers=headers, json={
+        "capital_id": capital_id,
+        "amount": EXPENSE_AMOUNT,
+        "description": f"Concurrency test expense {index}"
+    })
+    return response
+
+def test_parallel_debits():
+    """Hammer one capital with parallel expenses and check that no debit is lost or overdrawn"""
+    print_separator("TESTING PARALLEL DEBITS ON ONE CAPITAL")
+
+    response = requests.post(f"{API_URL}/capitals", headers=headers, json={
+        "name": "Concurrency test capital",
+        "balance": INITIAL_BALANCE
+    })
+    if response.status_code != 200:
+        print(f"❌ Error creating capital: {response.status_code} - {response.text}")
+        return False, None
+    capital_id = response.json()["id"]
+    print(f"✅ Created capital {capital_id} with balance {INITIAL_BALANCE}")
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        responses = list(pool.map(lambda i: create_expense(capital_id, i), range(PARALLEL_REQUESTS)))
+
+    succeeded = [r for r in responses if r.status_code == 200]
+    rejected = [r for r in responses if r.status_code == 400]
+    unexpected = [r for r in responses if r.status_code not in (200, 400)]
+    print(f"Succeeded: {len(succeeded)}, rejected for funds: {len(rejected)}, unexpected: {len(unexpected)}")
+
+    if unexpected:
+        print(f"❌ Unexpected response: {unexpected[0].status_code} - {unexpected[0].text}")
+        return False, capital_id
+
+    expected_successes = int(INITIAL_BALANCE // EXPENSE_AMOUNT)
+    if len(succeeded) != expected_successes:
+        print(f"❌ Expected exactly {expected_successes} successful debits, got {len(succeeded)}")
+        return False, capital_id
+
+    balance = get_balance(capital_id)
+    expected_balance = INITIAL_BALANCE - len(succeeded) * EXPENSE_AMOUNT
+    if abs(balance - expected_balance) > 0.001:
+        print(f"❌ Final balance {balance}, expected {expected_balance}")
+        return False, capital_id
+    print(f"✅ Final balance is {balance} as expected, never overdrawn")
+
+    # Delete the expenses in parallel: every credit must land
+    expense_ids = [r.json()["expense_id"] for r in succeeded]
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        deletions = list(pool.map(
+            lambda expense_id: requests.delete(f"{API_URL}/expenses/{expense_id}", headers=headers),
+            expense_ids
+        ))
+    if any(r.status_code != 200 for r in deletions):
+        print("❌ Some expense deletions failed")
+        return False, capital_id
+
+    balance = get_balance(capital_id)
+    if abs(balance - INITIAL_BALANCE) > 0.001:
+        print(f"❌ Balance after parallel refunds is {balance}, expected {INITIAL_BALANCE}")
+        return False, capital_id
+    print(f"✅ Balance restored to {balance} after parallel refunds")
+    return True, capital_id
+
+def test_parallel_payment_toggles(capital_id):
+    """Mark every installment of a client paid in parallel and check the credited total"""
+    print_separator("TESTING PARALLEL PAYMENT STATUS UPDATES")
+
+    response = requests.post(f"{API_URL}/clients", headers=headers, json={
+        "capital_id": capital_id,
+        "name": "Concurrency Test Client",
+        "product": "Test product",
+        "purchase_amount": 1200.0,
+        "debt_amount": 1200.0,
+        "monthly_payment": 100.0,
+        "start_date": "2024-01-01",
+        "months": 12
+    })
+    if response.status_code != 200:
+        print(f"❌ Error creating client: {response.status_code} - {response.text}")
+        return False
+    client = response.json()
+    balance_before = get_balance(capital_id)
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        updates = list(pool.map(
+            lambda item: requests.put(
+                f"{API_URL}/clients/{client['client_id']}/payments/{item['payment_date']}",
+                headers=headers,
+                json={"status": "paid"}
+            ),
+            client["schedule"]
+        ))
+    if any(r.status_code != 200 for r in updates):
+        print("❌ Some payment status updates failed")
+        return False
+
+    balance = get_balance(capital_id)
+    expected_balance = balance_before + sum(item["amount"] for item in client["schedule"])
+    if abs(balance - expected_balance) > 0.001:
+        print(f"❌ Balance after parallel payments is {balance}, expected {expected_balance}")
+        return False
+    print(f"✅ Balance after parallel payments is {balance} as expected")
+    return True
+
+def cleanup(capital_id):
+    if capital_id:
+        requests.delete(f"{API_URL}/capitals/{capital_id}", headers=headers)
+
+if __name__ == "__main__":
+    success, capital_id = test_parallel_debits()
+    try:
+        if success:
+            success = test_parallel_payment_toggles(capital_id)
+    finally:
+        cleanup(capital_id)
+    sys.exit(0 if success else 1)
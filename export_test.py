@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import requests
+import uuid
+import sys
+import csv
+import io
+import json
+
+# Get the backend URL from the frontend .env file
+BACKEND_URL = None
+try:
+    with open('/app/frontend/.env', 'r') as f:
+        for line in f:
+            if line.startswith('REACT_APP_BACKEND_URL='):
+                BACKEND_URL = line.strip().split('=')[1].strip('"\'')
+                break
+except Exception as e:
+    print(f"Error reading .env file: {e}")
+    sys.exit(1)
+
+if not BACKEND_URL:
+    print("Could not find REACT_APP_BACKEND_URL in .env file")
+    sys.exit(1)
+
+API_URL = f"{BACKEND_URL}/api"
+print(f"Using API URL: {API_URL}")
+
+# Unique user so the test never touches real data
+TEST_USER_ID = f"test_user_export_{uuid.uuid4()}"
+
+headers = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {TEST_USER_ID}"
+}
+
+CLIENTS = 3
+MONTHS = 4
+
+def print_separator(title):
+    """Print a separator with a title for better readability"""
+    print("\n" + "="*80)
+    print(f" {title} ".center(80, "="))
+    print("="*80 + "\n")
+
+def export(capital_id, export_format, entity="schedules"):
+    response = requests.get(f"{API_URL}/export/{capital_id}", headers=headers, stream=True,
+                            params={"format": export_format, "entity": entity})
+    if response.status_code != 200:
+        print(f"❌ Error exporting {entity} as {export_format}: {response.status_code} - {response.text}")
+        return None
+    return b"".join(response.iter_content(chunk_size=65536))
+
+def test_schedule_export(capital_id):
+    """One row per installment in both CSV and NDJSON"""
+    print_separator("TESTING SCHEDULE EXPORT")
+
+    body = export(capital_id, "csv")
+    if body is None:
+        return False
+    rows = list(csv.DictReader(io.StringIO(body.decode("utf-8-sig"))))
+    if len(rows) != CLIENTS * MONTHS:
+        print(f"❌ CSV has {len(rows)} rows, expected {CLIENTS * MONTHS}")
+        return False
+    if sorted({row["installment"] for row in rows}) != [str(m) for m in range(1, MONTHS + 1)]:
+        print("❌ CSV installment numbers are wrong")
+        return False
+    print(f"✅ CSV has {len(rows)} installment rows")
+
+    body = export(capital_id, "ndjson")
+    if body is None:
+        return False
+    records = [json.loads(line) for line in body.splitlines() if line]
+    if len(records) != CLIENTS * MONTHS or any(r["amount"] != 1000.0 for r in records):
+        print(f"❌ NDJSON export is wrong: {records[:2]}")
+        return False
+    print(f"✅ NDJSON has {len(records)} installment rows")
+    return True
+
+def test_other_entities(capital_id):
+    print_separator("TESTING CLIENT AND EXPENSE EXPORT")
+
+    body = export(capital_id, "ndjson", "clients")
+    if body is None or len(body.splitlines()) != CLIENTS:
+        print("❌ Client export does not have one row per client")
+        return False
+    print("✅ Client export has one row per client")
+
+    body = export(capital_id, "xlsx", "expenses")
+    if body is None or not body.startswith(b"PK"):
+        print("❌ Expense export is not an XLSX file")
+        return False
+    print(f"✅ Expense XLSX export, {len(body)} bytes")
+
+    response = requests.get(f"{API_URL}/export/{uuid.uuid4()}", headers=headers)
+    if response.status_code != 403:
+        print(f"❌ Export of a foreign capital returned {response.status_code}")
+        return False
+    print("✅ Export of a foreign capital is denied")
+    return True
+
+if __name__ == "__main__":
+    response = requests.post(f"{API_URL}/capitals", headers=headers, json={
+        "name": "Export test capital",
+        "balance": 100000.0
+    })
+    if response.status_code != 200:
+        print(f"❌ Error creating capital: {response.status_code} - {response.text}")
+        sys.exit(1)
+    capital_id = response.json()["id"]
+
+    try:
+        for i in range(CLIENTS):
+            response = requests.post(f"{API_URL}/clients", headers=headers, json={
+                "capital_id": capital_id,
+                "name": f"Export Test Client {i}",
+                "product": "Test product",
+                "purchase_amount": 3000.0,
+                "debt_amount": 4000.0,
+                "monthly_payment": 1000.0,
+                "start_date": "2024-01-15",
+                "months": MONTHS
+            })
+            response.raise_for_status()
+        requests.post(f"{API_URL}/expenses", headers=headers, json={
+            "capital_id": capital_id,
+            "amount": 100.0,
+            "description": "Export test expense"
+        }).raise_for_status()
+
+        success = test_schedule_export(capital_id) and test_other_entities(capital_id)
+    finally:
+        requests.delete(f"{API_URL}/capitals/{capital_id}", headers=headers)
+    sys.exit(0 if success else 1)
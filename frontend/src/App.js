@@ -426,36 +426,43 @@ const ImportModal = ({ isOpen, onClose, selectedCapital, onClientsImported }) =>
       let errorCount = 0;
       const errors = [];
 
-      for (const clientData of clients) {
+      // Send clients in chunks to the bulk endpoint instead of one request per row
+      const CHUNK_SIZE = 500;
+      for (let offset = 0; offset < clients.length; offset += CHUNK_SIZE) {
+        const chunk = clients.slice(offset, offset + CHUNK_SIZE);
+        // Prepare data according to ClientCreate model
+        const clientPayloads = chunk.map(clientData => ({
+          name: clientData.name,
+          product: clientData.product,
+          purchase_amount: clientData.purchase_amount,
+          debt_amount: clientData.debt_amount,
+          monthly_payment: clientData.monthly_payment,
+          start_date: clientData.start_date,
+          months: clientData.months || clientData.schedule?.length || 12,
+          guarantor_name: clientData.guarantor_name,
+          client_address: clientData.client_address,
+          client_phone: clientData.client_phone,
+          guarantor_phone: clientData.guarantor_phone,
+          schedule: clientData.schedule || null  // Передаем график платежей из Excel
+        }));
+
         try {
-          // Prepare data according to ClientCreate model
-          const clientPayload = {
+          const response = await axios.post(`${API}/api/clients/bulk`, {
             capital_id: selectedCapital.id,
-            name: clientData.name,
-            product: clientData.product,
-            purchase_amount: clientData.purchase_amount,
-            debt_amount: clientData.debt_amount,
-            monthly_payment: clientData.monthly_payment,
-            start_date: clientData.start_date,
-            months: clientData.months || clientData.schedule?.length || 12,
-            guarantor_name: clientData.guarantor_name,
-            client_address: clientData.client_address,
-            client_phone: clientData.client_phone,
-            guarantor_phone: clientData.guarantor_phone,
-            schedule: clientData.schedule || null  // Передаем график платежей из Excel
-          };
-
-          const response = await axios.post(`${API}/api/clients`, clientPayload, { headers });
-
-          if (response.status === 200 || response.status === 201) {
-            successCount++;
-          } else {
-            errorCount++;
-            errors.push(`Клиент ${clientData.name}: ${response.data.detail || 'неизвестная ошибка'}`);
-          }
+            clients: clientPayloads,
+            offset
+          }, { headers });
+
+          successCount += response.data.created;
+          errorCount += response.data.failed;
+          response.data.results
+            .filter(result => result.status === 'error')
+            .forEach(result => {
+              errors.push(`Клиент ${clients[result.row]?.name}: ${result.detail}`);
+            });
         } catch (error) {
-          errorCount++;
-          errors.push(`Клиент ${clientData.name}: ${error.response?.data?.detail || error.message}`);
+          errorCount += chunk.length;
+          errors.push(`Строки ${offset + 1}-${offset + chunk.length}: ${error.response?.data?.detail || error.message}`);
         }
       }
 
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+import requests
+import uuid
+import sys
+import time
+
+# Get the backend URL from the frontend .env file
+BACKEND_URL = None
+try:
+    with open('/app/frontend/.env', 'r') as f:
+        for line in f:
+            if line.startswith('REACT_APP_BACKEND_URL='):
+                BACKEND_URL = line.strip().split('=')[1].strip('"\'')
+                break
+except Exception as e:
+    print(f"Error reading .env file: {e}")
+    sys.exit(1)
+
+if not BACKEND_URL:
+    print("Could not find REACT_APP_BACKEND_URL in .env file")
+    sys.exit(1)
+
+API_URL = f"{BACKEND_URL}/api"
+print(f"Using API URL: {API_URL}")
+
+# Unique user so the test never touches real data
+TEST_USER_ID = f"test_user_import_{uuid.uuid4()}"
+
+# No Content-Type here: requests sets the multipart boundary itself
+headers = {
+    "Authorization": f"Bearer {TEST_USER_ID}"
+}
+
+VALID_ROWS = 50
+CSV_HEADER = "name,product,purchase_amount,debt_amount,monthly_payment,start_date,months\n"
+
+def print_separator(title):
+    """Print a separator with a title for better readability"""
+    print("\n" + "="*80)
+    print(f" {title} ".center(80, "="))
+    print("="*80 + "\n")
+
+def make_csv():
+    lines = [CSV_HEADER]
+    for i in range(VALID_ROWS):
+        lines.append(f"Import Client {i},Test product,1000,1200,100,2024-01-15,12\n")
+    # Line VALID_ROWS + 2 of the file: monthly_payment is missing
+    lines.append("Broken Client,Test product,1000,1200,,2024-01-15,12\n")
+    return "".join(lines).encode()
+
+def wait_for_job(job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = requests.get(f"{API_URL}/import/{job_id}", headers=headers)
+        if response.status_code != 200:
+            print(f"❌ Error reading job: {response.status_code} - {response.text}")
+            return None
+        job = response.json()
+        print(f"status: {job['status']}, rows: {job['rows']}")
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.5)
+    print("❌ Import did not finish in time")
+    return None
+
+def test_csv_import(capital_id):
+    """Valid rows are created, invalid ones are reported by file line"""
+    print_separator("TESTING CSV IMPORT JOB")
+
+    response = requests.post(f"{API_URL}/import", headers=headers, data={"capital_id": capital_id},
+                             files={"file": ("clients.csv", make_csv(), "text/csv")})
+    if response.status_code != 202:
+        print(f"❌ Error starting import: {response.status_code} - {response.text}")
+        return False
+    job = wait_for_job(response.json()["job_id"])
+    if not job:
+        return False
+    if job["status"] != "completed" or job["created"] != VALID_ROWS or job["failed"] != 1:
+        print(f"❌ Unexpected job result: {job}")
+        return False
+    if [error["row"] for error in job["errors"]] != [VALID_ROWS + 2]:
+        print(f"❌ Wrong error rows: {job['errors']}")
+        return False
+    print(f"✅ {job['created']} clients imported, error reported for line {job['errors'][0]['row']}")
+
+    clients = requests.get(f"{API_URL}/clients", headers=headers, params={"capital_id": capital_id}).json()
+    if len(clients) != VALID_ROWS:
+        print(f"❌ Capital has {len(clients)} clients")
+        return False
+    print("✅ Imported clients are listed")
+    return True
+
+def test_rejected_upload(capital_id):
+    print_separator("TESTING REJECTED UPLOADS")
+
+    response = requests.post(f"{API_URL}/import", headers=headers, data={"capital_id": capital_id},
+                             files={"file": ("clients.txt", b"hello", "text/plain")})
+    if response.status_code != 415:
+        print(f"❌ Unsupported file returned {response.status_code}")
+        return False
+    response = requests.get(f"{API_URL}/import/{uuid.uuid4()}", headers=headers)
+    if response.status_code != 404:
+        print(f"❌ Unknown job returned {response.status_code}")
+        return False
+    print("✅ Unsupported files and unknown jobs are rejected")
+    return True
+
+if __name__ == "__main__":
+    response = requests.post(f"{API_URL}/capitals", headers=headers, json={
+        "name": "Import test capital",
+        "balance": 1000000.0
+    })
+    if response.status_code != 200:
+        print(f"❌ Error creating capital: {response.status_code} - {response.text}")
+        sys.exit(1)
+    capital_id = response.json()["id"]
+
+    try:
+        success = test_csv_import(capital_id) and test_rejected_upload(capital_id)
+    finally:
+        requests.delete(f"{API_URL}/capitals/{capital_id}", headers=headers)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import requests
+import uuid
+import sys
+from datetime import date
+
+# Get the backend URL from the frontend .env file
+BACKEND_URL = None
+try:
+    with open('/app/frontend/.env', 'r') as f:
+        for line in f:
+            if line.startswith('REACT_APP_BACKEND_URL='):
+                BACKEND_URL = line.strip().split('=')[1].strip('"\'')
+                break
+except Exception as e:
+    print(f"Error reading .env file: {e}")
+    sys.exit(1)
+
+if not BACKEND_URL:
+    print("Could not find REACT_APP_BACKEND_URL in .env file")
+    sys.exit(1)
+
+API_URL = f"{BACKEND_URL}/api"
+print(f"Using API URL: {API_URL}")
+
+# Unique user so the test never touches real data
+TEST_USER_ID = f"test_user_ledger_{uuid.uuid4()}"
+
+headers = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {TEST_USER_ID}"
+}
+
+TODAY = date.today().strftime("%Y-%m-%d")
+
+def print_separator(title):
+    """Print a separator with a title for better readability"""
+    print("\n" + "="*80)
+    print(f" {title} ".center(80, "="))
+    print("="*80 + "\n")
+
+def check(response, action):
+    if response.status_code != 200:
+        print(f"❌ Error {action}: {response.status_code} - {response.text}")
+        return None
+    return response.json()
+
+def test_ledger(capital_id):
+    """Every balance change must land in the ledger and add up to the balance"""
+    print_separator("TESTING LEDGER ENTRIES FOR BALANCE CHANGES")
+
+    client = check(requests.post(f"{API_URL}/clients", headers=headers, json={
+        "capital_id": capital_id,
+        "name": "Ledger Test Client",
+        "product": "Test product",
+        "purchase_amount": 3000.0,
+        "debt_amount": 3600.0,
+        "monthly_payment": 1200.0,
+        "start_date": "2024-01-31",
+        "months": 3
+    }), "creating client")
+    expense = check(requests.post(f"{API_URL}/expenses", headers=headers, json={
+        "capital_id": capital_id,
+        "amount": 500.0,
+        "description": "Ledger test expense"
+    }), "creating expense")
+    if not client or not expense:
+        return False
+    payment_date = client["schedule"][0]["payment_date"]
+    for status in ("paid", "pending", "paid"):
+        if not check(requests.put(
+            f"{API_URL}/clients/{client['client_id']}/payments/{payment_date}",
+            headers=headers, json={"status": status}
+        ), f"marking payment {status}"):
+            return False
+    if not check(requests.put(f"{API_URL}/expenses/{expense['expense_id']}", headers=headers,
+                              json={"amount": 700.0}), "updating expense"):
+        return False
+
+    entries = check(requests.get(f"{API_URL}/capitals/{capital_id}/ledger", headers=headers), "reading ledger")
+    if entries is None:
+        return False
+    kinds = [entry["kind"] for entry in entries]
+    print(f"Ledger kinds: {kinds}")
+    expected = ["opening", "client_purchase", "expense", "payment", "payment_reversal", "payment", "expense"]
+    if kinds != expected:
+        print(f"❌ Expected ledger kinds {expected}")
+        return False
+
+    capital = check(requests.get(f"{API_URL}/capitals/{capital_id}", headers=headers), "reading capital")
+    total = sum(entry["amount"] for entry in entries)
+    if abs(total - capital["balance"]) > 0.001:
+        print(f"❌ Ledger sums to {total}, balance is {capital['balance']}")
+        return False
+    print(f"✅ Ledger sums to the balance {capital['balance']}")
+
+    verify = check(requests.get(f"{API_URL}/capitals/{capital_id}/ledger/verify", headers=headers), "verifying")
+    if not verify or not verify["ok"]:
+        print(f"❌ Verification failed: {verify}")
+        return False
+    print("✅ Ledger verification passed")
+
+    balance = check(requests.get(f"{API_URL}/capitals/{capital_id}/balance", headers=headers,
+                                 params={"at": TODAY}), "reading balance at date")
+    if not balance or abs(balance["balance"] - capital["balance"]) > 0.001:
+        print(f"❌ Balance at {TODAY} is {balance}, expected {capital['balance']}")
+        return False
+    print(f"✅ Balance at {TODAY} matches")
+
+    flow = check(requests.get(f"{API_URL}/capitals/{capital_id}/cash-flow", headers=headers,
+                              params={"date_from": TODAY, "date_to": TODAY}), "reading cash flow")
+    if not flow or abs(flow["closing_balance"] - capital["balance"]) > 0.001:
+        print(f"❌ Cash flow closing balance is wrong: {flow}")
+        return False
+    if abs(flow["inflow"] - flow["outflow"] - total) > 0.001:
+        print(f"❌ Cash flow inflow/outflow do not match the ledger: {flow}")
+        return False
+    print(f"✅ Cash flow: inflow {flow['inflow']}, outflow {flow['outflow']}")
+    return True
+
+if __name__ == "__main__":
+    capital = check(requests.post(f"{API_URL}/capitals", headers=headers, json={
+        "name": "Ledger test capital",
+        "balance": 10000.0
+    }), "creating capital")
+    if not capital:
+        sys.exit(1)
+
+    try:
+        success = test_ledger(capital["id"])
+    finally:
+        requests.delete(f"{API_URL}/capitals/{capital['id']}", headers=headers)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""Maintenance commands for the CRM backend.
+
+Подключение берётся из тех же переменных окружения, что и у сервера
+(MONGO_URL, DB_NAME, MONGO_TLS), например для локального mongod:
+
+    MONGO_URL=mongodb://localhost:27017 DB_NAME=crm MONGO_TLS=false python manage.py indexes --check
+"""
+import argparse
+import asyncio
+import sys
+from datetime import date
+
+from backend import server
+
+
+async def indexes_command(args) -> int:
+    report = await server.ensure_indexes()
+    for key in ("created", "mismatched", "unexpected", "failed"):
+        for name in report[key]:
+            print(f"{key}: {name}")
+
+    exit_code = 1 if report["failed"] else 0
+    if args.check:
+        unindexed = await server.check_hot_queries()
+        for query in unindexed:
+            print(f"❌ Not served by an index: {query}")
+        if unindexed or report["mismatched"]:
+            exit_code = 1
+        else:
+            print("✅ All hot queries are served by indexes")
+    return exit_code
+
+
+async def stats_command(args) -> int:
+    if args.capital_id:
+        capital_ids = args.capital_id
+    else:
+        capital_ids = await server.db.capitals.distinct("id")
+
+    drifted = 0
+    for capital_id in capital_ids:
+        result = await server.rebuild_capital_stats(capital_id, dry_run=args.dry_run)
+        if result["missing"]:
+            print(f"{capital_id}: stats document was missing")
+        elif result["drift"]:
+            drifted += 1
+            print(f"{capital_id}: drift detected")
+            for key, (stored, actual) in sorted(result["drift"].items()):
+                print(f"    {key}: stored={stored} actual={actual}")
+    action = "Checked" if args.dry_run else "Rebuilt"
+    print(f"{action} {len(capital_ids)} capitals, {drifted} with drift")
+    return 1 if args.dry_run and drifted else 0
+
+
+async def sweep_command(args) -> int:
+    today = date.fromisoformat(args.date) if args.date else None
+    report = await server.sweep_overdue(today)
+    print(f"Marked {report['payments']} payments overdue, "
+          f"changed {report['status_changes']} client statuses in {report['clients']} clients")
+    return 0
+
+
+async def ledger_command(args) -> int:
+    if args.action == "backfill":
+        created = await server.backfill_ledger_openings()
+        print(f"Recorded opening entries for {created} capitals")
+        return 0
+    if args.action == "snapshot":
+        until = date.fromisoformat(args.until) if args.until else None
+        if until and until >= date.today():
+            print(f"❌ --until {until} is not a closed day, use a date before today")
+            return 2
+        try:
+            report = await server.snapshot_ledgers(until)
+        except server.LegacyMoney as e:
+            print(f"❌ {e}")
+            return 1
+        print(f"Wrote {report['snapshots']} snapshots for {report['capitals']} capitals")
+        return 0
+
+    capital_ids = args.capital_id or await server.db.capitals.distinct("id")
+    mismatched = 0
+    for capital_id in capital_ids:
+        try:
+            result = await server.verify_ledger(capital_id, full=args.full)
+        except server.LegacyMoney as e:
+            mismatched += 1
+            print(f"❌ {e}")
+            continue
+        if not result["ok"]:
+            mismatched += 1
+            print(f"❌ {capital_id}: balance={result['balance']} ledger={result['ledger_balance']}")
+    print(f"Verified {len(capital_ids)} capitals, {mismatched} mismatched")
+    return 1 if mismatched else 0
+
+
+async def schedules_command(args) -> int:
+    report = await server.convert_schedules(
+        args.action == "encode", capital_id=args.capital_id, batch_size=args.batch_size
+    )
+    print(f"Converted {report['converted']} schedules, skipped {report['skipped']}, "
+          f"{report['conflicts']} changed meanwhile (run again to pick them up)")
+    return 1 if report["conflicts"] else 0
+
+
+async def money_command(args) -> int:
+    if args.check:
+        counts = await server.count_legacy_money()
+        for collection, count in counts.items():
+            if count:
+                print(f"{collection}: {count} documents with float amounts")
+        legacy = sum(counts.values())
+        print("✅ All amounts are stored in kopecks" if not legacy else f"❌ {legacy} documents to convert")
+        return 1 if legacy else 0
+
+    report = await server.migrate_money(batch_size=args.batch_size)
+    conflicts = 0
+    for collection, counts in report.items():
+        conflicts += counts["conflicts"]
+        print(f"{collection}: converted {counts['converted']}, {counts['conflicts']} changed meanwhile")
+    return 1 if conflicts else 0
+
+
+async def migrate_command(args) -> int:
+    if args.check:
+        pending = await server.pending_migrations()
+        for collection, count in pending.items():
+            print(f"{collection}: {count} documents below schema version {server.SCHEMA_VERSIONS[collection]}")
+        print("✅ All documents are at the current schema version" if not pending else "❌ Migrations pending")
+        return 1 if pending else 0
+
+    results = await server.run_migrations(
+        args.collection, batch_size=args.batch_size, throttle_ms=args.throttle_ms
+    )
+    incomplete = 0
+    for result in results:
+        if result["status"] != "completed":
+            incomplete += 1
+        print(f"{result['collection']} v{result['version']} ({result['description']}): {result['status']}, "
+              f"migrated {result['migrated']}, {result['remaining']} remaining")
+    return 1 if incomplete else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    indexes = subparsers.add_parser("indexes", help="create missing indexes and report drift")
+    indexes.add_argument("--check", action="store_true", help="fail if a hot query is not served by an index")
+    indexes.set_defaults(handler=indexes_command)
+
+    stats = subparsers.add_parser("stats", help="recompute materialized capital stats and report drift")
+    stats.add_argument("--capital-id", action="append", help="capital to rebuild (default: all)")
+    stats.add_argument("--dry-run", action="store_true", help="only report drift, do not overwrite stats")
+    stats.set_defaults(handler=stats_command)
+
+    sweep = subparsers.add_parser("sweep", help="mark past-due installments overdue and update client statuses")
+    sweep.add_argument("--date", help="sweep as of this YYYY-MM-DD date (default: today)")
+    sweep.set_defaults(handler=sweep_command)
+
+    ledger = subparsers.add_parser("ledger", help="maintain and verify the capital ledger")
+    ledger.add_argument("action", choices=["backfill", "snapshot", "verify"],
+                        help="backfill opening entries, write daily snapshots or verify balances")
+    ledger.add_argument("--until", help="snapshot: last day to snapshot, YYYY-MM-DD (default: yesterday)")
+    ledger.add_argument("--capital-id", action="append", help="verify: capital to check (default: all)")
+    ledger.add_argument("--full", action="store_true", help="verify: sum the whole ledger instead of snapshot + tail")
+    ledger.set_defaults(handler=ledger_command)
+
+    schedules = subparsers.add_parser("schedules", help="convert stored payment schedules between storage formats")
+    schedules.add_argument("action", choices=["encode", "decode"],
+                           help="encode rows into the columnar format or decode columnar back into rows")
+    schedules.add_argument("--capital-id", help="capital to convert (default: all)")
+    schedules.add_argument("--batch-size", type=int, default=500, help="clients per bulk write")
+    schedules.set_defaults(handler=schedules_command)
+
+    money = subparsers.add_parser("money", help="convert float ruble amounts to integer kopecks")
+    money.add_argument("--check", action="store_true", help="only count documents that still need converting")
+    money.add_argument("--batch-size", type=int, default=500, help="documents per bulk write")
+    money.set_defaults(handler=money_command)
+
+    migrate = subparsers.add_parser("migrate", help="bring documents up to the current schema version")
+    migrate.add_argument("--collection", action="append", help="collection to migrate (default: all)")
+    migrate.add_argument("--check", action="store_true", help="only count documents below the current version")
+    migrate.add_argument("--batch-size", type=int, default=server.MIGRATION_BATCH_SIZE, help="documents per bulk write")
+    migrate.add_argument("--throttle-ms", type=int, default=server.MIGRATION_THROTTLE_MS,
+                         help="pause between batches, milliseconds")
+    migrate.set_defaults(handler=migrate_command)
+
+    args = parser.parse_args()
+
+    async def run():
+        try:
+            return await args.handler(args)
+        finally:
+            server.client.close()
+
+    return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""Conversion of legacy float ruble amounts to integer kopecks (manage.py money).
+
+Seeds one capital with a client, a ledger entry and a ledger snapshot written
+the old way, checks that the read layer serves them unscaled and that balance
+writes refuse the float balance, converts them with migrate_money and checks
+the stored types, the values read back and balance writes after conversion.
+migrate_money converts the whole database, so point it at a scratch one:
+
+    MONGO_URL=mongodb://localhost:27017 DB_NAME=crm_test MONGO_TLS=false python money_migration_test.py
+"""
+import asyncio
+import sys
+import uuid
+from datetime import datetime
+
+from fastapi import HTTPException
+
+from backend import server
+
+CAPITAL_ID = f"test_capital_money_{uuid.uuid4()}"
+CLIENT_ID = f"test_client_money_{uuid.uuid4()}"
+ENTRY_ID = f"test_entry_money_{uuid.uuid4()}"
+
+# Поля в рублях, как их писали до перевода, и ожидаемые копейки
+LEGACY_CAPITAL = {"balance": (1234.56, 123456)}
+LEGACY_CLIENT = {
+    "purchase_amount": (1000.0, 100000),
+    "debt_amount": (1500.5, 150050),
+    "total_amount": (1500.5, 150050),
+    "monthly_payment": (250.08, 25008),
+}
+LEGACY_LEDGER = {"amount": (1234.56, 123456)}
+LEGACY_SNAPSHOT = {"balance": (1234.56, 123456), "inflow": (1234.56, 123456), "outflow": (0.0, 0)}
+SCHEDULE = [("2024-01-10", 250.08, 25008), ("2024-02-10", 0.1, 10)]
+
+def print_separator(title):
+    """Print a separator with a title for better readability"""
+    print("\n" + "="*80)
+    print(f" {title} ".center(80, "="))
+    print("="*80 + "\n")
+
+def legacy(fields):
+    return {field: rubles for field, (rubles, _) in fields.items()}
+
+async def seed():
+    now = datetime.utcnow()
+    await server.db.capitals.insert_one({
+        "id": CAPITAL_ID, "name": "Money test capital", "owner_id": "test_user_money",
+        "is_active": True, "created_at": now, **legacy(LEGACY_CAPITAL),
+    })
+    await server.db.clients.insert_one({
+        "client_id": CLIENT_ID, "capital_id": CAPITAL_ID, "name": "Money test client",
+        "status": "active", "created_at": now, **legacy(LEGACY_CLIENT),
+        "schedule": [{"payment_date": day, "amount": rubles, "status": "pending"} for day, rubles, _ in SCHEDULE],
+    })
+    await server.db.ledger.insert_one({
+        "entry_id": ENTRY_ID, "capital_id": CAPITAL_ID, "kind": "opening",
+        "entry_date": "2024-01-01", "created_at": now, **legacy(LEGACY_LEDGER),
+    })
+    await server.db.ledger_snapshots.insert_one({
+        "capital_id": CAPITAL_ID, "date": "2024-01-01", **legacy(LEGACY_SNAPSHOT),
+    })
+
+async def read_back():
+    """Every seeded document as the API would serve it, amounts in rubles"""
+    capital = await server.db.capitals.find_one({"id": CAPITAL_ID}, {"_id": 0})
+    client = await server.db.clients.find_one({"client_id": CLIENT_ID}, {"_id": 0})
+    entry = await server.db.ledger.find_one({"entry_id": ENTRY_ID})
+    snapshot = await server.db.ledger_snapshots.find_one({"capital_id": CAPITAL_ID}, {"_id": 0})
+    return {
+        "capitals": server.capital_from_db(capital),
+        "clients": server.client_from_db(client),
+        "ledger": server.ledger_entry_from_db(entry),
+        "ledger_snapshots": server.money_from_db(snapshot, server.MONEY_FIELDS["ledger_snapshots"]),
+    }
+
+def check_rubles(documents) -> bool:
+    ok = True
+    for collection, fields in (("capitals", LEGACY_CAPITAL), ("clients", LEGACY_CLIENT),
+                               ("ledger", LEGACY_LEDGER), ("ledger_snapshots", LEGACY_SNAPSHOT)):
+        for field, (rubles, _) in fields.items():
+            value = documents[collection][field]
+            if value != rubles:
+                print(f"❌ {collection}.{field} reads as {value}, expected {rubles}")
+                ok = False
+    amounts = [entry["amount"] for entry in documents["clients"]["schedule"]]
+    if amounts != [rubles for _, rubles, _ in SCHEDULE]:
+        print(f"❌ Schedule amounts read as {amounts}")
+        ok = False
+    if ok:
+        print("✅ All amounts read back in rubles")
+    return ok
+
+async def check_stored_kopecks() -> bool:
+    ok = True
+    stored = {
+        "capitals": await server.db.capitals.find_one({"id": CAPITAL_ID}),
+        "clients": await server.db.clients.find_one({"client_id": CLIENT_ID}),
+        "ledger": await server.db.ledger.find_one({"entry_id": ENTRY_ID}),
+        "ledger_snapshots": await server.db.ledger_snapshots.find_one({"capital_id": CAPITAL_ID}),
+    }
+    for collection, fields in (("capitals", LEGACY_CAPITAL), ("clients", LEGACY_CLIENT),
+                               ("ledger", LEGACY_LEDGER), ("ledger_snapshots", LEGACY_SNAPSHOT)):
+        for field, (_, kopecks) in fields.items():
+            value = stored[collection][field]
+            if not isinstance(value, int) or value != kopecks:
+                print(f"❌ {collection}.{field} is stored as {value!r}, expected {kopecks}")
+                ok = False
+    amounts = [entry["amount"] for entry in stored["clients"]["schedule"]]
+    if amounts != [kopecks for _, _, kopecks in SCHEDULE] or not all(isinstance(a, int) for a in amounts):
+        print(f"❌ Schedule amounts are stored as {amounts!r}")
+        ok = False
+    if ok:
+        print("✅ All amounts are stored as integer kopecks")
+    return ok
+
+async def check_balance_writes(expected_balance, refused) -> bool:
+    """Debit 100 ₽ and credit 50 ₽; both must be refused on a float balance"""
+    ok = True
+    for name, write in (
+        ("debit", server.debit_capital(CAPITAL_ID, 10000, kind=server.LedgerKind.expense)),
+        ("credit", server.adjust_capital_balance(CAPITAL_ID, 5000, kind=server.LedgerKind.payment)),
+    ):
+        try:
+            await write
+            if refused:
+                print(f"❌ {name} of a float ruble balance was applied")
+                ok = False
+        except server.LegacyMoney as e:
+            if not refused:
+                print(f"❌ {name} was refused after conversion: {e}")
+                ok = False
+        except HTTPException as e:
+            print(f"❌ {name} failed with {e.status_code}: {e.detail}")
+            ok = False
+    capital = await server.db.capitals.find_one({"id": CAPITAL_ID})
+    entries = await server.db.ledger.count_documents({"capital_id": CAPITAL_ID, "entry_id": {"$ne": ENTRY_ID}})
+    if capital["balance"] != expected_balance or type(capital["balance"]) is not type(expected_balance):
+        print(f"❌ Balance is {capital['balance']!r}, expected {expected_balance!r}")
+        ok = False
+    if entries != (0 if refused else 2):
+        print(f"❌ {entries} ledger entries recorded by the balance writes")
+        ok = False
+    if ok:
+        print("✅ Float balance left untouched" if refused else f"✅ Debit and credit applied, balance {expected_balance}")
+    return ok
+
+async def test_money_migration() -> bool:
+    print_separator("LEGACY DOCUMENTS BEFORE CONVERSION")
+    await seed()
+    counts = await server.count_legacy_money()
+    print(f"Legacy documents: {counts}")
+    if any(not counts[collection] for collection in ("capitals", "clients", "ledger", "ledger_snapshots")):
+        print("❌ Seeded documents are not detected as legacy")
+        return False
+    # Непереведённые рубли не должны делиться на 100 при чтении
+    if not check_rubles(await read_back()):
+        return False
+    if "capitals" not in await server.refresh_legacy_money():
+        print("❌ Legacy capitals do not close the write gate")
+        return False
+    if not await check_balance_writes(1234.56, refused=True):
+        return False
+
+    print_separator("CONVERSION")
+    report = await server.migrate_money()
+    print(f"Report: {report}")
+    if not await check_stored_kopecks():
+        return False
+    if not check_rubles(await read_back()):
+        return False
+    client = await server.db.clients.find_one({"client_id": CLIENT_ID}, {"version": 1})
+    if client.get("version") != 1:
+        print(f"❌ Converted client has version {client.get('version')}, expected 1")
+        return False
+
+    print_separator("RERUN")
+    report = await server.migrate_money()
+    print(f"Report: {report}")
+    client = await server.db.clients.find_one({"client_id": CLIENT_ID}, {"version": 1})
+    if client.get("version") != 1 or not await check_stored_kopecks():
+        print("❌ Rerun changed already converted documents")
+        return False
+    print("✅ Rerun left converted documents alone")
+
+    print_separator("BALANCE WRITES AFTER CONVERSION")
+    return await check_balance_writes(123456 - 10000 + 5000, refused=False)
+
+async def main() -> int:
+    try:
+        success = await test_money_migration()
+    finally:
+        await server.db.capitals.delete_many({"id": CAPITAL_ID})
+        await server.db.clients.delete_many({"capital_id": CAPITAL_ID})
+        await server.db.ledger.delete_many({"capital_id": CAPITAL_ID})
+        await server.db.ledger_snapshots.delete_many({"capital_id": CAPITAL_ID})
+        server.client.close()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
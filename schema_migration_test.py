@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Schema migration runner (manage.py migrate): resuming and rerunning.
+
+Runs migrate_collection over a scratch collection: the first run is
+interrupted by a failing transform, the second has to continue after the
+last recorded _id and the third has to change nothing. Also checks that the
+client amount fallbacks stay on until clients v1 is recorded as completed.
+
+    MONGO_URL=mongodb://localhost:27017 DB_NAME=crm_test MONGO_TLS=false python schema_migration_test.py
+"""
+import asyncio
+import sys
+import uuid
+
+from backend import server
+
+COLLECTION = f"test_schema_migration_{uuid.uuid4().hex}"
+VERSION = 1
+DOCUMENTS = 10
+BATCH_SIZE = 2
+INTERRUPT_AT = 5  # Документ, на котором обрывается первый запуск
+
+class Interrupted(Exception):
+    pass
+
+def print_separator(title):
+    """Print a separator with a title for better readability"""
+    print("\n" + "="*80)
+    print(f" {title} ".center(80, "="))
+    print("="*80 + "\n")
+
+def recording_transform(seen, interrupt_at=None):
+    def transform(document):
+        if interrupt_at is not None and len(seen) + 1 == interrupt_at:
+            raise Interrupted()
+        seen.append(document["_id"])
+        return {"doubled": document["n"] * 2}
+    return transform
+
+async def migrate(transform):
+    return await server.migrate_collection(
+        COLLECTION, VERSION, "double n", transform, batch_size=BATCH_SIZE, throttle_ms=0
+    )
+
+async def state():
+    return await server.db.schema_migrations.find_one({"collection": COLLECTION, "version": VERSION}, {"_id": 0})
+
+async def test_interrupted_run() -> bool:
+    print_separator("INTERRUPTED RUN")
+    result = await server.db[COLLECTION].insert_many([{"n": n} for n in range(DOCUMENTS)])
+    ids = sorted(result.inserted_ids)
+    seen = []
+    try:
+        await migrate(recording_transform(seen, interrupt_at=INTERRUPT_AT))
+        print("❌ The first run was expected to be interrupted")
+        return False
+    except Interrupted:
+        pass
+    # Записаны только целые пачки до обрыва
+    done = (INTERRUPT_AT - 1) // BATCH_SIZE * BATCH_SIZE
+    current = await state()
+    print(f"State after the interruption: {current}")
+    if current["status"] != "running" or current["last_id"] != ids[done - 1] or current["migrated"] != done:
+        print(f"❌ Expected a running migration with {done} documents done up to {ids[done - 1]}")
+        return False
+    print(f"✅ Progress recorded up to document {done}")
+
+    print_separator("RESUMED RUN")
+    seen = []
+    result = await migrate(recording_transform(seen))
+    print(f"Result: {result}")
+    if seen != ids[done:]:
+        print(f"❌ Resumed run read {len(seen)} documents, expected the {DOCUMENTS - done} after last_id")
+        return False
+    if result["status"] != "completed" or result["migrated"] != DOCUMENTS or result["remaining"]:
+        print("❌ Resumed run did not complete the migration")
+        return False
+    documents = await server.db[COLLECTION].find({}, {"_id": 0}).sort("n", 1).to_list(None)
+    if documents != [{"n": n, "doubled": n * 2, "schema_version": VERSION} for n in range(DOCUMENTS)]:
+        print(f"❌ Unexpected documents after the migration: {documents}")
+        return False
+    print("✅ Resumed after last_id and migrated every document once")
+    return True
+
+async def test_rerun() -> bool:
+    print_separator("RERUN")
+    before = await server.db[COLLECTION].find({}).sort("_id", 1).to_list(None)
+    seen = []
+    result = await migrate(recording_transform(seen))
+    print(f"Result: {result}")
+    after = await server.db[COLLECTION].find({}).sort("_id", 1).to_list(None)
+    if seen or after != before:
+        print(f"❌ Rerun touched {len(seen)} documents")
+        return False
+    if result["status"] != "completed" or result["migrated"] != DOCUMENTS:
+        print("❌ Rerun changed the recorded migration state")
+        return False
+    print("✅ Rerun is a no-op")
+    return True
+
+def test_client_fallbacks() -> bool:
+    print_separator("CLIENT AMOUNT FALLBACKS")
+    legacy = {"total_amount": 50000, "purchase_amount": None}
+    server.migrated_collections.discard("clients")
+    amounts = server.stored_client_amounts(legacy)
+    if amounts["debt_amount"] != 50000 or amounts["purchase_amount"] != 50000:
+        print(f"❌ Pending clients v1 should fall back to total_amount, got {amounts}")
+        return False
+    print("✅ Fallbacks apply while clients v1 is not completed")
+    server.migrated_collections.add("clients")
+    try:
+        if server.stored_client_amounts(legacy) is not legacy:
+            print("❌ Completed clients v1 should read stored amounts as they are")
+            return False
+    finally:
+        server.migrated_collections.discard("clients")
+    print("✅ Stored amounts are read directly once clients v1 is completed")
+    return True
+
+async def main() -> int:
+    try:
+        success = await test_interrupted_run() and await test_rerun() and test_client_fallbacks()
+    finally:
+        await server.db.drop_collection(COLLECTION)
+        await server.db.schema_migrations.delete_many({"collection": COLLECTION})
+        server.client.close()
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
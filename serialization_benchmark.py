@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Response serialization cost of /api/clients and /api/dashboard, old path vs fast path.
+
+The old path is what the endpoints did before: build ``Client`` models from the
+documents, let FastAPI validate them against ``response_model`` (or run
+``jsonable_encoder`` for the dashboard) and render with the stdlib json module.
+The fast path is ``client_from_db`` + orjson. Documents are synthetic, so no
+database is needed; the server module only has to be importable:
+
+    MONGO_URL=mongodb://localhost:27017 DB_NAME=crm_bench MONGO_TLS=false python serialization_benchmark.py
+"""
+import argparse
+import json
+import sys
+import time
+import uuid
+from datetime import datetime, date, timedelta
+from typing import List
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from backend import server
+
+def print_separator(title):
+    """Print a separator with a title for better readability"""
+    print("\n" + "="*80)
+    print(f" {title} ".center(80, "="))
+    print("="*80 + "\n")
+
+def make_client_documents(count, months):
+    """Documents shaped like what find() returns for stored clients (amounts in kopecks)"""
+    start = date(2024, 1, 1)
+    documents = []
+    for i in range(count):
+        schedule = [
+            {
+                "payment_date": (start + timedelta(days=30 * (m + 1))).strftime("%Y-%m-%d"),
+                "amount": 100000,
+                "status": "paid" if m < months // 2 else "pending",
+                "paid_date": None,
+            }
+            for m in range(months)
+        ]
+        documents.append({
+            "client_id": str(uuid.uuid4()),
+            "capital_id": "benchmark",
+            "name": f"Клиент {i}",
+            "product": "Телефон",
+            "purchase_amount": 100000 * months,
+            "debt_amount": 100000 * months,
+            "monthly_payment": 100000,
+            "client_phone": "+7 900 000 00 00",
+            "start_date": start.strftime("%Y-%m-%d"),
+            "end_date": schedule[-1]["payment_date"],
+            "schedule": schedule,
+            "status": "active",
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow(),
+        })
+    return documents
+
+def make_dashboard(documents):
+    buckets = [
+        {"client": {field: doc.get(field) for field in server.DASHBOARD_CLIENT_FIELDS}, "payment": doc["schedule"][-1]}
+        for doc in documents[:200]
+    ]
+    return {"today": buckets, "tomorrow": buckets, "overdue": buckets, "all_clients": documents}
+
+def clients_old(documents, adapter):
+    models = [server.Client(**doc) for doc in documents]
+    # FastAPI validates the return value against response_model, then dumps it
+    validated = adapter.validate_python(models)
+    return json.dumps(adapter.dump_python(validated, mode="json"), ensure_ascii=False).encode()
+
+def clients_fast(documents):
+    return orjson.dumps([server.client_from_db(doc) for doc in documents])
+
+def dashboard_old(dashboard):
+    return json.dumps(jsonable_encoder(dashboard), ensure_ascii=False).encode()
+
+def dashboard_fast(dashboard):
+    content = dict(dashboard, all_clients=[server.client_from_db(doc) for doc in dashboard["all_clients"]])
+    return orjson.dumps(content)
+
+def measure(func, *args, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), len(body)
+
+def compare(title, old, fast, repeat):
+    print_separator(title)
+    old_time, old_size = measure(*old, repeat=repeat)
+    fast_time, fast_size = measure(*fast, repeat=repeat)
+    print(f"old path:  {old_time * 1000:8.1f} ms, {old_size} bytes")
+    print(f"fast path: {fast_time * 1000:8.1f} ms, {fast_size} bytes")
+    speedup = old_time / fast_time
+    print(f"{'✅' if speedup > 1 else '❌'} speedup x{speedup:.1f}")
+    return speedup > 1
+
+def main(args):
+    documents = make_client_documents(args.clients, args.months)
+    adapter = TypeAdapter(List[server.Client])
+    ok = compare(
+        f"/api/clients: {args.clients} clients x {args.months} installments",
+        (clients_old, documents, adapter),
+        (clients_fast, documents),
+        args.repeat,
+    )
+    dashboard = make_dashboard(documents)
+    ok = compare(
+        "/api/dashboard",
+        (dashboard_old, dashboard),
+        (dashboard_fast, dashboard),
+        args.repeat,
+    ) and ok
+    server.client.close()
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=5000)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=5)
+    sys.exit(main(parser.parse_args()))
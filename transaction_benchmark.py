@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Throughput of compound writes with and without multi-document transactions.
+
+Runs the same unit of work the expense endpoint performs (debit the capital,
+insert the expense, update capital_stats) through ``run_in_transaction`` with
+transactions on and off. Needs a replica set, e.g. a single-node one:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 && mongosh --eval 'rs.initiate()'
+    MONGO_URL=mongodb://localhost:27017 DB_NAME=crm_bench MONGO_TLS=false python transaction_benchmark.py
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from backend import server
+
+def print_separator(title):
+    """Print a separator with a title for better readability"""
+    print("\n" + "="*80)
+    print(f" {title} ".center(80, "="))
+    print("="*80 + "\n")
+
+async def setup_capitals(count):
+    capital_ids = []
+    for _ in range(count):
+        capital = server.Capital(name="Benchmark capital", balance=10 ** 9, owner_id="benchmark_user")
+        await server.db.capitals.insert_one(capital.dict())
+        await server.db.capital_stats.insert_one(server.empty_capital_stats(capital.id))
+        capital_ids.append(capital.id)
+    return capital_ids
+
+async def cleanup(capital_ids):
+    await server.db.expenses.delete_many({"capital_id": {"$in": capital_ids}})
+    await server.db.capital_stats.delete_many({"capital_id": {"$in": capital_ids}})
+    await server.db.capitals.delete_many({"id": {"$in": capital_ids}})
+
+async def record_expense(capital_id, session):
+    expense = server.Expense(capital_id=capital_id, amount=1.0, description="Benchmark expense")
+    await server.debit_capital(capital_id, expense.amount, session=session)
+    await server.db.expenses.insert_one(expense.dict(), session=session)
+    await server.apply_stats_delta(capital_id, {"total_expenses": expense.amount}, session=session)
+
+async def run_mode(capital_ids, operations, concurrency, transactional):
+    server._transactions_supported = transactional
+    queue = asyncio.Queue()
+    for i in range(operations):
+        queue.put_nowait(capital_ids[i % len(capital_ids)])
+
+    async def worker():
+        while not queue.empty():
+            capital_id = queue.get_nowait()
+            await server.run_in_transaction(lambda session: record_expense(capital_id, session))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return operations / elapsed, elapsed
+
+async def main(args):
+    hello = await server.client.admin.command("hello")
+    if "setName" not in hello:
+        print("❌ MongoDB is standalone, transactions need a replica set")
+        return 1
+
+    capital_ids = await setup_capitals(args.capitals)
+    results = {}
+    try:
+        for transactional in (False, True):
+            mode = "transactional" if transactional else "plain"
+            print_separator(f"{mode.upper()} WRITES")
+            throughput, elapsed = await run_mode(capital_ids, args.operations, args.concurrency, transactional)
+            results[mode] = throughput
+            print(f"{args.operations} operations in {elapsed:.2f}s: {throughput:.0f} ops/s")
+    finally:
+        await cleanup(capital_ids)
+        server.client.close()
+
+    print_separator("SUMMARY")
+    overhead = 1 - results["transactional"] / results["plain"]
+    print(f"Transactions cost {overhead:.1%} of plain throughput")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--operations", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--capitals", type=int, default=10, help="fewer capitals means more write conflicts")
+    sys.exit(asyncio.run(main(parser.parse_args())))
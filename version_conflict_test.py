@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+import requests
+import uuid
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# Get the backend URL from the frontend .env file
+BACKEND_URL = None
+try:
+    with open('/app/frontend/.env', 'r') as f:
+        for line in f:
+            if line.startswith('REACT_APP_BACKEND_URL='):
+                BACKEND_URL = line.strip().split('=')[1].strip('"\'')
+                break
+except Exception as e:
+    print(f"Error reading .env file: {e}")
+    sys.exit(1)
+
+if not BACKEND_URL:
+    print("Could not find REACT_APP_BACKEND_URL in .env file")
+    sys.exit(1)
+
+API_URL = f"{BACKEND_URL}/api"
+print(f"Using API URL: {API_URL}")
+
+# Unique user so the test never touches real data
+TEST_USER_ID = f"test_user_version_{uuid.uuid4()}"
+
+headers = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {TEST_USER_ID}"
+}
+
+MONTHS = 12
+
+def print_separator(title):
+    """Print a separator with a title for better readability"""
+    print("\n" + "="*80)
+    print(f" {title} ".center(80, "="))
+    print("="*80 + "\n")
+
+def test_stale_update(client):
+    """A write based on an old version gets 409 with the current client"""
+    print_separator("TESTING STALE CLIENT UPDATE")
+
+    url = f"{API_URL}/clients/{client['client_id']}"
+    version = client["version"]
+    first = requests.put(url, headers=headers, json={"name": "Operator A", "version": version})
+    if first.status_code != 200 or first.json()["version"] != version + 1:
+        print(f"❌ First update failed: {first.status_code} - {first.text}")
+        return False
+    print(f"✅ First update accepted, version {version} -> {first.json()['version']}")
+
+    second = requests.put(url, headers=headers, json={"name": "Operator B", "version": version})
+    if second.status_code != 409:
+        print(f"❌ Stale update returned {second.status_code} - {second.text}")
+        return False
+    current = second.json()["current"]
+    if current["name"] != "Operator A" or current["version"] != version + 1:
+        print(f"❌ 409 does not carry the current client: {current}")
+        return False
+    print("✅ Stale update rejected with 409 and the current client")
+
+    third = requests.put(url, headers=headers, json={"name": "Operator B", "version": current["version"]})
+    if third.status_code != 200:
+        print(f"❌ Retried update failed: {third.status_code} - {third.text}")
+        return False
+    print("✅ Update based on the current version accepted")
+    return True
+
+def test_concurrent_installments(client):
+    """Status changes of different installments of one client must all persist"""
+    print_separator("TESTING CONCURRENT INSTALLMENT UPDATES")
+
+    dates = [entry["payment_date"] for entry in client["schedule"]]
+    def mark_paid(payment_date):
+        return requests.put(f"{API_URL}/clients/{client['client_id']}/payments/{payment_date}",
+                            headers=headers, json={"status": "paid"})
+    with ThreadPoolExecutor(max_workers=len(dates)) as pool:
+        responses = list(pool.map(mark_paid, dates))
+    if any(r.status_code != 200 for r in responses):
+        print("❌ Some status updates failed")
+        return False
+
+    stored = requests.get(f"{API_URL}/clients/{client['client_id']}", headers=headers).json()
+    unpaid = [entry["payment_date"] for entry in stored["schedule"] if entry["status"] != "paid"]
+    if unpaid:
+        print(f"❌ Lost updates for installments {unpaid}")
+        return False
+    if stored["version"] < client["version"] + len(dates):
+        print(f"❌ Version did not grow with every write: {stored['version']}")
+        return False
+    print(f"✅ All {len(dates)} installments paid, version {stored['version']}")
+    return True
+
+if __name__ == "__main__":
+    response = requests.post(f"{API_URL}/capitals", headers=headers, json={
+        "name": "Version test capital",
+        "balance": 100000.0
+    })
+    if response.status_code != 200:
+        print(f"❌ Error creating capital: {response.status_code} - {response.text}")
+        sys.exit(1)
+    capital_id = response.json()["id"]
+
+    try:
+        response = requests.post(f"{API_URL}/clients", headers=headers, json={
+            "capital_id": capital_id,
+            "name": "Version Test Client",
+            "product": "Test product",
+            "purchase_amount": 10000.0,
+            "debt_amount": 12000.0,
+            "monthly_payment": 1000.0,
+            "start_date": "2024-01-15",
+            "months": MONTHS
+        })
+        response.raise_for_status()
+        client = response.json()
+        success = test_stale_update(client)
+        client = requests.get(f"{API_URL}/clients/{client['client_id']}", headers=headers).json()
+        success = success and test_concurrent_installments(client)
+    finally:
+        requests.delete(f"{API_URL}/capitals/{capital_id}", headers=headers)
+    sys.exit(0 if success else 1)